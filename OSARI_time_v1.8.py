@@ -31,16 +31,26 @@ Input:
     
 Output:
     
-    4 output files in format:
+    8 output files in format:
         OSARI_ExpH_123_OSARI_2020_Jul_19_1307.log
         OSARI_ExpH_123_OSARI_2020_Jul_19_1307.csv
         OSARI_ExpH_123_OSARI_2020_Jul_19_1307.psydat
         OSARI_ExpH_123_OSARI_2020_Jul_19_1307.txt
+        OSARI_ExpH_123_OSARI_2020_Jul_19_1307.osari
+        OSARI_ExpH_123_OSARI_2020_Jul_19_1307.schedule
+        OSARI_ExpH_123_OSARI_2020_Jul_19_1307.phases
+        OSARI_ExpH_123_OSARI_2020_Jul_19_1307.timing
     
     For details on psydat and log files see 
         https://www.psychopy.org/general/dataOutputs.html#:~:text=PsychoPy%20data%20file%20(.-,psydat),python%20and%2C%20probably%2C%20matplotlib.
     
     Data is contained in the .txt and .csv files. The .txt file saves the main details of interest but csv stores further details.
+    The .osari file is a binary copy of the .txt data and the task settings for fast loading (see osari_binary.py).
+    The .schedule file holds the trial order of the session and the seed it was made from (see osari_schedule.py).
+    The .phases file has the wall clock and CPU time spent in each phase of every trial, and the .timing
+    file a report of them (percentiles and histograms per phase) (see osari_timing.py).
+    With the 'psi' method a .psi file has the posterior summary after every test stop trial (see osari_psi.py).
+    With interleaved staircases a .staircases file has the SSD, reversals and converged SSD of each (see osari_staircase.py).
     
     Block: block number
 
@@ -72,6 +82,21 @@ import sys  # to get file system encoding
 import pyglet
 import math
 from psychopy.hardware import keyboard
+import osari_binary
+import osari_ringlog
+import osari_schedule
+import osari_conditions
+import osari_config
+import osari_latency
+import osari_media
+import osari_monitor
+import osari_records
+import osari_sink
+import osari_stats
+import osari_staircase
+import osari_stimuli
+import osari_timing
+import osari_trial
 _thisDir = os.path.dirname(os.path.abspath(__file__))
 os.chdir(_thisDir)
 
@@ -89,11 +114,22 @@ expInfo={'Participant ID':0000,
         'Age (Years)':00,
         'Sex':['F', 'M', 'Prefer not to say'],
         'Default parameters?':True}
+#OSARI_time_v1.8_IL.py runs this script with TEXT_IDS set: the Participant ID and age are typed
+#as text in the dialog, so IDs such as "007" or "P12" are kept as they are
+if globals().get('TEXT_IDS'):
+    expInfo['Participant ID'], expInfo['Age (Years)'] = '0000', '00'
 expName='OSARI'
-dlg=gui.DlgFromDict(dictionary=expInfo, title='Participant Information',
-    tip={'Default parameters?':
-        'This will run the task with no additional options'})
-if dlg.OK ==False: core.quit()
+#Started with --config (see osari_config.py) the settings come from a config file and the participant
+#from the command line or a queue file, and no dialogs are shown
+config=osari_config.from_command_line(sys.argv[1:])
+if config is None:
+    dlg=gui.DlgFromDict(dictionary=expInfo, title='Participant Information',
+        tip={'Default parameters?':
+            'This will run the task with no additional options'})
+    if dlg.OK ==False: core.quit()
+else:
+    expInfo['Sex']='Prefer not to say'
+    expInfo.update(config['expInfo'])
 expInfo['date'] = data.getDateStr()
 
 # Task Information
@@ -102,7 +138,7 @@ expInfo['date'] = data.getDateStr()
 taskInfo_brief={'Practice trials': True,
                 'Count down':True,
                 'Trial by trial feedback':True,
-                'Method':['staircase', 'fixed'],
+                'Method':['staircase', 'fixed', 'psi'],
                 'Trial order':['random', 'sequential'],
                 'Step size (s)':0.025,
                 'Lowest SSD (s)':0.05,
@@ -113,12 +149,17 @@ taskInfo_brief={'Practice trials': True,
                 'Full Screen':True}
 
 #Check if user ticked for use of default parameters. If not present in depth task parameter options.
-if not expInfo['Default parameters?']:
+if config is not None:
+    #the defaults, with the settings of the config file
+    taskInfo_brief['Trial order']='random'
+    taskInfo_brief['Method']='staircase'
+    taskInfo_brief.update(config.get('taskInfo_brief', {}))
+elif not expInfo['Default parameters?']:
     dlg=gui.DlgFromDict(dictionary=taskInfo_brief, title='Experiment Parameters',
         tip={
         'Count down':'Do you want a countdown before the bar starts filling?',
         'Trial by trial feedback':'Do you want participants to receive trial to trial feedback',
-        'Method':'What SSD method do you want?',
+        'Method':'What SSD method do you want? [psi chooses each SSD from a Bayesian estimate of the inhibition function, see osari_psi.py]',
         'Trial order':'Do you want trials to be in a random order or in the order you have set in the conditions .csv file [sequential]',
         'Step size (s)':'What do you want the step size to be in ms - e.g., 0.025 is 25ms',
         'Lowest SSD (s)':'The lowest the SSD can go in ms - e.g., 0.05 is 5ms',
@@ -133,32 +174,51 @@ else:
     taskInfo_brief['Trial order']='random'
     taskInfo_brief['Method']='staircase'
 
-# "Bar_top" is how many cm above the centre of the screen (x = 0 y = 0) the top of the bar will be drawn.
-Bar_top=taskInfo_brief['Total bar height (in cm)']/2
-
-# "Target_pos" is where the target line will be drawn. This is currently hard coded as 80%
-# of the total bar length (i.e. total bar height is multiplied by .8)
-Target_pos=(.8*taskInfo_brief['Total bar height (in cm)'])-Bar_top
-
 # Additional parameters beyond "taskInfo_brief" can be set here (but not in GUI)
-taskInfo={'Bar base below fixation (cm)':Bar_top,
+taskInfo={'Bar base below fixation (cm)':None, # None - from the bar height, see below
           'Bar width (cm)':3,
-          'Bar top above fixation (cm)':Bar_top,
+          'Bar top above fixation (cm)':None, # None - from the bar height
           'Target line width (cm)':5,
-          'Target line above fixation (cm)':Target_pos,
+          'Target line above fixation (cm)':None, # None - at 80% of the bar
           'rise velocity (cm/sec)':15,
           'StopS start pos. (ms)':500,
           'trial length (max trial duration in seconds)':1,
-          'StopS start pos. (seconds)':.5} 
+          'StopS start pos. (seconds)':.5,
+          'Warm start SSD':False, # True - start the staircase where this participant's last session converged (see osari_staircase.py)
+          'Staircases':None, # e.g. [{'start':.3}, {'start':.7, 'up':2}] - interleaved staircases, chosen by the 'Staircase' column of the conditions (see osari_staircase.py)
+          'Schedule seed':None, # seed for the trial order - None draws a new one, which is saved in the .schedule file
+          'Max stop trials in a row':None, # e.g. 3 - only used with a random trial order
+          'No stop trial first':False, # True - no block starts with a stop trial (random trial order only)
+          'Conditions spec':None, # e.g. 'TestConditionsSpec.json' - test blocks from a spec instead of TestConditions.csv (see osari_conditions.py)
+          'Monitor port':None, # e.g. 8765 - follow the session in a browser at http://127.0.0.1:8765/ (see osari_monitor.py)
+          'Collector':None, # e.g. '192.168.0.10:8766' - also send the results to an osari_collector.py (see osari_sink.py)
+          'Timing report':True, # time each phase of every trial and write the .phases and .timing files (see osari_timing.py)
+          'Profile bar rise':False, # also run the bar rise under cProfile every 10th trial (listed in the .timing report)
+          'End video':'Stimuli/Astronaught_floss_test.mp4', # played at the end if it is there, None for none (see osari_media.py)
+          'Alerts':None} # e.g. {'no response':3, 'stuck staircase':None} - change the in-session alerts (see osari_stats.py)
+#any of these can be set in a config file too (see osari_config.py)
+if config is not None:
+    taskInfo.update(config.get('taskInfo', {}))
+
+# The quantities that follow from the settings, computed once (see osari_config.derived):
+# "Bar_top" is how many cm above the centre of the screen (x = 0 y = 0) the top of the bar will be drawn.
+# "Target_pos" is where the target line will be drawn. This is currently hard coded as 80%
+# of the total bar length (i.e. total bar height is multiplied by .8, osari_config.TARGET)
+# "Target_time" is the time taken to get to the target line i.e. 80% of the total trial time
+derived=osari_config.derived(taskInfo_brief, taskInfo)
+Bar_top=derived['Bar_top']
+Target_pos=derived['Target_pos']
+Target_time=derived['Target_time']
+for name, value in (('Bar base below fixation (cm)', Bar_top), ('Bar top above fixation (cm)', Bar_top),
+                    ('Target line above fixation (cm)', Target_pos)):
+    if taskInfo[name] is None:
+        taskInfo[name]=value
 
 # "trial_length" is the max duration of a trial in seconds i.e. the amount of time it
 # takes the filling bar to fill to the top.
 trial_length=taskInfo['trial length (max trial duration in seconds)']
 bar_height = taskInfo_brief['Total bar height (in cm)']
 
-#The time taken to get to the target line i.e. 80% of the total trial time
-Target_time=(.8*taskInfo['trial length (max trial duration in seconds)'])
-
 # --------------------------------------------------------------
 #                     Hardware parameters
 # This section presents users with options for hardware
@@ -211,25 +271,42 @@ frame_dur=1000/expInfo['frameRate'] #"frame_dur" = the duration of a single fram
 #print out useful info on frame rate for the interested user
 print('Monitor frame rate is %s' %(expInfo['frameRate']))
 
-stoptime=taskInfo['StopS start pos. (seconds)']
-stepsize = taskInfo_brief['Step size (s)']
-upper_ssd = taskInfo_brief['Highest SSD (s)']
-lower_ssd = taskInfo_brief['Lowest SSD (s)']
+#Start the staircase at the SSD this participant's last session converged to, from their
+#file in data/participants (made from their earlier sessions the first time, see osari_staircase.py)
+taskInfo['Start SSD source']='default'
+if taskInfo['Warm start SSD']:
+    taskInfo['StopS start pos. (seconds)'], taskInfo['Start SSD source'] = osari_staircase.warm_start(
+        _thisDir + os.sep + 'data', expInfo['Participant ID'], taskInfo['StopS start pos. (seconds)'],
+        taskInfo_brief['Lowest SSD (s)'], taskInfo_brief['Highest SSD (s)'])
+    print('Start SSD %s s from %s' % (taskInfo['StopS start pos. (seconds)'], taskInfo['Start SSD source']))
 
 #Use experiment handler with 2 loops, a practice loop and a main trial loop
 Output_ExpH = _thisDir + os.sep + u'data/s_%s_%s_%s' % (expInfo['Participant ID'],
     expName, expInfo['date'])
+extraInfo = dict(expInfo, **taskInfo_brief) #this will save the participant info and all of the user input for task info brief - might want also the full task info
+#and where the staircase started
+extraInfo['StopS start pos. (seconds)'] = taskInfo['StopS start pos. (seconds)']
+extraInfo['Start SSD source'] = taskInfo['Start SSD source']
 thisExp = data.ExperimentHandler(
     name = 'OSARI', version = '1.73',
-    extraInfo = taskInfo_brief, #this will save all of the user input for task info brief - might want also the full task info
+    extraInfo = extraInfo,
         savePickle=True, saveWideText=True,
     dataFileName = Output_ExpH, autoLog = True)
-# save a log file for detail verbose info
-logFile = logging.LogFile(Output_ExpH+'.log', level=logging.DEBUG)
 logging.console.setLevel(logging.WARNING)  # this outputs to the screen, not a file
+# save a log file for detail verbose info - records are kept in a ring buffer and written
+# by a background thread and during the ISI, so the DEBUG logging doesn't hold up the flips
+# (see osari_ringlog.py)
+logFile = osari_ringlog.RingLog(Output_ExpH+'.log', level=logging.DEBUG)
+logFile.install(logging)
 
 #Input files that are used to create the trial list at the start of each block
-conditions = data.importConditions('TestConditions.csv') #conditions file for the 'main trials'
+if taskInfo['Conditions spec']:
+    #the test blocks are described by a spec (trial counts, stop proportion ...) and the trials are made as they are run
+    test_blocks = osari_conditions.load_spec(taskInfo['Conditions spec'])
+    taskInfo_brief['Number of Test Blocks'] = len(test_blocks)
+else:
+    conditions = data.importConditions('TestConditions.csv') #conditions file for the 'main trials'
+    test_blocks = [('testBlocks', conditions)]*taskInfo_brief['Number of Test Blocks']
 practiceGoConditions = data.importConditions('practiceGoConditions.csv') #conditions file for the 'practice go trials'
 practiceMixedConditions = data.importConditions('practiceMixedConditions.csv') #conditions file for the 'practice go and stop trials'
 
@@ -240,6 +317,32 @@ else:
     prac_block_n=0
     n_blocks = taskInfo_brief['Number of Test Blocks']
 
+#The trial order of the whole session is made here, before the first trial, from the conditions
+#files, a seed and the constraints in "taskInfo" (see osari_schedule.py) and saved with the data
+schedule_blocks=[('testBlocks', block_conditions, 1) for _, block_conditions in test_blocks] # all test blocks run as 'testBlocks'
+if taskInfo_brief['Practice trials']:
+    schedule_blocks=[('practiceGoTrials', practiceGoConditions, 1), ('practiceMixedTrials', practiceMixedConditions, 1)]+schedule_blocks
+schedule = osari_schedule.make_schedule(schedule_blocks, seed=taskInfo['Schedule seed'], method=taskInfo_brief['Trial order'],
+    constraints={'column':'Signal', 'value':1, 'max_run':taskInfo['Max stop trials in a row'], 'not_first':taskInfo['No stop trial first']})
+taskInfo['Schedule seed'] = schedule.seed
+if taskInfo_brief['Method']=='staircase' and taskInfo['Staircases']:
+    #every 'Staircase' of the conditions has to be one of the staircases (see osari_staircase.py)
+    osari_staircase.check_schedule(schedule, len(taskInfo['Staircases']))
+schedule.save(Output_ExpH+osari_schedule.EXTENSION)
+
+#Live experimenter monitor, served from a background thread
+monitor = None
+if taskInfo['Monitor port']:
+    monitor = osari_monitor.Monitor(port=taskInfo['Monitor port'])
+    print('Experimenter monitor at %s' % monitor.url)
+
+#Optional copy of the results sent to a collector - anything that can't be sent is kept in data/spool
+sink = None
+if taskInfo['Collector']:
+    sink = osari_sink.Sink(taskInfo['Collector'], session=os.path.basename(Output_ExpH),
+        spool_dir=_thisDir + os.sep + 'data' + os.sep + 'spool')
+    sink.post_session({'expInfo':expInfo, 'taskInfo_brief':taskInfo_brief, 'taskInfo':taskInfo})
+
 #An "outerLoop" that corresponds to blocks, we use this loop to repeat sets of trials however many times we want
 outerLoop = data.TrialHandler(trialList=[], nReps=n_blocks, name = 'Block')#note: nReps also includes our 2 practice blocks
 
@@ -300,7 +403,6 @@ correctstop=visual.TextStim(win, pos=[-8, 0], height=1, color=[1,1,1],
 wrongKey=visual.TextStim(win, pos=[-8, 0], height=1, color=[1,1,1],
     text="WrongKey - Please press the space key", units='cm' )
 countdown_clock=core.Clock()
-number_text = visual.TextStim(win, pos=[0, Target_pos],height=1, color=[-1,-1,-1], text="1", units='cm')
 
 # -------------------- Countdown--------------------------------
 # --------------------------------------------------------------
@@ -308,9 +410,10 @@ number_text = visual.TextStim(win, pos=[0, Target_pos],height=1, color=[-1,-1,-1
 def countdown():
     countdown_clock.reset()
     keydown=0
+    shown=None # the number on the screen - we only draw and flip when it changes
     while int(countdown_clock.getTime())<4:
         remainingKeys = kb.getKeys(keyList=['space', 'escape'], waitRelease=False, clear=False)
-        number_text.text="%s"%(3-int(countdown_clock.getTime()))
+        number=3-int(countdown_clock.getTime())
         if remainingKeys:# if a key was pressed <------------------------make this specific to space once integrates
             keydown=1
             for key in remainingKeys:
@@ -321,61 +424,53 @@ def countdown():
                     kb.clock.reset() #reset the keyboard clock
                     TooSoon_text.draw() #tell the participant they lifted their finger too soon (during the countdown)
                     win.flip() # draw the "too soon" message
-                    k = event.waitKeys() # wait for the key to be pressed again
+                    k = osari_timing.wait_keys() # wait for the key to be pressed again
                     if k[0]=='escape':#make sure the user can still quit in this loop
                         print('User pressed escape, quiting now')
                         win.close()
                         core.quit()
                     countdown_clock.reset() # reset the countdown clock
+                    number=3
+                    shown=None
+        if number==shown:
+            # nothing has changed on the screen, sleep rather than redraw
+            osari_timing.idle()
+            continue
+        number_text.text="%s"%(number)
         Bar.draw()
         fillBar.draw()
         if taskInfo_brief['Spaceship']:
             Spaceship.draw()
         targetArrowRight.draw()
         targetArrowLeft.draw()
-        if int(countdown_clock.getTime())<3:
+        if number>0:
             number_text.draw()
         win.flip()
+        shown=number
 
 # ----------------- Filling bar---------------------------------
 # --------------------------------------------------------------
-# Specify the filling and static bar
-bar_width_vert1=0-(taskInfo['Bar width (cm)']/2)
-bar_width_vert2=(taskInfo['Bar width (cm)']/2)
+# The filling bar, static bar, target arrows and spaceship are made in
+# osari_stimuli.py, which the render benchmark (osari_benchmark.py) uses too
+stimuli = osari_stimuli.make_stimuli(win, taskInfo_brief, taskInfo)
 
 # "vert" = vertices (corners) of filling bar in x y coordinates ([0, 0] = centre)
-vert = [(bar_width_vert1,0-taskInfo['Bar base below fixation (cm)']), (bar_width_vert1,0-taskInfo['Bar base below fixation (cm)']+.01),
-        (bar_width_vert2,0-taskInfo['Bar base below fixation (cm)']+.01), (bar_width_vert2,0-taskInfo['Bar base below fixation (cm)'])]
-
+vert = stimuli['vert']
 original_vert=vert
-
-fillBar= visual.ShapeStim(win, fillColor='skyblue', lineWidth=0, opacity=1, units='cm', vertices=vert)
+fillBar = stimuli['fillBar']
 
 # ------------------ Static bar---------------------------------
 # --------------------------------------------------------------
 # "fullvert" = vertices of the static background bar
-fullvert = [(bar_width_vert1,0-taskInfo['Bar base below fixation (cm)']),
-            (bar_width_vert1,taskInfo['Bar top above fixation (cm)']),
-            (bar_width_vert2,taskInfo['Bar top above fixation (cm)']),
-            (bar_width_vert2,0-taskInfo['Bar base below fixation (cm)'])]
-
-Bar = visual.ShapeStim(win, vertices=fullvert, fillColor='white', lineWidth=0, opacity=1, units='cm')
+fullvert = stimuli['fullvert']
+Bar = stimuli['Bar']
 
 # ------------------ Target line--------------------------------
 # --------------------------------------------------------------
-
-# Specify the target width
-
-target_width = 0.5
-
-# Vertices of the target arrows
-targetArrowRightvert = [(1.5,Target_pos),
-        (1.5+target_width,Target_pos+(target_width/np.sqrt(3))),(1.5+target_width,Target_pos-(target_width/np.sqrt(3)))]
-targetArrowRight = visual.ShapeStim(win, vertices=targetArrowRightvert, fillColor='yellow', lineWidth=0, opacity=1, units='cm')
-
-targetArrowLeftvert = [(-1.5-target_width,Target_pos+(target_width/np.sqrt(3))),(-1.5-target_width,Target_pos-(target_width/np.sqrt(3))),
-        (-1.5,Target_pos)]
-targetArrowLeft = visual.ShapeStim(win, vertices=targetArrowLeftvert, fillColor='yellow', lineWidth=0, opacity=1, units='cm')
+targetArrowRight = stimuli['targetArrowRight']
+targetArrowLeft = stimuli['targetArrowLeft']
+# the countdown digit, drawn on the target line
+number_text = stimuli['number_text']
 
 # ---------------------- Spaceship (optional) ------------------
 # --------------------------------------------------------------
@@ -384,7 +479,7 @@ targetArrowLeft = visual.ShapeStim(win, vertices=targetArrowLeftvert, fillColor=
 #How high is the spaceship in cm (set the position to be the
 Spaceship_height_cm=2
 #set it so that the line in the middle of the spaceship should eventually line up with the targetline
-Spaceship=visual.ImageStim(win, image='Stimuli'+os.sep+'SpaceShip_scaled.png', pos=(0, vert[2][1]), units='cm')
+Spaceship = stimuli['Spaceship']
 Spaceship_practice_im=visual.ImageStim(win, image='Stimuli'+os.sep+'Practice_Image.png', pos=(10, 0), units='cm')
 
 # --------------------------------------------------------------
@@ -394,16 +489,25 @@ Spaceship_practice_im=visual.ImageStim(win, image='Stimuli'+os.sep+'Practice_Ima
 
 # --------------------------------------------------------------
 #Trial loop
-inc=0
 height = 0
-correct=[]
 
-#keep track of feedback to give individual feedback at the end
-feedback_list=[]
-correct_gos=0
-correct_StopSs=0
+#"trial_engine" moves the SSD (staircase or fixed) from trial to trial and decides the outcome
+#of each trial (see osari_trial.py, which can replay recorded sessions through the same logic).
+#It also keeps track of feedback to give individual feedback at the end (feedback_list, correct_gos, correct_StopSs)
+trial_engine=osari_trial.TrialEngine(taskInfo_brief, taskInfo)
+#"records" holds the results of every trial in a typed array made for the whole schedule; each trial
+#is written into its record and every output (.txt, csv, .osari, monitor, sink) reads it from there (see osari_records.py)
+records=osari_records.SessionRecords(len(schedule))
+#the columns of every trial in the csv (and .psydat)
+csv_columns=osari_records.csv_columns(staircases=trial_engine.staircases is not None)
+#"stats" keeps running statistics of the session (lift error, stop success, go omissions, SSD, reversals)
+#updated in constant time after every trial, warns about problems as they happen and gives the feedback
+#between blocks and at the end (see osari_stats.py)
+stats=osari_stats.SessionStats(Target_time, taskInfo['Alerts'], taskInfo_brief['Method'])
+#"phases" keeps the wall clock and CPU time spent in each phase of every trial (does nothing if the timing report is off)
+phases=osari_timing.Phases(enabled=taskInfo['Timing report'], profile=('bar rise',) if taskInfo['Profile bar rise'] else ())
+reward_video = osari_media.Preloader(_thisDir + os.sep + taskInfo['End video']) if taskInfo['End video'] else None
 
-count=0
 #"block_count" keeps track of how many blocks there have been
 block_count=0
 #"trial_count" keeps track of how many trials there have been
@@ -420,16 +524,16 @@ else:
     instr_image.draw()
 
 win.flip()
-core.wait(1)
+osari_timing.wait(1)
 
-#wait for button press
-event.waitKeys()
+#wait for button press (osari_timing waits sleep between checks for keys rather than keeping the CPU busy)
+osari_timing.wait_keys()
 
 #give warning practice
 if taskInfo_brief['Practice trials']:
     practice_prepare.draw()
     win.flip()
-    event.waitKeys()
+    osari_timing.wait_keys()
 
 ISI = 2
 # --------------------------------------------------------------
@@ -441,36 +545,36 @@ ISI = 2
 block_count=0 #blocks
 for block in outerLoop:
     print(block)
-    if block_count == 0 and taskInfo_brief['Practice trials']:
-        trials = data.TrialHandler(trialList = practiceGoConditions, nReps = 1, method = taskInfo_brief['Trial order'], name = 'practiceGoTrials',autoLog = True)
-    elif block_count ==1 and taskInfo_brief['Practice trials']:
-        trials = data.TrialHandler(trialList = practiceMixedConditions, nReps = 1, method = taskInfo_brief['Trial order'], name = 'practiceMixedTrials', autoLog = True)
-    else:
-        trials = trials = data.TrialHandler(trialList = conditions, nReps = 1, method = taskInfo_brief['Trial order'], name = 'testBlocks', autoLog = True)
-            #Note 1: nReps is the number of repetitions of the condition rows set in the 'practiceGoTrials', 'practiceMixedTrials' or 'TestConditions' file.
-            #Users can control the number of trials by increasing the number of rows per condition in the conditions file OR ...
-            #by changing the number of nReps. For example, if your conditions file has two rows (0 and 1), and your nReps is 3, you will have 6 trials
-            #We recommend users change the number of trials using the conditions file rather than nReps
-            #Note 2: method = 'random' randomly selects the conditions in the conditions files, you can also use 'sequential'
+    #the trials of this block in the order set by the schedule (practice go, practice mixed, then the test blocks)
+    trials = data.TrialHandler(trialList = list(schedule.trial_list(block_count)), nReps = 1, method = 'sequential', name = schedule.names[block_count], autoLog = True)
+            #Note 1: the number of trials is the number of rows in the 'practiceGoTrials', 'practiceMixedTrials' or 'TestConditions' file.
+            #We recommend users change the number of trials using the conditions file
+            #Note 2: the 'Trial order' option ('random' or 'sequential') is applied when the schedule is made, so the
+            #TrialHandler just runs the trials in the order it is given
     thisExp.addLoop(trials)
+    #feedback on the block that just ended, if the participant gets feedback
+    block_feedback = stats.block_feedback()+'\n\n' if taskInfo_brief['Trial by trial feedback'] and stats.block_feedback() else ''
+    #check and read the video for the end of the session in the background during the last block (see osari_media.py)
+    if block_count==n_blocks-1 and reward_video:
+        reward_video.start()
     if block_count>2 and taskInfo_brief['Practice trials']:
         #set message
         Blocks_completed = visual.TextStim(win, pos=[0, 0], height=1, color=[1,1,1],
-            text="Block %s of %s complete!!\n\nPress space when ready to continue!"%(block_count-prac_block_n, n_blocks-prac_block_n), units='cm')
+            text="Block %s of %s complete!!\n\n%sPress space when ready to continue!"%(block_count-prac_block_n, n_blocks-prac_block_n, block_feedback), units='cm')
         Blocks_completed.draw()
         win.flip()
-        core.wait(1)
+        osari_timing.wait(1)
         #wait for keypress
-        event.waitKeys()
+        osari_timing.wait_keys()
     elif not taskInfo_brief['Practice trials'] and block_count>0:
         #set message
         Blocks_completed = visual.TextStim(win, pos=[0, 0], height=1, color=[1,1,1],
-            text="Block %s of %s complete!!\n\nPress space when ready to continue!"%(block_count-prac_block_n, n_blocks-prac_block_n), units='cm')
+            text="Block %s of %s complete!!\n\n%sPress space when ready to continue!"%(block_count-prac_block_n, n_blocks-prac_block_n, block_feedback), units='cm')
         Blocks_completed.draw()
         win.flip()
-        core.wait(1)
+        osari_timing.wait(1)
         #wait for keypress
-        event.waitKeys()
+        osari_timing.wait_keys()
 
     #note what block we are on
     block_count=block_count+1
@@ -488,7 +592,10 @@ for block in outerLoop:
     trial_count=0
     for thisTrial in trials:
         trial_count=trial_count+1 #count trials
+        trial_index = records.new()
+        logFile.set_trial(trial_index) # log records from here on belong to this trial
 
+        phases.start('instructions')
         #Reset the colour of the target arrows
         targetArrowRight.fillColor='yellow'
         targetArrowLeft.fillColor='yellow'
@@ -504,7 +611,7 @@ for block in outerLoop:
                 win.flip()
 
                 #wait for key press
-                event.waitKeys()
+                osari_timing.wait_keys()
 
             elif trials.name == 'practiceMixedTrials':
 
@@ -514,24 +621,22 @@ for block in outerLoop:
                 win.flip()
 
                 #wait for key press
-                core.wait(3)
-                event.waitKeys()
-            if trials.name == 'testBlocks' and  ((taskInfo_brief['Practice trials'] and block_count==3) or (taskInfo_brief['Practice trials']==False and block_count==1)):
+                osari_timing.wait(3)
+                osari_timing.wait_keys()
+            if osari_trial.first_test_trial(trials.name, block_count, taskInfo_brief['Practice trials']):
 
                 #If this is the first main trial (i.e. the trial count is 1 more than the practice trials)
                 #ask the participant if they understand the task.
                 understand.draw()
 
                 #Reset the stop time so it doesn't carry over from the practice
-                stoptime=taskInfo['StopS start pos. (seconds)']
-
-                #Reset correct as well so that the loop to change stoptimes is not entered
-                correct=[]
+                #(and correct as well so that the loop to change stoptimes is not entered)
+                trial_engine.restart()
 
                 win.flip()
 
                 #wait for key press
-                UnderstandKey = event.waitKeys(keyList=['y','n'])
+                UnderstandKey = osari_timing.wait_keys(keyList=['y','n'])
 
                 #check if the user understood the task, if not ('n') quit the task
                 if UnderstandKey[0] == 'n':
@@ -552,46 +657,29 @@ for block in outerLoop:
         # ---------------------------------------------------------------
 
         #Find out if/where the rising bar should stop on this trial based on accuracy in previous
-        if not taskInfo_brief['Method']=='fixed':
-            if correct==-1 and round(stoptime,3) > round(lower_ssd,3):#if they incorrectly lifted on a StopS trial (checking success count allows us to check if the trial restarted)
-                stoptime=stoptime-stepsize
-            elif correct == -1 and round(stoptime,3) == round(lower_ssd,3):
-                stoptime = lower_ssd
-            elif correct ==2 and round(stoptime,3) < round(upper_ssd,3):#if they correctly stopped on the StopS trial
-                stoptime=stoptime+stepsize
-            elif correct == 2 and round(stoptime,3) == round(upper_ssd,3):# never equal floats in python. so we use round.
-                stoptime = upper_ssd
-
-        elif taskInfo_brief['Method']=='fixed':
-            stoptime=thisTrial['fixedStopTime']
-            print(stoptime)
-
-        #reset correct
-        correct=[]
-        #set the stop time based on if this is a 'Go' or 'Stop' trial
+        #(staircase), or from the conditions file ('fixed'), and reset correct.
+        #The stop time is the trial length if this is a 'Go' trial
         #if Signal = 0, then trial type = Go,
         #if Signal = 1, then trial type = Stop
-        #if this is a go trial, the stop time is the maximum trial time (i.e. time taken to fill bar)
+        this_stoptime = trial_engine.start(thisTrial)
+        if taskInfo_brief['Method']=='fixed':
+            print(trial_engine.stoptime)
         Signal =thisTrial['Signal']
 
-        if Signal==0:
-            this_stoptime=trial_length
-        else:
-            this_stoptime = stoptime #stop time is the trial length - the time taken to travel from the target to the top - the current step size)
-
         #print('this_stoptime:', this_stoptime)
         # ---------------------------------------------------------------
         # ------------------- 3. Participant pushes key
         #---------------------- Start of trial
         # ---------------------------------------------------------------
         #draw instructions to hold key down
+        phases.start('press key')
         PressKey_instructions.draw()
         win.flip()
 
         #wait for keypress
         kb.start() # we need to start watching the keyboard before a key is pressed
         kb.clearEvents ()
-        k = event.waitKeys()
+        k = osari_timing.wait_keys()
 
         #check for if user wishes to esc
         if k[0]=='escape':
@@ -606,6 +694,7 @@ for block in outerLoop:
 
         #Count down before trial starts
         if taskInfo_brief['Count down']:
+            phases.start('countdown')
             countdown()
 
         targetArrowRight.setAutoDraw(True)
@@ -621,12 +710,14 @@ for block in outerLoop:
         #Record the frame intervals for the interested user
         win.frameIntervals=[]
         win.recordFrameIntervals = True
+        n_dropped_start = win.nDroppedFrames
 
         #"waiting" = variable to say if we are waiting for the key to be lifted
         waiting=1
         height=0
         #print('current vert:', vert[1][1])
         time_elapsed=0#we want this to be 0 at this point
+        phases.start('bar rise')
         win.callOnFlip(kb.clock.reset)
         win.flip()
         #kb.clock.reset()
@@ -639,10 +730,7 @@ for block in outerLoop:
             # Calculate "height" - the current height of the bar in cm
             # this will be added to the vertices position to adjust the size of
             # the filling (blue) bar.
-            if time_elapsed<this_stoptime:
-                height = (time_elapsed*bar_height)/trial_length
-            elif time_elapsed>=this_stoptime:
-                height = (this_stoptime*bar_height)/trial_length#max_height
+            height = osari_trial.bar_height(time_elapsed, this_stoptime, trial_length, bar_height)
 
             # If a key has been pressed (i.e. there is something in the keyboard events)
             # we will draw the filling bar. This will stop if key lift detected.
@@ -653,7 +741,7 @@ for block in outerLoop:
                         lift_time = kb.clock.getTime()
                         kd=key.duration
                         krt=key.rt
-                        kd_start_synced=key.duration-np.abs((key.tDown-kb.clock.getLastResetTime()))#<----can just do key.duration - key.rt
+                        kd_start_synced=osari_trial.release_time(key.duration, key.tDown, kb.clock.getLastResetTime())#<----can just do key.duration - key.rt
                         #print('lift time:', lift_time, 'duration:', kd, 'duration_startsynced', kd_start_synced)
                         kb.clearEvents() #clear the key events
                         #say we are not waiting anymore and break the loop
@@ -673,8 +761,15 @@ for block in outerLoop:
                     vert[2]=(vert[2][0], vert[2][1]-height)# right corner
                     win.flip()
 
+        #the flip that showed the bar stopped has just returned: how long after the lift was it
+        #seen, shown, and how far did the bar rise past the lift (see osari_latency.py)
+        latency = None
+        if waiting==0:
+            latency = osari_latency.trial_latency(kd_start_synced, lift_time, kb.clock.getTime(), height,
+                this_stoptime, trial_length, bar_height)
         #stop recording frame intervals
         win.recordFrameIntervals = False
+        phases.start('feedback')
         #if this was a stop trial then the above while loop will have broken when the stoplimit was
         #reached. but, we still want to wait untill the end of the trial to make sure they
         #actually hold and don't lift as soon as the stop limit is reached
@@ -683,65 +778,55 @@ for block in outerLoop:
         #---------------------- compile feedback and save data
         # ---------------------------------------------------------------
         kb.stop() # stop watching the keyboard
-        #if the bar has filled but we are still waiting for the key to lift
+        #if the bar has filled but we are still waiting for the key to lift the outcome is decided
+        #by the signal: a go trial where they incorrectly stopped (correct=-2) or a stop trial where they
+        #correctly stopped (2). If the key was lifted before the bar filled: a go trial with feedback of the
+        #time in ms from the target (1) or a stop trial where they incorrectly lifted (-1)
         if waiting==1:
-            kd_start_synced='NaN'
-            # Optional prints for debugging
-            #print('trial length:',trial_length)
-            lifted=0#<-------------------------------------------Are the variables lifted
-            RT='NaN'
-            #if this was a go trial feedback that the participant incorrectly stopped
-            if Signal==0:
-                feedback=incorrectstop
-                # Change the colour of the target arrows
-                targetArrowRight.fillColor='Red'
-                targetArrowLeft.fillColor='Red'
-                correct=-2
-            # If this was a stop trial feedback that the participant correctly stopped
-            elif Signal==1:# The participant must have continued holding untill the end of the total trial length
-                correct=2
-                #change the colour of the target Arrows
-                targetArrowRight.fillColor='Green'
-                targetArrowLeft.fillColor='Green'
-                feedback=correctstop
-                correct_StopSs=correct_StopSs+1
-        # If the key was lifted before the bar filled
+            lift_time, kd_start_synced = None, 'NaN'
+        outcome = trial_engine.finish(Signal, lift_time, kd_start_synced, trial_label)
+        record = records.fill(trial_index, block_count, trial_label, trial_count, Signal, this_stoptime, outcome, latency)
+        # Change the colour of the target arrows
+        targetArrowRight.fillColor=outcome['colour']
+        targetArrowLeft.fillColor=outcome['colour']
+        if outcome['feedback']=='correctgo':
+            feedback = osari_stimuli.feedback_text(win,
+                "You stopped the bar \n %.0f ms from the target!"%(outcome['feedback_ms'])) # <--------------------------- the ".8" is osari_config.TARGET - do we want it flexible this is the proportion of the trial time where the target is
         else:
-            # If this was a stop trial feedback that the participant incorrectly stopped
-            lifted=1
-            RT = lift_time
-            if Signal==0:# Give feedback they correctly lifted and time in ms from target
-                correct=1
-                feedback_synced = round(abs(((trial_length*.8)-lift_time)*1000)) #this used the kb.clock.getTime we used previously and saw was binned
-                targetArrowRight.fillColor='Green'
-                targetArrowLeft.fillColor='Green'
-                correctgo = visual.TextStim(win, pos=[-8, 0], height=1, color=[1,1,1],
-                text="You stopped the bar \n %.0f ms from the target!"%(feedback_synced), units='cm') # <--------------------------- the ".8" is hard coded here - do we want it flexible this is the proportion of the trial time where the target is
-                feedback_list.append(feedback_synced)
-                if trial_label=="main":# Only add to the feedback if this is a main trial (i.e. dont count the practice trials)
-                    correct_gos=correct_gos+1
-                feedback=correctgo
-            elif Signal==1:# Give feedback they incorrectly lifted -- and this is an unsuccessfull trial, so the trial should restart (it will be noted in the output that the trial restarted)
-                feedback=incorrectgo
-                targetArrowRight.fillColor='Red'
-                targetArrowLeft.fillColor='Red'
-                correct=-1
+            feedback={'incorrectstop':incorrectstop, 'correctstop':correctstop, 'incorrectgo':incorrectgo}[outcome['feedback']]
         if taskInfo_brief['Trial by trial feedback']:
             feedback.setAutoDraw(True)
         win.flip()
-        if Signal == 0:
-            this_stoptime = 'NaN'
+        phases.start('save')
         with open(Output+'.txt', 'a') as b:
-            b.write('%s	%s	%s	%s	%s	%s	%s\n'%(block_count, trial_label, trial_count, Signal, lifted, this_stoptime, kd_start_synced))
-        trials.addData('block', block_count)
-        trials.addData('trialType', trial_label)
-        trials.addData('trial', trial_count)
-        trials.addData('signal', Signal)
-        trials.addData('response', lifted)
-        trials.addData('ssd', this_stoptime)
-        trials.addData('rt', kd_start_synced)
+            b.write(osari_trial.TXT_FORMAT%records.txt_row(trial_index))
+        phases.start('add data')
+        # write out the trial's log records first, so that its counts are complete: log records lost
+        # because the ring buffer was full and records written to disk late
+        logFile.drain()
+        record['log_dropped'], record['log_late'] = logFile.trial_counts()[1:]
+        if monitor or sink:
+            values = records.values(trial_index, csv_columns)
+        if monitor:
+            # only queues the trial, the monitor's own thread does the rest
+            monitor.post(frame_drops=win.nDroppedFrames-n_dropped_start, n_trials=trials.nTotal, n_blocks=n_blocks,
+                **values)
+        if sink:
+            sink.post_trial(values)
+        records.add_data(trial_index, trials, csv_columns)
+        for alert in stats.update(record):
+            logging.warning('OSARI alert: %s' % alert)
         thisExp.nextEntry()
-        core.wait(ISI)
+        # write the log out while nothing is being timed
+        phases.start('isi')
+        isi_start = core.getTime()
+        #psi: update the posterior and choose the next SSD while nothing is being timed (see osari_psi.py)
+        psi_summary = trial_engine.update()
+        if psi_summary:
+            logging.data('psi: threshold %(threshold).4f (sd %(threshold_sd).4f) slope %(slope).4f entropy %(entropy).3f '
+                'next SSD %(next_ssd).3f (%(ms).2f ms)' % psi_summary)
+        logFile.drain()
+        osari_timing.wait(max(ISI-(core.getTime()-isi_start), 0))
         # Reset visual stimuli for next trial
         feedback.setAutoDraw(False)
         targetArrowRight.setAutoDraw(False)
@@ -750,33 +835,79 @@ for block in outerLoop:
         Bar.setAutoDraw(False)
         if taskInfo_brief['Spaceship']:
             Spaceship.setAutoDraw(False)
-        count=count+1# Only add to the trial could if we have been successfull
+        phases.end_trial()
+
+    for alert in stats.end_block():
+        logging.warning('OSARI alert: %s' % alert)
+    # Save a typed binary copy of the data (see osari_binary.py), rewritten at the end of every block
+    osari_binary.write_trials(Output_ExpH+'.osari', records.trials(), expInfo, taskInfo_brief, taskInfo)
+    # and the time spent in each phase of every trial with a summary report (see osari_timing.py)
+    phases.save(Output_ExpH+'.phases')
+    phases.write_report(Output_ExpH+'.timing')
+    # and the input latency of the lifts, with the trials detected more than a frame late
+    osari_latency.write_report(Output_ExpH+'.latency', records.trials(), frame_dur)
+    # and the posterior after every stop trial with the psi method
+    if trial_engine.psi:
+        trial_engine.psi.save(Output_ExpH+'.psi')
+    # and the SSD, reversals and converged SSD of each interleaved staircase
+    if trial_engine.staircases is not None:
+        trial_engine.staircases.save(Output_ExpH+'.staircases')
 
     # Write a nice thank-you message and some feedback on performance
-    EndMessage = visual.TextStim(win, pos=[0, 0.4], height=.1, color=[1,1,1],
-        text="The End!\nThanks for taking part!\n[press a key to end]")
-        #text="The End!\n\nAverage time from target: %.3f\n\nCorrect Go: %s out of %s\n\nCorrect Stop: %s out of %s"%(
-#        np.average(feedback_list), correct_gos, taskInfo_brief['n_go_trials (per block)']*taskInfo_brief['n blocks'], correct_StopSs, taskInfo_brief['n_stop_trials (per block)']*taskInfo_brief['n blocks']))
+    session_feedback = osari_stats.feedback_text(stats.summary())+'\n\n' if taskInfo_brief['Trial by trial feedback'] else ''
+    EndMessage = visual.TextStim(win, pos=[0, 0.5], height=.1, color=[1,1,1],
+        text="The End!\nThanks for taking part!\n\n%s[press a key to end]" % session_feedback)
 # --------------------------------------------------------------
 # --------------------------------------------------------------
 #                   END TRIALS
 # --------------------------------------------------------------
 # --------------------------------------------------------------
 
-#play fun video
-mov = visual.MovieStim3(win, 'Stimuli/Astronaught_floss_test.mp4', size=(320, 240),
-    flipVert=False, flipHoriz=False, loop=False)
-
-while mov.status != visual.FINISHED:
-    mov.draw()
-    EndMessage.draw()
-    win.flip()
-    if event.getKeys():
-        break
+#Remember where the staircase converged, for a warm start of this participant's next session
+#(not with interleaved staircases: the SSDs of the session are not one staircase)
+if taskInfo_brief['Method']=='staircase' and trial_engine.staircases is None:
+    osari_staircase.update_state(_thisDir + os.sep + 'data', expInfo['Participant ID'],
+        '%s_%s_%s' % (expInfo['Participant ID'], expName, expInfo['date']), records.trials())
+
+#Save all the data before the video, so nothing that goes wrong with it can lose them
+thisExp.saveAsWideText(Output_ExpH+'.csv', delim='auto')
+thisExp.saveAsPickle(Output_ExpH)
+thisExp.abort() # the data files are saved, don't save them again on exit
+#the participant came from a queue file: only now is their row moved to <queue>.done (see osari_config.py)
+if config is not None and config['queue']:
+    osari_config.take_participant(config['queue'], expInfo['Participant ID'])
+logFile.drain()
+if sink:
+    sink.close()
+    for name, error in sink.rejected:
+        print('The collector rejected %s (kept in the spool folder): %s' % (name, error))
+
+#play fun video, if it was there and could be decoded (checked in the background during the last block)
+mov = reward_video.movie(win, size=(320, 240), flipVert=False, flipHoriz=False, loop=False) if reward_video else None
+if reward_video and mov is None:
+    print('No video at the end: %s' % reward_video.error)
+try:
+    while mov is not None and mov.status != visual.FINISHED:
+        mov.draw()
+        EndMessage.draw()
+        win.flip()
+        if event.getKeys():
+            break
+except Exception as e:
+    print('The video at the end stopped: %s' % e)
 # Be nice and thank participant.
 EndMessage.draw()
 win.flip()
 
 # Wait for button press
-event.waitKeys()
+osari_timing.wait_keys()
+#CPU use of each trial phase, summed over the session
+for phase, (wall, cpu) in sorted(phases.totals().items()):
+    print('%-12s wall %7.1f s  cpu %7.1f s (%.0f%%)' % (phase, wall, cpu, 100*cpu/max(wall, 1e-9)))
+#and how the session went (test trials)
+print('Stop success %(stop success).2f, go omissions %(go omissions).2f, lift error %(lift error mean).1f ms '
+    '(sd %(lift error sd).1f, median %(lift error p50).1f), mean SSD of the last stop trials %(ssd average).3f s, '
+    '%(reversals)s reversals' % stats.summary())
+if trial_engine.psi:
+    print('psi: longest update %.2f ms (ISI %s s)' % (trial_engine.psi.worst*1000, ISI))
 core.quit()
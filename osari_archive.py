@@ -0,0 +1,522 @@
+"""
+OSARI content addressed archive
+
+Stores data folders (of one or many testing sites) in a compressed archive where
+every piece of content is kept once. Files are cut into chunks at points chosen by
+their content (a gear rolling hash over the last 32 bytes), so a rerun's csv, a .txt
+with a second session appended or the same file copied between sites share their
+chunks, which are stored once each, compressed with zstd (the zstandard package) or,
+without it, zlib:
+
+    archive/manifest.json   the files (size, modification time, digest, chunks) and
+                            the sessions they belong to (as osari_data.session_index)
+    archive/chunks.npy      the chunk index: digest, pack, offset, stored and raw size,
+                            codec, sorted by digest
+    archive/packs/*.pack    the compressed chunks, appended one after the other
+
+The archive is read through a Python API, without extracting it (or a FUSE mount).
+Reads only decompress the chunks they need:
+
+    archive = Archive('archive')
+    archive.files()                         # names, e.g. 's_123_OSARI_2020_Jul_19_1307.csv'
+    archive.read(name, offset=0, size=-1)   # bytes
+    with archive.open(name) as f:           # a text (or, with 'rb', binary) file object
+        trials = osari_data.read_txt(f)
+    archive.session_index()                 # as osari_data.session_index, with archive names
+    archive.load_sessions()                 # as osari_data.load_sessions (.txt and .csv)
+
+Folders are added in parallel (cutting, hashing and compressing run in a process
+pool; the chunks are written by one process). Files that are unchanged since they
+were added are skipped, so a folder can be added again after every session. A prefix
+keeps the files of different sites apart:
+
+    python osari_archive.py add data archive [prefix]
+    python osari_archive.py ls archive
+    python osari_archive.py cat archive s_123_OSARI_2020_Jul_19_1307.txt
+    python osari_archive.py verify archive
+    python osari_archive.py check data      # a copy of data with a site in a subfolder
+
+The chunks of files that were changed or replaced stay in the packs; nothing is
+ever removed from an archive.
+"""
+from __future__ import absolute_import, division
+import hashlib
+import io
+import json
+import os
+import time
+import zlib
+import numpy as np
+
+import osari_data
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+VERSION = 1
+MANIFEST = 'manifest.json'
+INDEX = 'chunks.npy'
+PACKS = 'packs'
+PACK_SIZE = 1 << 30
+
+# content defined chunking: a cut after every byte where the low AVG_BITS bits of the
+# gear hash are 0 (one in 8 KiB), at least MIN_CHUNK and at most MAX_CHUNK apart
+WINDOW = 32
+AVG_BITS = 13
+MIN_CHUNK = 1 << 11
+MAX_CHUNK = 1 << 16
+GEAR_SEED = 20200719
+GEAR = np.random.RandomState(GEAR_SEED).randint(0, 1 << 32, 256, dtype=np.uint64).astype(np.uint32)
+_MASK = np.uint32((1 << AVG_BITS)-1)
+_BLOCK = 1 << 22
+
+CODECS = ('raw', 'zlib', 'zstd')
+ZSTD_LEVEL = 9
+ZLIB_LEVEL = 6
+CHUNK_DTYPE = np.dtype([('digest', 'S40'),   # blake2b (20 bytes) in hex
+                        ('pack', 'u4'),
+                        ('offset', 'u8'),
+                        ('length', 'u4'),    # stored (compressed) size
+                        ('size', 'u4'),      # raw size
+                        ('codec', 'u1')])
+
+
+class ArchiveError(Exception):
+    pass
+
+
+def digest(data):
+    return hashlib.blake2b(data, digest_size=20).hexdigest()
+
+
+def cut_points(data):
+    """The end of every chunk of "data" (bytes), see the module docstring"""
+    n = len(data)
+    candidates = []
+    for start in range(0, n, _BLOCK):
+        # the hash at a byte covers the WINDOW bytes up to it, so each block starts WINDOW-1 bytes early
+        low = max(start-WINDOW+1, 0)
+        h = GEAR[np.frombuffer(data, dtype=np.uint8, count=min(start+_BLOCK, n)-low, offset=low)]
+        # sum of GEAR[byte i-k] << k over the window, doubling the span each pass (1, 2, 4 ... WINDOW)
+        span = 1
+        while span < WINDOW:
+            doubled = h.copy()
+            doubled[span:] += h[:-span] << np.uint32(span)
+            h = doubled
+            span *= 2
+        candidates.append(np.flatnonzero((h[start-low:] & _MASK) == 0)+start+1)
+    ends = []
+    last = 0
+    for cut in (np.concatenate(candidates) if candidates else []):
+        while cut-last > MAX_CHUNK:
+            last += MAX_CHUNK
+            ends.append(last)
+        if cut-last >= MIN_CHUNK:
+            ends.append(int(cut))
+            last = int(cut)
+    while n-last > MAX_CHUNK:
+        last += MAX_CHUNK
+        ends.append(last)
+    if last < n:
+        ends.append(n)
+    return ends
+
+
+def compress(data):
+    """(codec, stored bytes); raw if compressing does not make it smaller"""
+    if zstandard is not None:
+        codec, stored = 2, zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    else:
+        codec, stored = 1, zlib.compress(data, ZLIB_LEVEL)
+    if len(stored) >= len(data):
+        return 0, data
+    return codec, stored
+
+
+def decompress(stored, codec, size):
+    if codec == 0:
+        return stored
+    if codec == 1:
+        return zlib.decompress(stored)
+    if zstandard is None:
+        raise ArchiveError('the archive has zstd chunks, reading it needs the zstandard package')
+    return zstandard.ZstdDecompressor().decompress(stored, max_output_size=size)
+
+
+def _chunk_job(args):
+    """Cut, hash and compress one file (run in the process pool)"""
+    path, name = args
+    try:
+        stat = os.stat(path)
+        with open(path, 'rb') as f:
+            data = f.read()
+        chunks = []
+        start = 0
+        for end in cut_points(data):
+            piece = data[start:end]
+            chunks.append((digest(piece), end-start)+compress(piece))
+            start = end
+        return name, None, {'size': len(data), 'mtime_ns': stat.st_mtime_ns, 'digest': digest(data)}, chunks
+    except Exception as err:
+        return name, '%s: %s' % (type(err).__name__, err), None, None
+
+
+def _write(path, text):
+    tmp = path+'.tmp'
+    with open(tmp, 'w') as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def _names(data_dir, prefix=''):
+    """{archive name: path} of the files in "data_dir" and its subfolders"""
+    names = {}
+    for folder, dirs, files in os.walk(data_dir):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+        for fname in sorted(files):
+            if fname.startswith('.') or fname.endswith('.tmp'):
+                continue
+            path = os.path.join(folder, fname)
+            rel = os.path.relpath(path, data_dir).replace(os.sep, '/')
+            names[prefix+'/'+rel if prefix else rel] = path
+    return names
+
+
+class Archive(object):
+    """An archive folder (see the module docstring); made empty if it does not exist"""
+
+    def __init__(self, path, cache=64):
+        self.path = path
+        self.manifest = {'version': VERSION, 'files': {}, 'sessions': {},
+                         'chunking': {'window': WINDOW, 'avg_bits': AVG_BITS, 'min': MIN_CHUNK,
+                                      'max': MAX_CHUNK, 'gear_seed': GEAR_SEED}}
+        self.index = np.zeros(0, dtype=CHUNK_DTYPE)
+        if os.path.exists(os.path.join(path, MANIFEST)):
+            with open(os.path.join(path, MANIFEST)) as f:
+                self.manifest = json.load(f)
+            if self.manifest['version'] > VERSION:
+                raise ArchiveError('%s was written by a newer version (%s) of the archive' % (path, self.manifest['version']))
+            if os.path.exists(os.path.join(path, INDEX)):
+                self.index = np.load(os.path.join(path, INDEX))
+        self._packs = {}
+        self._cache = {}
+        self._cache_size = cache
+
+    # ----------------------------------------------------------- reading
+
+    def files(self):
+        return sorted(self.manifest['files'])
+
+    def stat(self, name):
+        try:
+            return self.manifest['files'][name]
+        except KeyError:
+            raise ArchiveError('%s is not in %s' % (name, self.path))
+
+    def _find(self, digests):
+        """The index rows of chunk digests (hex)"""
+        keys = np.array(digests, dtype='S40')
+        rows = np.searchsorted(self.index['digest'], keys)
+        if len(keys) and (rows.max() >= len(self.index) or np.any(self.index['digest'][rows] != keys)):
+            raise ArchiveError('%s: chunks missing from the index' % self.path)
+        return rows
+
+    def _chunk(self, row):
+        """The raw bytes of the chunk in index row "row" (the last few are cached)"""
+        if row in self._cache:
+            return self._cache[row]
+        c = self.index[row]
+        pack = int(c['pack'])
+        if pack not in self._packs:
+            self._packs[pack] = open(os.path.join(self.path, PACKS, '%05d.pack' % pack), 'rb')
+        f = self._packs[pack]
+        f.seek(int(c['offset']))
+        data = decompress(f.read(int(c['length'])), int(c['codec']), int(c['size']))
+        if len(self._cache) >= self._cache_size:
+            self._cache.pop(next(iter(self._cache)))
+        self._cache[row] = data
+        return data
+
+    def _layout(self, name):
+        """Index rows of the chunks of a file and the offset each one starts at in it"""
+        rows = self._find(self.stat(name)['chunks'])
+        sizes = self.index['size'][rows].astype(np.int64)
+        return rows, np.cumsum(sizes)-sizes
+
+    def _read(self, rows, starts, file_size, offset, size):
+        stop = file_size if size is None or size < 0 else min(offset+size, file_size)
+        parts = []
+        i = int(np.searchsorted(starts, offset, side='right'))-1
+        while offset < stop:
+            chunk = self._chunk(rows[i])
+            parts.append(chunk[offset-starts[i]:stop-starts[i]])
+            offset = int(starts[i])+len(chunk)
+            i += 1
+        return b''.join(parts)
+
+    def read(self, name, offset=0, size=-1):
+        """"size" bytes of a file from "offset" (to the end if size < 0)"""
+        rows, starts = self._layout(name)
+        return self._read(rows, starts, self.stat(name)['size'], offset, size)
+
+    def open(self, name, mode='r', encoding=None, newline=None):
+        """A read only file object, text ('r') or binary ('rb'), that seeks without reading"""
+        raw = _ArchiveFile(self, name)
+        if mode == 'rb':
+            return io.BufferedReader(raw)
+        if mode != 'r':
+            raise ValueError('an archive can only be opened for reading (r or rb), not %s' % mode)
+        return io.TextIOWrapper(io.BufferedReader(raw), encoding=encoding, newline=newline)
+
+    def extract(self, name, path):
+        with open(path, 'wb') as f:
+            f.write(self.read(name))
+
+    def session_index(self):
+        """The sessions in the archive, as osari_data.session_index (archive names instead of paths)"""
+        return [self.manifest['sessions'][key] for key in sorted(self.manifest['sessions'])]
+
+    def load_sessions(self, index=None):
+        """As osari_data.load_sessions, read from the archive (.txt and .csv files)"""
+        sessions = []
+        for entry in (self.session_index() if index is None else index):
+            if entry['txt'] is None:
+                continue
+            entry = dict(entry)
+            with self.open(entry['txt']) as f:
+                entry['trials'] = osari_data.read_txt(f)
+            entry['info'] = {}
+            if entry['csv']:
+                with self.open(entry['csv'], encoding='utf-8-sig', newline='') as f:
+                    entry['info'] = osari_data.read_csv_info(f)
+            sessions.append(entry)
+        return sessions
+
+    def verify(self):
+        """Read every file back and check the digests of its chunks and of the whole file;
+        returns a list of problems"""
+        problems = []
+        for name in self.files():
+            entry = self.manifest['files'][name]
+            try:
+                rows = self._find(entry['chunks'])
+                data = b''.join(self._chunk(row) for row in rows)
+            except Exception as err:
+                problems.append('%s: %s' % (name, err))
+                continue
+            bad = [d for d, row in zip(entry['chunks'], rows) if digest(self._chunk(row)) != d]
+            if bad:
+                problems.append('%s: %s chunks do not match their digest' % (name, len(bad)))
+            elif len(data) != entry['size'] or digest(data) != entry['digest']:
+                problems.append('%s: the file does not match its digest' % name)
+        return problems
+
+    def close(self):
+        for f in self._packs.values():
+            f.close()
+        self._packs = {}
+        self._cache = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ----------------------------------------------------------- adding
+
+    def add(self, data_dir='data', prefix='', n_jobs=None, force=False):
+        """Add the files of "data_dir" (and its subfolders) that are new or changed
+
+        Returns a list of (name, status, message) with status one of 'added',
+        'unchanged' or 'error', and counts of the chunks and bytes written.
+        """
+        from concurrent.futures import ProcessPoolExecutor
+        files = self.manifest['files']
+        results = []
+        jobs = []
+        for name, path in sorted(_names(data_dir, prefix).items()):
+            stat = os.stat(path)
+            known = files.get(name)
+            if not force and known and [known['size'], known['mtime_ns']] == [stat.st_size, stat.st_mtime_ns]:
+                results.append((name, 'unchanged', ''))
+            else:
+                jobs.append((path, name))
+
+        counts = {'chunks': 0, 'new chunks': 0, 'bytes': 0, 'stored bytes': 0}
+        if jobs:
+            if not os.path.exists(os.path.join(self.path, PACKS)):
+                os.makedirs(os.path.join(self.path, PACKS))
+            pack = int(self.index['pack'].max()) if len(self.index) else 0
+            pack_path = os.path.join(self.path, PACKS, '%05d.pack' % pack)
+            out = open(pack_path, 'ab')
+            new = {}
+            try:
+                with ProcessPoolExecutor(n_jobs) as pool:
+                    for name, error, entry, chunks in pool.map(_chunk_job, jobs, chunksize=4):
+                        if error:
+                            results.append((name, 'error', error))
+                            continue
+                        for key, size, codec, stored in chunks:
+                            counts['chunks'] += 1
+                            counts['bytes'] += size
+                            if key in new or self._has(key):
+                                continue
+                            if out.tell()+len(stored) > PACK_SIZE and out.tell():
+                                out.close()
+                                pack += 1
+                                out = open(os.path.join(self.path, PACKS, '%05d.pack' % pack), 'ab')
+                            new[key] = (key.encode('ascii'), pack, out.tell(), len(stored), size, codec)
+                            out.write(stored)
+                            counts['new chunks'] += 1
+                            counts['stored bytes'] += len(stored)
+                        entry['chunks'] = [c[0] for c in chunks]
+                        files[name] = entry
+                        results.append((name, 'added', '%s chunks' % len(chunks)))
+                out.flush()
+                os.fsync(out.fileno())
+            finally:
+                out.close()
+            # the chunks are on disk before the index and manifest that point to them
+            if new:
+                index = np.concatenate([self.index, np.array(list(new.values()), dtype=CHUNK_DTYPE)])
+                self.index = index[np.argsort(index['digest'], kind='stable')]
+                with open(os.path.join(self.path, INDEX+'.tmp'), 'wb') as f:
+                    np.save(f, self.index)
+                os.replace(os.path.join(self.path, INDEX+'.tmp'), os.path.join(self.path, INDEX))
+                self._cache = {}
+        self._add_sessions(data_dir, prefix)
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        _write(os.path.join(self.path, MANIFEST), json.dumps(self.manifest, indent=1, sort_keys=True))
+        return results, counts
+
+    def _has(self, key):
+        row = np.searchsorted(self.index['digest'], key.encode('ascii'))
+        return row < len(self.index) and self.index['digest'][row] == key.encode('ascii')
+
+    def _add_sessions(self, data_dir, prefix):
+        """Link the files of "data_dir" and its subfolders to their sessions
+        (osari_data.session_index of each folder), named as in _names"""
+        files = self.manifest['files']
+        for folder, dirs, _ in os.walk(data_dir):
+            dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+            for entry in osari_data.session_index(folder):
+                entry = dict(entry)
+                rel = os.path.relpath(os.path.join(folder, entry['session']), data_dir).replace(os.sep, '/')
+                key = prefix+'/'+rel if prefix else rel
+                entry['session'] = key
+                for ext in ('txt', 'csv', 'psydat', 'log', 'osari'):
+                    if entry[ext] is not None:
+                        rel = os.path.relpath(entry[ext], data_dir).replace(os.sep, '/')
+                        entry[ext] = prefix+'/'+rel if prefix else rel
+                        if entry[ext] in files:
+                            files[entry[ext]]['session'] = key
+                        else:
+                            entry[ext] = None
+                self.manifest['sessions'][key] = entry
+
+
+class _ArchiveFile(io.RawIOBase):
+    """A file in an archive (see Archive.open)"""
+
+    def __init__(self, archive, name):
+        io.RawIOBase.__init__(self)
+        self.name = name
+        self._archive = archive
+        self._rows, self._starts = archive._layout(name)
+        self._size = archive.stat(name)['size']
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        self._pos = max({io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: self._size}[whence]+offset, 0)
+        return self._pos
+
+    def readinto(self, b):
+        data = self._archive._read(self._rows, self._starts, self._size, self._pos, len(b))
+        b[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+
+def check(data_dir='data'):
+    """Archive a copy of the sessions of "data_dir" laid out as a data folder with a
+    site in a subfolder (half of the sessions in <copy>/siteA) and check that every
+    session is linked to its files and loads as it does from the folder; returns a
+    list of problems"""
+    import shutil
+    import tempfile
+    tmp = tempfile.mkdtemp()
+    try:
+        copy = os.path.join(tmp, 'data')
+        os.makedirs(os.path.join(copy, 'siteA'))
+        expected = {}
+        for i, entry in enumerate(osari_data.session_index(data_dir)):
+            folder = 'siteA/' if i % 2 else ''
+            for ext in ('txt', 'csv', 'psydat', 'log', 'osari'):
+                if entry[ext] is not None:
+                    shutil.copy2(entry[ext], os.path.join(copy, folder+os.path.basename(entry[ext])))
+            if entry['txt'] is not None:
+                expected['s/'+folder+entry['session']] = entry
+        with Archive(os.path.join(tmp, 'archive')) as archive:
+            archive.add(copy, 's', n_jobs=2)
+            loaded = dict((s['session'], s) for s in archive.load_sessions())
+        problems = ['%s: not in the archive\'s sessions' % key for key in sorted(set(expected)-set(loaded))]
+        for key in sorted(set(expected) & set(loaded)):
+            trials = osari_data.read_txt(expected[key]['txt'])
+            info = osari_data.read_csv_info(expected[key]['csv']) if expected[key]['csv'] else {}
+            if loaded[key]['trials'].tobytes() != trials.tobytes() or loaded[key]['info'] != info:
+                problems.append('%s: loads differently from the archive' % key)
+        return problems
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    import sys
+    command, path = sys.argv[1], sys.argv[2]
+    if command == 'add':
+        started = time.time()
+        data_dir, archive_dir = sys.argv[2], sys.argv[3]
+        results, counts = Archive(archive_dir).add(data_dir, *sys.argv[4:5])
+        statuses = {}
+        for r in results:
+            statuses[r[1]] = statuses.get(r[1], 0)+1
+        print('%s in %.1f s' % (', '.join('%s %s' % (n, status) for status, n in sorted(statuses.items())),
+                                time.time()-started))
+        print('%(chunks)s chunks, %(new chunks)s new; %(bytes)s bytes stored in %(stored bytes)s' % counts)
+        for name, status, message in results:
+            if status == 'error':
+                print('  %s: %s' % (name, message))
+    elif command == 'ls':
+        archive = Archive(path)
+        for name in archive.files():
+            entry = archive.manifest['files'][name]
+            print('%10d  %4d chunks  %s' % (entry['size'], len(entry['chunks']), name))
+        stored = int(archive.index['length'].sum())
+        total = sum(entry['size'] for entry in archive.manifest['files'].values())
+        print('%s files, %s sessions, %s bytes in %s bytes of chunks' % (
+            len(archive.files()), len(archive.manifest['sessions']), total, stored))
+    elif command == 'cat':
+        sys.stdout.buffer.write(Archive(path).read(sys.argv[3]))
+    elif command == 'check':
+        problems = check(path)
+        print('\n'.join(problems) if problems else '%s: every session is linked and loads from the archive' % path)
+        sys.exit(1 if problems else 0)
+    elif command == 'verify':
+        problems = Archive(path).verify()
+        print('\n'.join(problems) if problems else '%s: all files match their digests' % path)
+        sys.exit(1 if problems else 0)
+    else:
+        print('commands: add, ls, cat, verify, check (see the module docstring)')
@@ -0,0 +1,263 @@
+"""
+OSARI render benchmark
+
+Runs synthetic trials with the stimuli of the task (osari_stimuli.py: the bar, the
+filling bar, the target arrows, the optional spaceship, the countdown digit and
+the feedback messages) in a window that is not full screen, and measures the CPU
+time of each part of the render path:
+
+    height      computing the height of the filling bar for the frame
+    vertices    setting the vertices of the filling bar (and the spaceship position)
+    draw        drawing the frame and flipping (win.flip with the stimuli on autoDraw)
+    countdown   redrawing the screen when the countdown digit changes
+    feedback    making and showing the feedback message at the end of a trial
+
+No keyboard is involved. The trial clock advances one frame (1/60 s) per frame, so
+every run draws the same frames, and flips do not wait for the screen refresh
+(waitBlanking=False), so the times are those of the CPU rather than of the display.
+
+    python osari_benchmark.py                   # compare with render_baseline.json
+    python osari_benchmark.py --save            # write the baseline
+    python osari_benchmark.py --trials 200 --spaceship
+
+In CI (no GPU, no display) run it in a virtual display with software OpenGL:
+
+    xvfb-run -a -s "-screen 0 1440x900x24" python osari_benchmark.py --software
+
+The median, 90th and 99th percentile of each part are compared with the baseline;
+a percentile that got slower by more than --tolerance (and by more than 0.05 ms)
+is listed and the exit status is 1. The baseline records the OpenGL renderer it
+was made with - only compare runs made on the same machine and renderer.
+"""
+from __future__ import absolute_import, division
+import json
+import os
+import sys
+import time
+import numpy as np
+
+import osari_config
+import osari_stimuli
+import osari_trial
+
+BASELINE = 'render_baseline.json'
+MEASURES = ('height', 'vertices', 'draw', 'countdown', 'feedback')
+PERCENTILES = (50, 90, 99)
+# slowdowns smaller than this (s) are never counted as a regression
+MIN_DIFFERENCE = .00005
+FRAME = 1/60
+
+# CPU time of this thread (the one that renders), or of the process on older Pythons
+_cpu = getattr(time, 'thread_time', time.process_time)
+
+
+def task_parameters(bar_height=15, spaceship=False):
+    """taskInfo_brief and taskInfo with the geometry of the task's default parameters"""
+    taskInfo_brief = {'Total bar height (in cm)': bar_height, 'Spaceship': spaceship}
+    geometry = osari_config.derived(taskInfo_brief)
+    taskInfo = {'Bar base below fixation (cm)': geometry['Bar_top'],
+                'Bar width (cm)': 3,
+                'Bar top above fixation (cm)': geometry['Bar_top'],
+                'Target line above fixation (cm)': geometry['Target_pos'],
+                'trial length (max trial duration in seconds)': 1}
+    return taskInfo_brief, taskInfo
+
+
+def make_window(size=(1440, 900), software=False, headless=False):
+    """A pyglet window (not full screen) that does not wait for the screen refresh"""
+    if software:
+        # Mesa's software renderer (llvmpipe), as on CI machines without a GPU
+        os.environ['LIBGL_ALWAYS_SOFTWARE'] = '1'
+    if headless:
+        import pyglet
+        pyglet.options['headless'] = True
+    from psychopy import visual
+    return visual.Window(size=size, fullscr=False, winType='pyglet', monitor='testMonitor',
+        color=[-1, -1, -1], colorSpace='rgb', blendMode='avg', allowGUI=False, waitBlanking=False)
+
+
+def renderer():
+    try:
+        from pyglet.gl import gl_info
+        return '%s (%s)' % (gl_info.get_renderer(), gl_info.get_version())
+    except Exception:
+        return 'unknown'
+
+
+def run(win, n_trials=50, warmup=2, spaceship=False, stop_proportion=.25, seed=0):
+    """Run warmup+n_trials synthetic trials; returns {measure: CPU times (s)} of the last n_trials"""
+    taskInfo_brief, taskInfo = task_parameters(spaceship=spaceship)
+    stimuli = osari_stimuli.make_stimuli(win, taskInfo_brief, taskInfo)
+    fillBar, Bar, Spaceship = stimuli['fillBar'], stimuli['Bar'], stimuli['Spaceship']
+    arrows = [stimuli['targetArrowRight'], stimuli['targetArrowLeft']]
+    number_text = stimuli['number_text']
+    incorrectgo = osari_stimuli.feedback_text(win, "Oops! That was a Stop trial \nYou did not withold your response")
+    correctstop = osari_stimuli.feedback_text(win, "Correct!\nYou withheld your response")
+    vert = stimuli['vert']
+    original_vert = list(vert)
+    trial_length = taskInfo['trial length (max trial duration in seconds)']
+    bar_height = taskInfo_brief['Total bar height (in cm)']
+    rng = np.random.RandomState(seed)
+
+    times = dict((measure, []) for measure in MEASURES)
+    for trial in range(warmup+n_trials):
+        record = trial >= warmup
+        signal = rng.uniform() < stop_proportion
+        stoptime = .5 if signal else trial_length
+        # go trials lift around the target, stop trials sometimes lift before the bar stops
+        lift = rng.normal(.8, .05) if not signal or rng.uniform() < .5 else np.inf
+
+        fillBar.vertices = original_vert
+        if spaceship:
+            Spaceship.pos = (0, original_vert[2][1])
+        for number in (3, 2, 1, 0):
+            start = _cpu()
+            number_text.text = "%s" % number
+            Bar.draw()
+            fillBar.draw()
+            if spaceship:
+                Spaceship.draw()
+            for arrow in arrows:
+                arrow.draw()
+            if number > 0:
+                number_text.draw()
+            win.flip()
+            if record:
+                times['countdown'].append(_cpu()-start)
+
+        for stim in arrows+[Bar, fillBar]+([Spaceship] if spaceship else []):
+            stim.setAutoDraw(True)
+        frame = 0
+        time_elapsed = 0
+        while time_elapsed < trial_length and time_elapsed < lift:
+            time_elapsed = frame*FRAME
+            t0 = _cpu()
+            height = osari_trial.bar_height(time_elapsed, stoptime, trial_length, bar_height)
+            t1 = _cpu()
+            vert[1] = (vert[1][0], vert[1][1]+height)
+            vert[2] = (vert[2][0], vert[2][1]+height)
+            fillBar.vertices = vert
+            if spaceship:
+                Spaceship.pos = (0, vert[2][1])
+            vert[1] = (vert[1][0], vert[1][1]-height)
+            vert[2] = (vert[2][0], vert[2][1]-height)
+            t2 = _cpu()
+            win.flip()
+            t3 = _cpu()
+            if record:
+                times['height'].append(t1-t0)
+                times['vertices'].append(t2-t1)
+                times['draw'].append(t3-t2)
+            frame += 1
+
+        start = _cpu()
+        lifted = time_elapsed < trial_length
+        if lifted and not signal:
+            color = 'Green'
+            feedback = osari_stimuli.feedback_text(win,
+                "You stopped the bar \n %.0f ms from the target!" % round(abs((trial_length*osari_config.TARGET-lift)*1000)))
+        else:
+            color = 'Red' if signal and lifted else 'Green'
+            feedback = incorrectgo if signal and lifted else correctstop
+        for arrow in arrows:
+            arrow.fillColor = color
+        feedback.setAutoDraw(True)
+        win.flip()
+        if record:
+            times['feedback'].append(_cpu()-start)
+        for stim in [feedback]+arrows+[fillBar, Bar]+([Spaceship] if spaceship else []):
+            stim.setAutoDraw(False)
+        for arrow in arrows:
+            arrow.fillColor = 'yellow'
+        win.flip()
+    return times
+
+
+def summarise(times):
+    """{measure: {'n', 'mean', 'p50', 'p90', 'p99', 'max'}} (s)"""
+    summary = {}
+    for measure in MEASURES:
+        values = np.array(times[measure])
+        if not len(values):
+            continue
+        summary[measure] = {'n': len(values), 'mean': values.mean(), 'max': values.max()}
+        for p, value in zip(PERCENTILES, np.percentile(values, PERCENTILES)):
+            summary[measure]['p%d' % p] = value
+    return summary
+
+
+def compare(summary, baseline, tolerance=.25):
+    """The percentiles that are more than "tolerance" slower than in the baseline,
+    as (measure, percentile, now, baseline) tuples"""
+    regressions = []
+    for measure, before in baseline['summary'].items():
+        if measure not in summary:
+            continue
+        for p in PERCENTILES:
+            key = 'p%d' % p
+            now, then = summary[measure][key], before[key]
+            if now > then*(1+tolerance) and now-then > MIN_DIFFERENCE:
+                regressions.append((measure, key, now, then))
+    return regressions
+
+
+def report(summary, baseline=None):
+    lines = ['%-10s %7s %9s %9s %9s %9s %9s  (CPU time, ms)' % (
+        'measure', 'n', 'mean', 'median', 'p90', 'p99', 'max')]
+    for measure in MEASURES:
+        if measure not in summary:
+            continue
+        s = summary[measure]
+        line = '%-10s %7d %9.3f %9.3f %9.3f %9.3f %9.3f' % (
+            measure, s['n'], s['mean']*1000, s['p50']*1000, s['p90']*1000, s['p99']*1000, s['max']*1000)
+        if baseline is not None and measure in baseline['summary']:
+            b = baseline['summary'][measure]
+            line += '   baseline %.3f / %.3f / %.3f' % (b['p50']*1000, b['p90']*1000, b['p99']*1000)
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Frame timing of the OSARI render path')
+    parser.add_argument('--trials', type=int, default=50)
+    parser.add_argument('--warmup', type=int, default=2, help='trials run first and not measured')
+    parser.add_argument('--spaceship', action='store_true')
+    parser.add_argument('--size', default='1440x900', help='window size, e.g. 1440x900')
+    parser.add_argument('--software', action='store_true', help='use software OpenGL (Mesa llvmpipe)')
+    parser.add_argument('--headless', action='store_true', help='pyglet headless (EGL) instead of a display')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save', action='store_true', help='write the results as the baseline')
+    parser.add_argument('--tolerance', type=float, default=.25, help='allowed slowdown, e.g. 0.25 = 25%%')
+    args = parser.parse_args()
+
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))  # for the images in Stimuli/
+    win = make_window(tuple(int(n) for n in args.size.split('x')), args.software, args.headless)
+    times = run(win, args.trials, args.warmup, args.spaceship)
+    gl = renderer()
+    win.close()
+    summary = summarise(times)
+    results = {'summary': summary, 'trials': args.trials, 'spaceship': args.spaceship, 'size': args.size,
+               'renderer': gl, 'python': sys.version.split()[0], 'date': time.strftime('%Y-%m-%d %H:%M')}
+
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(report(summary))
+        print('Saved the baseline to %s (%s)' % (args.baseline, gl))
+        sys.exit()
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print(report(summary, baseline))
+    if baseline is None:
+        print('No baseline (%s) to compare with - make one with --save' % args.baseline)
+        sys.exit()
+    if baseline.get('renderer') != gl:
+        print('Warning: the baseline was made with %s, this run used %s' % (baseline.get('renderer'), gl))
+    regressions = compare(summary, baseline, args.tolerance)
+    for measure, key, now, then in regressions:
+        print('Slower: %s %s %.3f ms (baseline %.3f ms, +%.0f%%)' % (
+            measure, key, now*1000, then*1000, 100*(now/then-1)))
+    sys.exit(1 if regressions else 0)
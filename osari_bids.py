@@ -0,0 +1,322 @@
+"""
+OSARI BIDS events export
+
+Converts sessions into BIDS events files, so that EEG or TMS-EMG recordings made
+during the task can be lined up with its events without rebuilding them by hand:
+
+    bids/sub-<participant>/ses-<date>/beh/sub-<participant>_ses-<date>_task-osari_events.tsv
+    bids/sub-<participant>/ses-<date>/beh/sub-<participant>_ses-<date>_task-osari_events.json
+
+Every trial (a row of the session's .txt file) gives up to four events:
+
+    trial         the bar rise, from its first frame until it stopped (lift or end of the trial)
+    stop_signal   stop trials: the first frame drawn at or after the SSD (only if the
+                  key was still held then, i.e. the bar was seen to stop)
+    lift          the key release, from 'rt' (trials with a lift)
+    feedback      the feedback message, until it was taken off the screen
+
+with the trial's block, trial number, block type, signal, response, ssd and rt as
+extra columns. Onsets are seconds on the task's clock (the PsychoPy clock that
+time stamps the .log file). They are taken from the session's DEBUG log: the bar
+rise is bracketed by the window's recordFrameIntervals changes and the per-frame
+bar updates are the frame trace used for the stop signal frame (see osari_logs.py).
+Sessions without a log use their .phases file (see osari_timing.py) instead, which
+gives approximate onsets (time outside the trial phases, e.g. between blocks, is
+not counted); the events.json of each session says which was used. Sessions with
+neither are not converted (status 'no timing'). A session that was stopped during
+a trial has one more trial in its log than in its .txt; that trial is left out.
+
+    convert_session(entry, bids_dir)          -> the events of one session, written
+    convert_archive(data_dir, bids_dir)       -> every session in a process pool
+
+Conversion is incremental: a manifest (bids_manifest.json in the BIDS folder) keeps
+the size and modification time of the files each session was converted from, so
+unchanged sessions are skipped on the next run.
+
+    python osari_bids.py data bids
+"""
+from __future__ import absolute_import, division
+import json
+import os
+import re
+import time
+import numpy as np
+
+import osari_data
+import osari_logs
+
+MANIFEST = 'bids_manifest.json'
+TASK = 'osari'
+BIDS_VERSION = '1.8.0'
+COLUMNS = ('onset', 'duration', 'trial_type', 'block', 'trial', 'block_type', 'signal', 'response', 'ssd', 'rt')
+
+# the phases (osari_timing.py) the feedback message stays on the screen for
+_feedback_phases = ('feedback', 'save', 'add data', 'isi')
+
+_SIDECAR = {
+    'onset': {'Description': 'Onset of the event', 'Units': 's'},
+    'duration': {'Description': 'Duration of the event (0 for instantaneous events)', 'Units': 's'},
+    'trial_type': {'Description': 'Type of event',
+                   'Levels': {'trial': 'Bar rise, from its first frame until it stopped',
+                              'stop_signal': 'First frame drawn at or after the stop signal delay',
+                              'lift': 'Key release',
+                              'feedback': 'Feedback message on the screen'}},
+    'block': {'Description': 'Block number'},
+    'trial': {'Description': 'Trial number within the block'},
+    'block_type': {'Description': 'Name of the block (practice or test trials)'},
+    'signal': {'Description': 'Trial type', 'Levels': {'go': 'Go trial', 'stop': 'Stop trial'}},
+    'response': {'Description': 'Key lifted during the trial', 'Levels': {'0': 'No lift', '1': 'Lift'}},
+    'ssd': {'Description': 'Stop signal delay from the start of the bar rise', 'Units': 's'},
+    'rt': {'Description': 'Lift time from the start of the bar rise', 'Units': 's'},
+}
+
+
+class NoTiming(ValueError):
+    """The session has no .log or .phases file"""
+
+
+def label(text):
+    """A BIDS label (letters and digits only)"""
+    return re.sub(r'[^A-Za-z0-9]', '', str(text)) or 'unknown'
+
+
+def session_label(entry):
+    """ses-<label> from the session date (e.g. 2020_Jul_19_1307 -> 202007191307)"""
+    if entry.get('date'):
+        try:
+            return time.strftime('%Y%m%d', time.strptime(entry['date'][:11], '%Y_%b_%d'))+entry['date'][12:]
+        except ValueError:
+            pass
+    return label(entry['session'])
+
+
+def events_path(entry, bids_dir):
+    sub, ses = label(entry['participant']), session_label(entry)
+    return os.path.join(bids_dir, 'sub-'+sub, 'ses-'+ses, 'beh',
+                        'sub-%s_ses-%s_task-%s_events.tsv' % (sub, ses, TASK))
+
+
+def phases_path(entry, data_dir):
+    return os.path.join(data_dir, 's_%s.phases' % entry['session'])
+
+
+def _first(values, index, n):
+    """The first value of each index (0..n-1), NaN where an index has none"""
+    first = np.full(n, np.nan)
+    first[index[::-1]] = values[::-1]
+    return first
+
+
+def _per_event(values, trial):
+    """values[trial] for every event, NaN for events outside the trials (trial -1)"""
+    return np.append(values, np.nan)[trial]
+
+
+def times_from_log(path, n_trials):
+    """Per trial: rise onset and end, feedback onset and end (NaN if not shown), and the
+    frame trace (times of the per-frame bar updates and their trials)"""
+    events = osari_logs.read_log(path, keep_values=False)
+    trial = osari_logs.align_trials(events)
+    if trial.max(initial=-1)+1 < n_trials:
+        raise ValueError('the log has %s trials, the .txt %s' % (trial.max(initial=-1)+1, n_trials))
+    trial = np.where(trial < n_trials, trial, -1)
+    t = events['t']
+    attribute = events['kind'] == osari_logs.KINDS.index('attribute')
+    in_trial = trial >= 0
+    record = attribute & in_trial & (events['attribute'] == 'recordFrameIntervals')
+    rise = _first(t[record & (events['value'] == 'True')], trial[record & (events['value'] == 'True')], n_trials)
+    after_rise = in_trial & (t >= _per_event(rise, trial))
+    end = record & (events['value'] == 'False') & after_rise
+    rise_end = _first(t[end], trial[end], n_trials)
+
+    text = attribute & in_trial & (events['attribute'] == 'autoDraw') & np.char.endswith(events['source'], 'TextStim')
+    shown = text & (events['value'] == 'True') & (t >= _per_event(rise_end, trial))
+    feedback = _first(t[shown], trial[shown], n_trials)
+    hidden = text & (events['value'] == 'False') & (t > _per_event(feedback, trial))
+    feedback_end = _first(t[hidden], trial[hidden], n_trials)
+
+    frames = attribute & in_trial & (events['attribute'] == 'vertices') & osari_logs.rising(events)
+    return {'rise': rise, 'rise_end': rise_end, 'feedback': feedback, 'feedback_end': feedback_end,
+            'frame_t': t[frames], 'frame_trial': trial[frames], 'source': 'log'}
+
+
+def times_from_phases(path, n_trials, feedback_shown=True):
+    """Like times_from_log, from the phase durations of each trial (no frame trace)"""
+    rows = []
+    with open(path) as f:
+        next(f)
+        for line in f:
+            fields = line.rstrip('\n').split('\t')
+            rows.append((int(fields[0]), fields[1], float(fields[2])))
+    n = max(row[0] for row in rows)+1 if rows else 0
+    if n < n_trials:
+        raise ValueError('the .phases file has %s trials, the .txt %s' % (n, n_trials))
+    rise, rise_end = np.full(n_trials, np.nan), np.full(n_trials, np.nan)
+    feedback, feedback_end = np.full(n_trials, np.nan), np.full(n_trials, np.nan)
+    now = 0.
+    for i, phase, wall in rows:
+        if i >= n_trials:
+            break
+        if phase == 'bar rise':
+            rise[i], rise_end[i] = now, now+wall
+        if phase in _feedback_phases and feedback_shown:
+            if np.isnan(feedback[i]):
+                feedback[i] = now
+            feedback_end[i] = now+wall
+        now += wall
+    return {'rise': rise, 'rise_end': rise_end, 'feedback': feedback, 'feedback_end': feedback_end,
+            'frame_t': np.zeros(0), 'frame_trial': np.zeros(0, dtype=np.int32),
+            'source': 'phases (approximate)'}
+
+
+def stop_signal_frames(times, ssd):
+    """Time of the first frame drawn at or after the SSD of each trial (NaN if there was none)"""
+    frame_t, frame_trial = times['frame_t'], times['frame_trial']
+    due = frame_t >= times['rise'][frame_trial]+ssd[frame_trial]
+    return _first(frame_t[due], frame_trial[due], len(ssd))
+
+
+def _value(value):
+    if isinstance(value, float):
+        return 'n/a' if np.isnan(value) else '%.4f' % value
+    return '%s' % value
+
+
+def session_events(trials, times):
+    """The rows of the events file (lists in COLUMNS order), sorted by onset"""
+    ssd, rt = trials['ssd'], trials['rt']
+    stop_frame = stop_signal_frames(times, np.nan_to_num(ssd, nan=np.inf))
+    rows = []
+    for i, trial in enumerate(trials):
+        rise = times['rise'][i]
+        if np.isnan(rise):
+            continue
+        extra = [int(trial['block']), int(trial['trial']), str(trial['trialType']),
+                 'stop' if trial['signal'] == 1 else 'go', int(trial['response']), float(ssd[i]), float(rt[i])]
+        rows.append([rise, times['rise_end'][i]-rise, 'trial']+extra)
+        if trial['signal'] == 1 and not np.isnan(ssd[i]) and not rt[i] < ssd[i]:
+            onset = stop_frame[i] if not np.isnan(stop_frame[i]) else rise+ssd[i]
+            rows.append([onset, 0., 'stop_signal']+extra)
+        if not np.isnan(rt[i]):
+            rows.append([rise+rt[i], 0., 'lift']+extra)
+        if not np.isnan(times['feedback'][i]):
+            rows.append([times['feedback'][i], times['feedback_end'][i]-times['feedback'][i], 'feedback']+extra)
+    rows.sort(key=lambda row: row[0])
+    return rows
+
+
+def sidecar(source):
+    description = dict(_SIDECAR)
+    description['onset'] = dict(_SIDECAR['onset'], Description='Onset of the event on the task clock '
+                                '(PsychoPy log time); taken from the %s' % (
+                                    'DEBUG log and its frame trace' if source == 'log' else
+                                    '.phases file (approximate)'))
+    return description
+
+
+def _write(path, text):
+    tmp = path+'.tmp'
+    with open(tmp, 'w') as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def convert_session(entry, bids_dir, data_dir='data'):
+    """Write the events.tsv and events.json of one session (an entry of
+    osari_data.session_index); returns (path of the events.tsv, timing source, number of events)"""
+    trials = osari_data.read_txt(entry['txt'])
+    if entry.get('log'):
+        times = times_from_log(entry['log'], len(trials))
+    elif os.path.exists(phases_path(entry, data_dir)):
+        info = osari_data.read_csv_info(entry['csv']) if entry.get('csv') else {}
+        times = times_from_phases(phases_path(entry, data_dir), len(trials),
+                                  info.get('Trial by trial feedback', 'True') != 'False')
+    else:
+        raise NoTiming('no .log or .phases file to time the events with')
+    rows = session_events(trials, times)
+    path = events_path(entry, bids_dir)
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    _write(path, '\t'.join(COLUMNS)+'\n'+''.join('\t'.join(_value(v) for v in row)+'\n' for row in rows))
+    _write(path[:-len('.tsv')]+'.json', json.dumps(sidecar(times['source']), indent=1))
+    return path, times['source'], len(rows)
+
+
+def sources(entry, data_dir):
+    """The files a session is converted from, with their size and modification time"""
+    return osari_data.file_signature([entry['txt'], entry.get('log'), entry.get('csv'),
+                                      phases_path(entry, data_dir)])
+
+
+def _convert_job(args):
+    entry, bids_dir, data_dir = args
+    start = time.time()
+    try:
+        path, source, n = convert_session(entry, bids_dir, data_dir)
+        return entry['session'], 'converted', '%s events from the %s' % (n, source), time.time()-start
+    except NoTiming as err:
+        return entry['session'], 'no timing', str(err), time.time()-start
+    except Exception as err:
+        return entry['session'], 'error', '%s: %s' % (type(err).__name__, err), time.time()-start
+
+
+def convert_archive(data_dir='data', bids_dir='bids', n_jobs=None, force=False):
+    """Convert every session in "data_dir" that has a .txt file
+
+    Sessions whose source files are unchanged since the manifest was written (and
+    whose events file exists) are skipped. Returns a list of (session, status,
+    message, seconds) with status one of 'converted', 'skipped', 'no timing' or 'error'.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    if not os.path.exists(bids_dir):
+        os.makedirs(bids_dir)
+    description = os.path.join(bids_dir, 'dataset_description.json')
+    if not os.path.exists(description):
+        _write(description, json.dumps({'Name': 'OSARI', 'BIDSVersion': BIDS_VERSION, 'DatasetType': 'raw'},
+                                       indent=1))
+    manifest_path = os.path.join(bids_dir, MANIFEST)
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+    results = []
+    jobs = []
+    signatures = {}
+    for entry in osari_data.session_index(data_dir):
+        if not entry['txt']:
+            continue
+        signatures[entry['session']] = sources(entry, data_dir)
+        known = manifest.get(entry['session'])
+        if not force and known and known['sources'] == signatures[entry['session']] and \
+                os.path.exists(os.path.join(bids_dir, known['events'])):
+            results.append((entry['session'], 'skipped', '', 0.))
+        else:
+            jobs.append((entry, bids_dir, data_dir))
+    if jobs:
+        with ProcessPoolExecutor(n_jobs) as pool:
+            results += list(pool.map(_convert_job, jobs, chunksize=8))
+
+    entries = dict((job[0]['session'], job[0]) for job in jobs)
+    for session, status, _, _ in results:
+        if status == 'converted':
+            manifest[session] = {'sources': signatures[session],
+                                 'events': os.path.relpath(events_path(entries[session], bids_dir), bids_dir)}
+        elif status in ('error', 'no timing'):
+            manifest.pop(session, None)
+    _write(manifest_path, json.dumps(manifest, indent=1, sort_keys=True))
+    return results
+
+
+if __name__ == '__main__':
+    import sys
+    started = time.time()
+    results = convert_archive(*sys.argv[1:3])
+    counts = {}
+    for r in results:
+        counts[r[1]] = counts.get(r[1], 0)+1
+    print('%s in %.1f s' % (', '.join('%s %s' % (n, status) for status, n in sorted(counts.items())),
+                            time.time()-started))
+    for session, status, message, _ in results:
+        if status == 'error':
+            print('  %s: %s' % (session, message))
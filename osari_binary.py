@@ -0,0 +1,235 @@
+"""
+OSARI binary session files (.osari)
+
+A typed, columnar copy of a session's trials and settings, written by the task next
+to the .txt and .csv files, so that analysis code can load sessions without parsing
+any text ('NaN' strings, 'True'/'False' columns ...).
+
+File layout (all numbers little endian):
+
+    bytes 0-7      magic b'OSARIBIN'
+    bytes 8-9      format version (uint16)
+    bytes 10-11    reserved
+    bytes 12-15    length of the JSON header in bytes (uint32)
+    bytes 16-23    offset of the first column (uint64), a multiple of 64
+    bytes 24-      JSON header (utf-8):
+                       'version', 'n_trials',
+                       'columns': [{'name', 'dtype', 'offset', 'nbytes'}, ...]
+                                  (offsets relative to the first column)
+                       'categories': {column name: [labels]} for text columns, which
+                                  are stored as integer codes
+                       'expInfo', 'taskInfo_brief', 'taskInfo', 'extra'
+    then           one contiguous array per column, each starting on a 64 byte boundary
+
+Columns hold real NaN floats for missing SSDs and RTs, so a column can be used
+straight from a memory map:
+
+    f = SessionFile('data/s_123_OSARI_2020_Jul_19_1307.osari')
+    f.column('rt')          # np.memmap view, nothing is parsed
+    f.trials()              # osari_data.TRIAL_DTYPE array
+    f.meta['taskInfo_brief']
+
+Existing data folders can be converted in parallel with
+
+    python osari_binary.py data
+"""
+from __future__ import absolute_import, division
+import ast
+import json
+import os
+import struct
+import numpy as np
+
+import osari_data
+
+MAGIC = b'OSARIBIN'
+VERSION = 1
+EXTENSION = '.osari'
+_preamble = struct.Struct('<8sHHIQ')
+_align = 64
+
+# the participant info fields (anything else in the csv comes from taskInfo_brief)
+EXPINFO_KEYS = ('Participant ID', 'Age (Years)', 'Sex', 'Default parameters?', 'date', 'frameRate')
+
+
+def _json_default(value):
+    # numpy scalars (e.g. the measured frame rate) and arrays
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    return str(value)
+
+
+def _pad(n):
+    return (-n) % _align
+
+
+def write(path, columns, expInfo=None, taskInfo_brief=None, taskInfo=None, extra=None):
+    """Write a session file
+
+    "columns" maps column name to a 1d array (or list); text columns are stored as
+    integer codes. "extra" is any further (JSON serialisable) metadata. The file
+    is written to a temporary name and then moved into place, so readers never see
+    a half written file.
+    """
+    names = list(columns)
+    arrays = []
+    categories = {}
+    for name in names:
+        values = np.asarray(columns[name])
+        if values.dtype.kind in 'USO':
+            labels, codes = np.unique(values.astype(str), return_inverse=True)
+            categories[name] = labels.tolist()
+            values = codes.astype(np.int16)
+        arrays.append(np.ascontiguousarray(values, dtype=values.dtype.newbyteorder('<')))
+    lengths = set(len(a) for a in arrays)
+    if len(lengths) > 1:
+        raise ValueError('All columns must have the same length')
+
+    offset = 0
+    descr = []
+    for name, values in zip(names, arrays):
+        descr.append({'name': name, 'dtype': values.dtype.str, 'offset': offset, 'nbytes': values.nbytes})
+        offset += values.nbytes+_pad(values.nbytes)
+    header = json.dumps({'version': VERSION,
+                         'n_trials': lengths.pop() if lengths else 0,
+                         'columns': descr,
+                         'categories': categories,
+                         'expInfo': expInfo or {},
+                         'taskInfo_brief': taskInfo_brief or {},
+                         'taskInfo': taskInfo or {},
+                         'extra': extra or {}}, default=_json_default).encode('utf-8')
+    data_offset = _preamble.size+len(header)
+    data_offset += _pad(data_offset)
+
+    tmp = path+'.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(_preamble.pack(MAGIC, VERSION, 0, len(header), data_offset))
+        f.write(header)
+        f.write(b'\0'*(data_offset-_preamble.size-len(header)))
+        for values in arrays:
+            f.write(values.tobytes())
+            f.write(b'\0'*_pad(values.nbytes))
+    os.replace(tmp, path)
+
+
+def write_trials(path, trials, expInfo=None, taskInfo_brief=None, taskInfo=None):
+    """Write a TRIAL_DTYPE array (or a list of 7-tuples in .txt column order)"""
+    if not isinstance(trials, np.ndarray):
+        trials = np.array([tuple(row) for row in trials], dtype=osari_data.TRIAL_DTYPE)
+    write(path, dict((name, trials[name]) for name in trials.dtype.names),
+        expInfo, taskInfo_brief, taskInfo)
+
+
+class SessionFile(object):
+    """Read access to a .osari file
+
+    With mmap=True (default) the columns are views of a read only memory map of the
+    file, so only the columns that are used are ever read from disk.
+    """
+
+    def __init__(self, path, mmap=True):
+        self.path = path
+        with open(path, 'rb') as f:
+            magic, version, _, header_len, data_offset = _preamble.unpack(f.read(_preamble.size))
+            if magic != MAGIC:
+                raise ValueError('%s is not an OSARI binary file' % path)
+            if version > VERSION:
+                raise ValueError('%s was written by a newer version (%s) of the format' % (path, version))
+            self.meta = json.loads(f.read(header_len).decode('utf-8'))
+            if not mmap:
+                f.seek(0)
+                self._buffer = np.frombuffer(f.read(), dtype=np.uint8)
+        if mmap:
+            self._buffer = np.memmap(path, dtype=np.uint8, mode='r')
+        self.version = version
+        self.n_trials = self.meta['n_trials']
+        self._data_offset = data_offset
+        self._columns = dict((c['name'], c) for c in self.meta['columns'])
+
+    @property
+    def columns(self):
+        return [c['name'] for c in self.meta['columns']]
+
+    def column(self, name, decode=False):
+        """The values of one column (text columns as integer codes unless decode=True)"""
+        c = self._columns[name]
+        start = self._data_offset+c['offset']
+        values = self._buffer[start:start+c['nbytes']].view(np.dtype(c['dtype']))
+        if decode and name in self.meta['categories']:
+            return np.array(self.meta['categories'][name])[values]
+        return values
+
+    def trials(self):
+        """The trials as an osari_data.TRIAL_DTYPE array"""
+        trials = np.zeros(self.n_trials, dtype=osari_data.TRIAL_DTYPE)
+        for name in trials.dtype.names:
+            if name in self._columns:
+                trials[name] = self.column(name, decode=True)
+        return trials
+
+
+def read_trials(path):
+    return SessionFile(path).trials()
+
+
+def _parse_value(value):
+    """Turn a csv cell back into the Python value it was written from"""
+    try:
+        return ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        return value
+
+
+def convert_session(entry, out_dir=None, force=False):
+    """Convert one entry of osari_data.session_index to a .osari file
+
+    Returns the path written, or None if the file was already up to date.
+    """
+    out_dir = out_dir or os.path.dirname(entry['txt'])
+    if entry['date']:
+        name = 's_%s_OSARI_%s%s' % (entry['participant'], entry['date'], EXTENSION)
+    else:
+        name = entry['session']+EXTENSION
+    path = os.path.join(out_dir, name)
+    sources = [p for p in (entry['txt'], entry['csv']) if p]
+    if not force and os.path.exists(path) and \
+            os.path.getmtime(path) >= max(os.path.getmtime(p) for p in sources):
+        return None
+    info = osari_data.read_csv_info(entry['csv']) if entry['csv'] else {}
+    expInfo = dict((k, _parse_value(v)) for k, v in info.items() if k in EXPINFO_KEYS)
+    taskInfo_brief = dict((k, _parse_value(v)) for k, v in info.items() if k not in EXPINFO_KEYS)
+    write_trials(path, osari_data.read_txt(entry['txt']), expInfo, taskInfo_brief)
+    return path
+
+
+def _convert(args):
+    entry, out_dir, force = args
+    try:
+        return entry['session'], convert_session(entry, out_dir, force), None
+    except Exception as err:
+        return entry['session'], None, '%s: %s' % (type(err).__name__, err)
+
+
+def convert_archive(data_dir='data', out_dir=None, n_jobs=None, force=False):
+    """Convert every session in "data_dir" that has a .txt file, in parallel
+
+    Sessions whose .osari file is newer than their .txt and .csv are skipped.
+    Returns a list of (session, path written or None, error or None).
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    if out_dir and not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    jobs = [(entry, out_dir, force) for entry in osari_data.session_index(data_dir) if entry['txt']]
+    with ProcessPoolExecutor(n_jobs) as pool:
+        return list(pool.map(_convert, jobs, chunksize=16))
+
+
+if __name__ == '__main__':
+    import sys
+    results = convert_archive(*sys.argv[1:3])
+    written = [r for r in results if r[1]]
+    failed = [r for r in results if r[2]]
+    print('Converted %s sessions (%s up to date, %s failed)' % (
+        len(written), len(results)-len(written)-len(failed), len(failed)))
+    for session, _, error in failed:
+        print('  %s: %s' % (session, error))
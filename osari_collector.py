@@ -0,0 +1,177 @@
+"""
+OSARI result collector
+
+The receiving end of osari_sink.py: a TCP server that stores the batches sent by
+the testing computers in an SQLite database, one row per trial.
+
+    python osari_collector.py results.sqlite 8766
+
+Tables:
+
+    sessions    session, info (JSON: expInfo, taskInfo_brief ...), received
+    trials      session, block, trialType, trial, signal, response, ssd, rt, extra
+                (the TRIAL_DTYPE columns; any other fields of a trial record go into
+                extra as JSON)
+    batches     session, seq, kind, n, received - every batch stored, so that a
+                batch sent twice (e.g. from a spool after a lost acknowledgement) is
+                only stored once
+
+A batch is acknowledged ("ok <seq>") only after its transaction has been
+committed. export_sessions() writes every session in the database to a .osari
+file (see osari_binary.py), for the analysis helpers that read data folders:
+
+    python osari_collector.py results.sqlite --export data_collected
+"""
+from __future__ import absolute_import, division
+import json
+import os
+import sqlite3
+import threading
+import time
+import numpy as np
+
+import osari_binary
+import osari_data
+
+try:
+    import socketserver
+except ImportError:  # Python 2
+    import SocketServer as socketserver
+
+SCHEMA = '''
+create table if not exists sessions (session text primary key, info text, received real);
+create table if not exists trials (session text, block integer, trialType text, trial integer,
+    signal integer, response integer, ssd real, rt real, extra text);
+create index if not exists trials_session on trials (session);
+create table if not exists batches (session text, seq text, kind text, n integer, received real,
+    primary key (session, seq));
+'''
+
+
+class Store(object):
+    """The SQLite database, shared by the connection threads"""
+
+    def __init__(self, path):
+        self.path = path
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def add(self, message):
+        """Store one batch; returns False if it had been stored before"""
+        session, seq, kind, records = message['session'], str(message['seq']), message['kind'], message['records']
+        now = time.time()
+        with self._lock, self._db:
+            try:
+                self._db.execute('insert into batches values (?, ?, ?, ?, ?)', (session, seq, kind, len(records), now))
+            except sqlite3.IntegrityError:
+                return False
+            if kind == 'session':
+                for info in records:
+                    self._db.execute('insert or replace into sessions values (?, ?, ?)',
+                        (session, json.dumps(info), now))
+            elif kind == 'trial':
+                names = osari_data.TRIAL_DTYPE.names
+                self._db.executemany('insert into trials values (?, ?, ?, ?, ?, ?, ?, ?, ?)', [
+                    (session,)+tuple(r.get(n) for n in names)+
+                    (json.dumps(dict((k, v) for k, v in r.items() if k not in names)),)
+                    for r in records])
+            else:
+                raise ValueError('unknown batch kind %r' % kind)
+        return True
+
+    def sessions(self):
+        with self._lock:
+            return [row[0] for row in self._db.execute(
+                'select session from sessions union select session from trials order by 1')]
+
+    def trials(self, session):
+        """The trials of one session as an osari_data.TRIAL_DTYPE array, in the order received"""
+        with self._lock:
+            rows = self._db.execute('select block, trialType, trial, signal, response, ssd, rt from trials '
+                                    'where session = ? order by rowid', (session,)).fetchall()
+        # missing values: NaN for the float columns, -1 for the integer ones
+        kinds = [osari_data.TRIAL_DTYPE[n].kind for n in osari_data.TRIAL_DTYPE.names]
+        missing = [np.nan if k == 'f' else -1 if k == 'i' else '' for k in kinds]
+        return np.array([tuple(m if v is None else v for v, m in zip(row, missing)) for row in rows],
+                        dtype=osari_data.TRIAL_DTYPE)
+
+    def info(self, session):
+        with self._lock:
+            row = self._db.execute('select info from sessions where session = ?', (session,)).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def close(self):
+        self._db.close()
+
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                message = json.loads(line.decode('utf-8'))
+                self.server.store.add(message)
+            except (ValueError, KeyError, TypeError, sqlite3.Error) as err:
+                self.wfile.write(('error %s\n' % err).encode('utf-8'))
+                continue
+            self.wfile.write(('ok %s\n' % message['seq']).encode('utf-8'))
+
+
+class Collector(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """TCP server writing the batches it receives into a Store"""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, path, port=8766, host='127.0.0.1'):
+        socketserver.TCPServer.__init__(self, (host, port), _Handler)
+        self.store = Store(path)
+
+    def start(self):
+        """Serve from a background thread (e.g. for testing); returns the thread"""
+        thread = threading.Thread(target=self.serve_forever, name='OSARI collector')
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self.store.close()
+
+
+def export_sessions(path, out_dir):
+    """Write every session in the database at "path" to a .osari file in "out_dir" """
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    store = Store(path)
+    written = []
+    for session in store.sessions():
+        info = store.info(session)
+        out = os.path.join(out_dir, session+osari_binary.EXTENSION)
+        osari_binary.write_trials(out, store.trials(session), info.get('expInfo'), info.get('taskInfo_brief'),
+            info.get('taskInfo'))
+        written.append(out)
+    store.close()
+    return written
+
+
+if __name__ == '__main__':
+    import sys
+    path = sys.argv[1] if len(sys.argv) > 1 else 'results.sqlite'
+    if len(sys.argv) > 3 and sys.argv[2] == '--export':
+        print('Exported %s sessions' % len(export_sessions(path, sys.argv[3])))
+        sys.exit()
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else 8766
+    host = sys.argv[3] if len(sys.argv) > 3 else '0.0.0.0'
+    collector = Collector(path, port, host)
+    print('Collecting into %s on port %s (ctrl+c to stop)' % (path, port))
+    try:
+        collector.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        collector.server_close()
+        collector.store.close()
@@ -0,0 +1,115 @@
+"""
+OSARI conditions specs
+
+Instead of a conditions .csv file with one row per trial, the trials of a block
+can be described by a few numbers in a JSON spec file, e.g. TestConditionsSpec.json:
+
+    {"blocks": [
+        {"name": "testBlocks",
+         "n_trials": 64,
+         "stop_proportion": 0.25,                  (or "n_stop": 16)
+         "repeat": 3,                              (number of blocks like this one)
+         "fixedStopTime": [0.2, 0.25, 0.3, 0.35],  (SSDs for the 'fixed' method,
+                                                    cycled over the stop trials)
+         "columns": {"tmsOffset": [0.1, 0.15]}}    (any further columns, a value or
+    ]}                                              a list cycled over the trials)
+
+Like TestConditions.csv, the go trials (Signal 0) come first and the stop trials
+(Signal 1) after them; the trial order is set by the schedule (osari_schedule.py).
+
+A block is a Conditions object, a read only sequence that can stand in for the list
+returned by data.importConditions: conditions[i] builds the dict of row i when it
+is asked for, and nothing is stored per row, so reading a spec takes the same time
+however many trials it describes. Whole columns come out as arrays with
+conditions.column(name).
+
+    blocks = osari_conditions.load_spec('TestConditionsSpec.json')  # [(name, Conditions), ...]
+"""
+from __future__ import absolute_import, division
+import json
+import numpy as np
+
+try:
+    from collections.abc import Sequence
+except ImportError:  # Python 2
+    from collections import Sequence
+
+
+class Conditions(Sequence):
+    """The trials of one block, generated from a spec (see the module docstring)"""
+
+    def __init__(self, n_trials, n_stop=None, stop_proportion=None, fixedStopTime=None, columns=None, name=None):
+        if n_stop is None:
+            n_stop = int(round(n_trials*(stop_proportion or 0)))
+        if not 0 <= n_stop <= n_trials:
+            raise ValueError('A block of %s trials cannot have %s stop trials' % (n_trials, n_stop))
+        self.name = name
+        self.n_trials = int(n_trials)
+        self.n_stop = int(n_stop)
+        self.n_go = self.n_trials-self.n_stop
+        self.fixedStopTime = list(fixedStopTime) if fixedStopTime is not None else None
+        self.extra = dict(columns or {})
+        self.keys = ['Signal']+(['fixedStopTime'] if self.fixedStopTime else [])+list(self.extra)
+
+    @property
+    def spec(self):
+        """The spec this block was made from (JSON serialisable)"""
+        spec = {'name': self.name, 'n_trials': self.n_trials, 'n_stop': self.n_stop}
+        if self.fixedStopTime:
+            spec['fixedStopTime'] = self.fixedStopTime
+        if self.extra:
+            spec['columns'] = self.extra
+        return spec
+
+    def __len__(self):
+        return self.n_trials
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(self.n_trials))]
+        if i < 0:
+            i += self.n_trials
+        if not 0 <= i < self.n_trials:
+            raise IndexError('trial %s of a block of %s' % (i, self.n_trials))
+        signal = int(i >= self.n_go)
+        row = {'Signal': signal}
+        if self.fixedStopTime:
+            row['fixedStopTime'] = self.fixedStopTime[(i-self.n_go) % len(self.fixedStopTime)] if signal else None
+        for name, values in self.extra.items():
+            row[name] = values[i % len(values)] if isinstance(values, list) else values
+        return row
+
+    def column(self, name, rows=None):
+        """The values of one column for all trials (or for the trials in "rows") as an array"""
+        rows = np.arange(self.n_trials) if rows is None else np.asarray(rows)
+        signal = (rows >= self.n_go).astype(np.int64)
+        if name == 'Signal':
+            return signal
+        if name == 'fixedStopTime' and self.fixedStopTime:
+            values = np.asarray(self.fixedStopTime, dtype=np.float64)
+            return np.where(signal == 1, values[(rows-self.n_go) % len(values)], np.nan)
+        if name in self.extra:
+            values = self.extra[name]
+            if isinstance(values, list):
+                return np.asarray(values)[rows % len(values)]
+            return np.full(len(rows), values)
+        raise KeyError(name)
+
+    def __repr__(self):
+        return 'Conditions(%s)' % ', '.join('%s=%r' % kv for kv in sorted(self.spec.items()))
+
+
+def from_spec(spec):
+    """[(name, Conditions), ...] for every block of a spec (a dict), repeats expanded"""
+    blocks = []
+    for block in spec['blocks']:
+        block = dict(block)
+        repeat = block.pop('repeat', 1)
+        conditions = Conditions(**block)
+        blocks += [(conditions.name, conditions)]*repeat
+    return blocks
+
+
+def load_spec(path):
+    with open(path) as f:
+        return from_spec(json.load(f))
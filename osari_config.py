@@ -0,0 +1,288 @@
+"""
+OSARI config file launch
+
+Starts the task without the dialogs, for unattended or scripted launches (e.g. a
+fleet of testing computers). The settings come from a JSON (or, with Python 3.11+ or
+the tomli package, TOML) file with any of the three sections of the task's settings:
+
+    {"expInfo":         {"Sex": "Prefer not to say"},
+     "taskInfo_brief":  {"Method": "staircase", "Number of Test Blocks": 4, "Full Screen": true},
+     "taskInfo":        {"Bar width (cm)": 4, "trial length (max trial duration in seconds)": 1.2},
+     "queue":           "participants_queue.csv"}
+
+Anything not in the file keeps the value set in OSARI_time_v1.8.py, so a config only
+needs the settings it changes (see osari_kiosk.json). Every name and value is checked
+against SCHEMA before the task starts: unknown names (with the nearest known name),
+values of the wrong type, options that are not allowed (e.g. "Method") and a lowest
+SSD above the highest are all reported together.
+
+The participant comes from the command line or from a queue file (a csv with a
+"Participant ID" column and optionally "Age (Years)" and "Sex"); each launch runs the
+participant of the first row of the queue, and the row is only moved to <queue>.done
+(by take_participant) once the session has saved its data, so a launch that crashes
+or is quit leaves the participant at the front of the queue for the next one:
+
+    python OSARI_time_v1.8.py --config osari_kiosk.json --participant 123 --age 25 --sex F
+    python OSARI_time_v1.8.py --config osari_kiosk.json --queue participants_queue.csv
+
+The Participant ID is kept as text, as in OSARI_time_v1.8_IL.py, so IDs such as
+"007" or "P12" work with either script.
+
+The quantities that follow from the settings (the bar top, the target line and the
+time to reach it) are computed in one place, derived(), for the task and the render
+benchmark. To check a config file and print the settings it gives:
+
+    python osari_config.py osari_kiosk.json
+"""
+from __future__ import absolute_import, division
+import csv
+import difflib
+import json
+import os
+
+NUMBER = 'number'
+TEXT = 'text'
+BOOL = 'bool'
+INTEGER = 'integer'
+ANY = 'any'
+
+# name -> (type, allowed options or None, may be null)
+SCHEMA = {
+    'expInfo': {
+        'Participant ID': (TEXT, None, False),
+        'Age (Years)': (NUMBER, None, False),
+        'Sex': (TEXT, ['F', 'M', 'Prefer not to say'], False),
+    },
+    'taskInfo_brief': {
+        'Practice trials': (BOOL, None, False),
+        'Count down': (BOOL, None, False),
+        'Trial by trial feedback': (BOOL, None, False),
+        'Method': (TEXT, ['staircase', 'fixed', 'psi'], False),
+        'Trial order': (TEXT, ['random', 'sequential'], False),
+        'Step size (s)': (NUMBER, None, False),
+        'Lowest SSD (s)': (NUMBER, None, False),
+        'Highest SSD (s)': (NUMBER, None, False),
+        'Total bar height (in cm)': (NUMBER, None, False),
+        'Number of Test Blocks': (INTEGER, None, False),
+        'Spaceship': (BOOL, None, False),
+        'Full Screen': (BOOL, None, False),
+    },
+    'taskInfo': {
+        'Bar base below fixation (cm)': (NUMBER, None, False),
+        'Bar width (cm)': (NUMBER, None, False),
+        'Bar top above fixation (cm)': (NUMBER, None, False),
+        'Target line width (cm)': (NUMBER, None, False),
+        'Target line above fixation (cm)': (NUMBER, None, False),
+        'rise velocity (cm/sec)': (NUMBER, None, False),
+        'StopS start pos. (ms)': (NUMBER, None, False),
+        'trial length (max trial duration in seconds)': (NUMBER, None, False),
+        'StopS start pos. (seconds)': (NUMBER, None, False),
+        'Warm start SSD': (BOOL, None, False),
+        'Staircases': (ANY, None, True),
+        'Schedule seed': (INTEGER, None, True),
+        'Max stop trials in a row': (INTEGER, None, True),
+        'No stop trial first': (BOOL, None, False),
+        'Conditions spec': (TEXT, None, True),
+        'Monitor port': (INTEGER, None, True),
+        'Collector': (TEXT, None, True),
+        'Timing report': (BOOL, None, False),
+        'Profile bar rise': (BOOL, None, False),
+        'End video': (TEXT, None, True),
+        'Alerts': (ANY, None, True),
+    },
+}
+SECTIONS = ('expInfo', 'taskInfo_brief', 'taskInfo')
+# settings that must be above 0
+POSITIVE = ('Step size (s)', 'Total bar height (in cm)', 'Number of Test Blocks', 'Bar width (cm)',
+            'trial length (max trial duration in seconds)')
+# the target line is at this proportion of the bar (and of the trial length)
+TARGET = .8
+
+
+class ConfigError(ValueError):
+    """A config file with unknown names or values that are not allowed"""
+
+
+def _type_ok(kind, value):
+    if kind == ANY:
+        return True
+    if kind == BOOL:
+        return isinstance(value, bool)
+    if kind == TEXT:
+        return isinstance(value, str)
+    if isinstance(value, bool):
+        return False
+    if kind == INTEGER:
+        return isinstance(value, int)
+    return isinstance(value, (int, float))
+
+
+def validate(config):
+    """The problems with a config (a list of messages, empty if there are none)"""
+    problems = []
+    for section in config:
+        if section not in SECTIONS+('queue',):
+            problems.append('unknown section "%s" (sections: %s, queue)' % (section, ', '.join(SECTIONS)))
+    for section in SECTIONS:
+        values = config.get(section, {})
+        if not isinstance(values, dict):
+            problems.append('"%s" should be a table of settings' % section)
+            continue
+        schema = SCHEMA[section]
+        for name, value in values.items():
+            if name not in schema:
+                close = difflib.get_close_matches(name, list(schema), n=1)
+                problems.append('%s: unknown setting "%s"%s' % (
+                    section, name, ' (did you mean "%s"?)' % close[0] if close else ''))
+                continue
+            kind, options, nullable = schema[name]
+            if value is None:
+                if not nullable:
+                    problems.append('%s: "%s" can not be null' % (section, name))
+            elif not _type_ok(kind, value):
+                problems.append('%s: "%s" should be %s %s, not %r' % (
+                    section, name, 'an' if kind[0] in 'aeiou' else 'a', kind, value))
+            elif options is not None and value not in options:
+                problems.append('%s: "%s" should be one of %s, not %r' % (section, name, ', '.join(options), value))
+            elif name in POSITIVE and value <= 0:
+                problems.append('%s: "%s" should be above 0' % (section, name))
+    brief = config.get('taskInfo_brief', {})
+    if isinstance(brief, dict) and _type_ok(NUMBER, brief.get('Lowest SSD (s)')) and \
+            _type_ok(NUMBER, brief.get('Highest SSD (s)')) and brief['Lowest SSD (s)'] >= brief['Highest SSD (s)']:
+        problems.append('taskInfo_brief: "Lowest SSD (s)" should be below "Highest SSD (s)"')
+    if 'queue' in config and not isinstance(config['queue'], str):
+        problems.append('"queue" should be the path of a csv file')
+    return problems
+
+
+def read(path):
+    """A config file (JSON, or TOML if the name ends in .toml), validated"""
+    if path.endswith('.toml'):
+        try:
+            import tomllib
+        except ImportError:
+            try:
+                import tomli as tomllib
+            except ImportError:
+                raise ConfigError('reading %s needs Python 3.11+ or the tomli package' % path)
+        with open(path, 'rb') as f:
+            config = tomllib.load(f)
+    else:
+        with open(path) as f:
+            config = json.load(f)
+    if not isinstance(config, dict):
+        raise ConfigError('%s: the config should be a table of sections' % path)
+    problems = validate(config)
+    if problems:
+        raise ConfigError('%s:\n  %s' % (path, '\n  '.join(problems)))
+    return config
+
+
+def _read_queue(queue):
+    """The header and the rows of a queue file"""
+    if not os.path.isfile(queue):
+        raise ConfigError('%s: no such queue file' % queue)
+    with open(queue, newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        rows = [row for row in reader if any(row)]
+    if header is None or 'Participant ID' not in header:
+        raise ConfigError('%s: the queue needs a "Participant ID" column' % queue)
+    if not rows:
+        raise ConfigError('%s: no participants left in the queue' % queue)
+    return header, rows
+
+
+def next_participant(queue):
+    """The first row of a queue file (it stays in the queue until take_participant)"""
+    header, rows = _read_queue(queue)
+    participant = dict((name, value) for name, value in zip(header, rows[0]) if value != '')
+    if 'Age (Years)' in participant:
+        try:
+            age = float(participant['Age (Years)'])
+        except ValueError:
+            raise ConfigError('%s: the age of participant %s should be a number, not %r' % (
+                queue, participant['Participant ID'], participant['Age (Years)']))
+        participant['Age (Years)'] = int(age) if age == int(age) else age
+    return participant
+
+
+def take_participant(queue, participant_id):
+    """Move the first row of a queue file with this Participant ID to <queue>.done (at
+    the end of the participant's session, once the data are saved)"""
+    header, rows = _read_queue(queue)
+    column = header.index('Participant ID')
+    taken = [i for i, row in enumerate(rows) if len(row) > column and row[column] == str(participant_id)]
+    if not taken:
+        raise ConfigError('%s: participant %s is not in the queue' % (queue, participant_id))
+    done = queue+'.done'
+    new_done = not os.path.exists(done)
+    with open(done, 'a', newline='') as f:
+        writer = csv.writer(f)
+        if new_done:
+            writer.writerow(header)
+        writer.writerow(rows[taken[0]])
+    tmp = queue+'.tmp'
+    with open(tmp, 'w', newline='') as f:
+        csv.writer(f).writerows([header]+rows[:taken[0]]+rows[taken[0]+1:])
+    os.replace(tmp, queue)
+
+
+def from_command_line(argv):
+    """The config given with --config (with the participant in its expInfo, and in
+    "queue" the queue file the participant came from, if any), or None if the task was
+    started without one"""
+    import argparse
+    parser = argparse.ArgumentParser(description='Start OSARI from a config file, without the dialogs')
+    parser.add_argument('--config', help='JSON or TOML file with expInfo, taskInfo_brief and taskInfo settings')
+    parser.add_argument('--participant', help='Participant ID')
+    parser.add_argument('--age', type=float, help='Age (Years)')
+    parser.add_argument('--sex', help='Sex (F, M or "Prefer not to say")')
+    parser.add_argument('--queue', help='csv file of participants to take the next one from')
+    args, _ = parser.parse_known_args(argv)
+    if args.config is None:
+        return None
+    config = read(args.config)
+    expInfo = dict(config.get('expInfo', {}))
+    queue = args.queue or config.get('queue')
+    if args.participant is not None:
+        expInfo['Participant ID'] = args.participant
+        queue = None
+    elif queue:
+        expInfo.update(next_participant(queue))
+    else:
+        raise ConfigError('give the participant with --participant or a queue file (--queue or "queue")')
+    if args.age is not None:
+        expInfo['Age (Years)'] = int(args.age) if args.age == int(args.age) else args.age
+    if args.sex is not None:
+        expInfo['Sex'] = args.sex
+    if not isinstance(expInfo['Participant ID'], bool) and isinstance(expInfo['Participant ID'], (int, float)):
+        expInfo['Participant ID'] = '%g' % expInfo['Participant ID']
+    problems = validate({'expInfo': expInfo})
+    if problems:
+        raise ConfigError('\n'.join(problems))
+    config['expInfo'] = expInfo
+    config['queue'] = queue
+    return config
+
+
+def derived(taskInfo_brief, taskInfo=None):
+    """The quantities that follow from the settings: 'Bar_top' (cm above the centre of the
+    screen), 'Target_pos' (cm, the target line at TARGET of the bar) and, given taskInfo,
+    'Target_time' (s, the time the bar takes to reach the target line)"""
+    height = taskInfo_brief['Total bar height (in cm)']
+    values = {'Bar_top': height/2, 'Target_pos': TARGET*height-height/2}
+    if taskInfo is not None:
+        values['Target_time'] = TARGET*taskInfo['trial length (max trial duration in seconds)']
+    return values
+
+
+if __name__ == '__main__':
+    import sys
+    config = read(sys.argv[1])
+    for section in SECTIONS:
+        for name, value in sorted(config.get(section, {}).items()):
+            print('%-15s %-45s %r' % (section, name, value))
+    if 'Total bar height (in cm)' in config.get('taskInfo_brief', {}):
+        print(derived(config['taskInfo_brief']))
+    print('%s is valid' % sys.argv[1])
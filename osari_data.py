@@ -0,0 +1,246 @@
+"""
+OSARI data loading helpers
+
+Reads the files written by OSARI_time_v1.8.py into NumPy arrays so that analysis
+code can work on many sessions at once.
+
+    read_txt(path)          -> structured array with one row per trial
+    read_csv_info(path)     -> the participant/task information saved in the ExperimentHandler csv
+                               (both also take an open text file, e.g. from osari_archive.py)
+    session_index(data_dir) -> one entry per session, linking the .txt, .csv, .psydat, .log and .osari files
+    load_sessions(data_dir) -> the session index with the trials (and csv info) loaded
+    stack_trials(sessions)  -> all trials of all sessions in one set of flat arrays
+    file_signature(paths)   -> size and modification time of files, to tell if they changed
+
+Every trial is returned in the unified format used by the current .txt output:
+
+    block   trialType   trial   signal   response   ssd   rt
+
+with signal 0 = Go, 1 = Stop, response 0 = no lift, 1 = lift and 'NaN' entries
+converted to real NaN floats.
+
+Note:
+    Files written by the May 2020 versions of the task (capitalised header
+    "Block TrialType Trial Signal Response RT SSD ...") coded Signal the other way
+    round (1 = Go, 0 = Stop) and stored the trial length as SSD on Go trials.
+    These are converted to the current coding when read.
+"""
+from __future__ import absolute_import, division
+import contextlib
+import csv
+import os
+import re
+import warnings
+import numpy as np
+
+# The columns (and types) of a single trial
+TRIAL_DTYPE = np.dtype([('block', 'i4'),
+                        ('trialType', 'U24'),
+                        ('trial', 'i4'),
+                        ('signal', 'i1'),
+                        ('response', 'i1'),
+                        ('ssd', 'f8'),
+                        ('rt', 'f8')])
+
+# Names given to the test (i.e. non practice) trials across versions of the task
+TEST_TRIAL_TYPES = ('testBlocks', 'main')
+
+# e.g. "OSARI_123_OSARI_2020_Jul_19_1307.txt" or "s_123_OSARI_2020_Jul_19_1307.csv"
+_session_name = re.compile(r'^(?P<prefix>OSARI_ExpH|OSARI|s)_(?P<participant>.+)_OSARI_'
+                           r'(?P<date>\d{4}_[A-Za-z]{3}_\d{2}_\d{4})(?P<rerun>_\d+)?$')
+
+
+def _to_float(value):
+    """'NaN', '' and None become NaN, everything else a float"""
+    if value is None or value == '' or value == 'NaN':
+        return np.nan
+    return float(value)
+
+
+@contextlib.contextmanager
+def _open_text(source, **kwargs):
+    """"source" if it is an open file, else the file at that path"""
+    if hasattr(source, 'read'):
+        yield source
+    else:
+        with open(source, 'r', **kwargs) as f:
+            yield f
+
+
+def read_txt(path):
+    """Read a tab separated OSARI .txt output file into a TRIAL_DTYPE array"""
+    with _open_text(path) as f:
+        lines = f.read().splitlines()
+    path = getattr(path, 'name', path)
+    if not lines:
+        return np.zeros(0, dtype=TRIAL_DTYPE)
+    header = lines[0].split('\t')
+    # a rerun with the same file name appends a second header to the file
+    rows = [line.split('\t') for line in lines[1:] if line.strip() and line != lines[0]]
+    if header[:7] == ['block', 'trialType', 'trial', 'signal', 'response', 'ssd', 'rt']:
+        convert = lambda row: (int(row[0]), row[1], int(row[2]), int(row[3]), int(row[4]),
+            _to_float(row[5]), _to_float(row[6]))
+    elif header[:7] == ['Block', 'TrialType', 'Trial', 'Signal', 'Response', 'RT', 'SSD']:
+        # old format: 1 = Go, 0 = Stop and the SSD of a go trial is the trial length
+        convert = lambda row: (int(row[0]), row[1], int(row[2]), 1-int(row[3]), int(row[4]),
+            _to_float(row[6]) if row[3] == '0' else np.nan, _to_float(row[5]))
+    else:
+        raise ValueError('%s is not an OSARI .txt output file (header: %s)' % (path, lines[0]))
+    trials = np.zeros(len(rows), dtype=TRIAL_DTYPE)
+    n = 0
+    for row in rows:
+        try:
+            trials[n] = convert(row)
+        except (ValueError, IndexError):
+            warnings.warn('Skipping malformed row in %s: %s' % (path, '\t'.join(row)))
+            continue
+        n += 1
+    return trials[:n]
+
+
+def read_csv_info(path):
+    """Return the extraInfo columns (participant and task information) of an ExperimentHandler csv
+
+    These are the same on every row so only the first data row is read. Columns added
+    by the TrialHandlers and the trial data columns are left out.
+    """
+    with _open_text(path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.reader(f)
+        header = next(reader, [])
+        row = next(reader, [])
+    import osari_records
+    # the extraInfo columns come after the trial data columns (from 'rt' on, the
+    # columns of osari_records.RECORD_DTYPE); a session that ended before the first
+    # trial has no data columns
+    start = header.index('rt')+1 if 'rt' in header else 0
+    info = {}
+    for name, value in zip(header[start:], row[start:]):
+        if not name or '.this' in name or name in osari_records.RECORD_DTYPE.names or \
+                name in ('Signal', 'fixedStopTime'):
+            continue
+        info[name] = value
+    return info
+
+
+def parse_session_name(path):
+    """Split an output file name into its session key, participant ID and date
+
+    Returns None if the name does not follow the OSARI naming format.
+    """
+    name = os.path.splitext(os.path.basename(path))[0]
+    match = _session_name.match(name)
+    if match is None:
+        return None
+    return {'session': '%s_OSARI_%s' % (match.group('participant'), match.group('date')),
+            'participant': match.group('participant'),
+            'date': match.group('date'),
+            'rerun': match.group('rerun') is not None}
+
+
+def session_index(data_dir='data'):
+    """Group the files in "data_dir" by session
+
+    Returns a list of dicts sorted by session key, each with the keys 'session',
+    'participant', 'date', 'txt', 'csv', 'psydat', 'log' and 'osari' (a path or None).
+    Where a session was rerun (e.g. "..._1954.csv" and "..._1954_1.csv") the
+    rerun file is used. The log may be compressed (.log.gz); the older parts of a
+    rotated log (.log.1, .log.2 ...) are read with it (see osari_logs.log_parts).
+    """
+    sessions = {}
+    for fname in sorted(os.listdir(data_dir)):
+        stem, ext = os.path.splitext(fname)
+        if ext == '.gz' and stem.endswith('.log'):
+            stem, ext = os.path.splitext(stem)
+        ext = ext[1:]
+        if ext not in ('txt', 'csv', 'psydat', 'log', 'osari'):
+            continue
+        parsed = parse_session_name(stem+'.'+ext)
+        if parsed is None:
+            # files from before the naming format e.g. "ID01_400.txt"
+            if ext not in ('txt', 'osari'):
+                continue
+            parsed = {'session': stem, 'participant': fname.split('_')[0],
+                'date': None, 'rerun': False}
+        entry = sessions.setdefault(parsed['session'], {'session': parsed['session'],
+            'participant': parsed['participant'], 'date': parsed['date'],
+            'txt': None, 'csv': None, 'psydat': None, 'log': None, 'osari': None})
+        if entry[ext] is None or parsed['rerun']:
+            entry[ext] = os.path.join(data_dir, fname)
+    return [sessions[key] for key in sorted(sessions)]
+
+
+def file_signature(paths):
+    """{file name: [size, modification time (ns)]} of those of "paths" that exist
+
+    Incremental tools keep this for the files they read, and redo a session only
+    when it has changed.
+    """
+    signature = {}
+    for path in paths:
+        if path and os.path.exists(path):
+            stat = os.stat(path)
+            signature[os.path.basename(path)] = [stat.st_size, stat.st_mtime_ns]
+    return signature
+
+
+def load_sessions(data_dir='data', index=None):
+    """Load the trials and csv info of every session that has a .txt file
+
+    Each entry of the session index gets a 'trials' (TRIAL_DTYPE array) and an 'info'
+    (dict, empty if there is no csv) key. Where a .osari file at least as new as the
+    .txt file exists it is read instead of the text files.
+    """
+    import osari_binary
+    if index is None:
+        index = session_index(data_dir)
+    sessions = []
+    for entry in index:
+        if entry['txt'] is None and entry['osari'] is None:
+            continue
+        entry = dict(entry)
+        if entry['osari'] and (entry['txt'] is None or
+                os.path.getmtime(entry['osari']) >= os.path.getmtime(entry['txt'])):
+            binary = osari_binary.SessionFile(entry['osari'])
+            entry['trials'] = binary.trials()
+            entry['info'] = dict(binary.meta['expInfo'], **binary.meta['taskInfo_brief'])
+        else:
+            entry['trials'] = read_txt(entry['txt'])
+            entry['info'] = read_csv_info(entry['csv']) if entry['csv'] else {}
+        sessions.append(entry)
+    return sessions
+
+
+def stack_trials(sessions, trial_types=TEST_TRIAL_TYPES):
+    """Stack the trials of many sessions into flat arrays
+
+    Only trials whose trialType is in "trial_types" are kept (all trials if None).
+    Returns a dict of equal length arrays ('participant' holds the index of the
+    participant in the returned 'participants' list) so that a likelihood can be
+    computed over every trial at once and summed per participant with np.bincount.
+    """
+    participants = []
+    lookup = {}
+    parts = []
+    for session in sessions:
+        trials = session['trials']
+        if trial_types is not None:
+            trials = trials[np.isin(trials['trialType'], trial_types)]
+        if not len(trials):
+            continue
+        pid = session['participant']
+        if pid not in lookup:
+            lookup[pid] = len(participants)
+            participants.append(pid)
+        parts.append((np.full(len(trials), lookup[pid], dtype=np.intp), trials))
+    if parts:
+        index = np.concatenate([p[0] for p in parts])
+        trials = np.concatenate([p[1] for p in parts])
+    else:
+        index = np.zeros(0, dtype=np.intp)
+        trials = np.zeros(0, dtype=TRIAL_DTYPE)
+    return {'participants': participants,
+            'participant': index,
+            'signal': trials['signal'].astype(np.int8),
+            'response': trials['response'].astype(np.int8),
+            'ssd': trials['ssd'].astype(np.float64),
+            'rt': trials['rt'].astype(np.float64)}
@@ -0,0 +1,281 @@
+"""
+OSARI hierarchical race model
+
+Fits group (population) and individual stop-signal reaction times (SSRT) to the
+test trials of many participants at once, so that individual estimates are shrunk
+towards the group and group differences (site, diagnosis, age ...) are estimated
+directly rather than by t-tests on per person estimates.
+
+Model:
+    Each participant i has a go process and a stop process that race each other
+
+        go finishing time   ~ Normal(mu_go_i, sd_go_i)
+        stop finishing time ~ Normal(ssd + ssrt_i, sd_stop_i)
+
+    Go trial, lift at rt       : go density at rt
+    Go trial, no lift          : P(go finishing time > trial length)
+    Stop trial, lift at rt     : go density at rt * P(stop finishing time > rt)
+    Stop trial, no lift        : P(stop finishes before go)
+
+    The individual parameters theta_i = (mu_go, log sd_go, ssrt, log sd_stop) are
+    drawn from the population theta_i ~ Normal(X_i B, tau^2), where X is the group
+    design matrix (intercept + covariates).
+
+Fitting:
+    Gibbs sampling. The individual parameters are updated with random walk
+    Metropolis steps (go parameters, then stop parameters) for all participants
+    at once: the likelihood is computed over
+    the stacked trial matrix of every participant in one vectorized pass and summed
+    per participant with np.bincount. B and tau are drawn from their conjugate
+    conditionals. Chains run in parallel worker processes.
+
+Usage:
+    sessions = osari_data.load_sessions('data')
+    design = {'123': {'site': 'Dublin', 'diagnosis': 'control', 'age': 24}, ...}
+    fit = fit_hierarchical(sessions, design, categorical=['site', 'diagnosis'], continuous=['age'])
+    fit['population']  # posterior mean/sd of B for each parameter and design column
+    fit['individual']  # posterior mean/sd of each participant's parameters
+
+If no age is given in "design" it is taken from the 'Age (Years)' column of the
+session's csv file.
+"""
+from __future__ import absolute_import, division
+import multiprocessing
+import numpy as np
+from scipy.special import log_ndtr
+
+import osari_data
+
+PARAMS = ('mu_go', 'log_sd_go', 'ssrt', 'log_sd_stop')
+
+_log_sqrt_2pi = 0.5*np.log(2*np.pi)
+
+
+def design_matrix(participants, design=None, categorical=(), continuous=(), sessions=None):
+    """Build the group design matrix (one row per participant)
+
+    Categorical covariates are dummy coded against their first level, continuous
+    covariates are centred and scaled. Returns the matrix and the column names.
+    """
+    design = dict(design or {})
+    if sessions is not None:
+        # fall back on the age recorded with the session
+        for session in sessions:
+            age = session.get('info', {}).get('Age (Years)')
+            if age not in (None, ''):
+                design.setdefault(session['participant'], {}).setdefault('age', float(age))
+    columns = [np.ones(len(participants))]
+    names = ['intercept']
+    for cov in categorical:
+        values = [str(design.get(p, {}).get(cov)) for p in participants]
+        levels = sorted(set(values))
+        for level in levels[1:]:
+            columns.append(np.array([v == level for v in values], dtype=float))
+            names.append('%s[%s]' % (cov, level))
+    for cov in continuous:
+        values = np.array([float(design.get(p, {}).get(cov, np.nan)) for p in participants])
+        if np.isnan(values).any():
+            missing = [p for p, v in zip(participants, values) if np.isnan(v)]
+            raise ValueError('No %s for participant(s): %s' % (cov, ', '.join(missing)))
+        sd = values.std()
+        columns.append((values-values.mean())/(sd if sd > 0 else 1.))
+        names.append(cov)
+    return np.column_stack(columns), names
+
+
+def trial_loglik(theta, stacked, trial_length=1.):
+    """Log likelihood of every trial in "stacked" given per participant parameters
+
+    "theta" is an (n participants, 4) array; the parameters of each trial are looked
+    up through stacked['participant'] so the whole matrix is handled in one pass.
+    """
+    th = theta[stacked['participant']]
+    mu_go, sd_go = th[:, 0], np.exp(th[:, 1])
+    ssrt, sd_stop = th[:, 2], np.exp(th[:, 3])
+    rt = stacked['rt']
+    ssd = np.where(np.isnan(stacked['ssd']), 0., stacked['ssd'])
+    lifted = stacked['response'] == 1
+    stop = stacked['signal'] == 1
+    rt_ = np.where(lifted, rt, 0.)
+
+    go_density = -_log_sqrt_2pi-np.log(sd_go)-0.5*((rt_-mu_go)/sd_go)**2
+    go_omission = log_ndtr(-(trial_length-mu_go)/sd_go)
+    stop_survival = log_ndtr(-(rt_-ssd-ssrt)/sd_stop)
+    stop_wins = log_ndtr((mu_go-ssd-ssrt)/np.sqrt(sd_go**2+sd_stop**2))
+
+    return np.where(stop,
+        np.where(lifted, go_density+stop_survival, stop_wins),
+        np.where(lifted, go_density, go_omission))
+
+
+def participant_loglik(theta, stacked, n_participants, trial_length=1.):
+    """Summed log likelihood of each participant"""
+    return np.bincount(stacked['participant'], weights=trial_loglik(theta, stacked, trial_length),
+        minlength=n_participants)
+
+
+def initial_theta(stacked, n_participants):
+    """Crude per participant starting values from the observed lift times"""
+    p = stacked['participant']
+    go_lift = (stacked['signal'] == 0) & (stacked['response'] == 1)
+    n = np.bincount(p[go_lift], minlength=n_participants)
+    total = np.bincount(p[go_lift], weights=stacked['rt'][go_lift], minlength=n_participants)
+    mu = np.where(n > 0, total/np.maximum(n, 1), .8)
+    theta = np.empty((n_participants, 4))
+    theta[:, 0] = mu
+    theta[:, 1] = np.log(.05)
+    theta[:, 2] = .25
+    theta[:, 3] = np.log(.05)
+    return theta
+
+
+def _subset(stacked, mask):
+    return dict((key, value[mask]) for key, value in stacked.items())
+
+
+def _chain(args):
+    """Run one Gibbs chain (in a worker process)"""
+    stacked, X, n_iter, n_burn, thin, seed, trial_length, prior = args
+    rng = np.random.default_rng(seed)
+    n, k = X.shape[0], X.shape[1]
+    # the stop parameters only enter the likelihood of stop trials, so their update
+    # only needs to look at those
+    go_trials = _subset(stacked, stacked['signal'] == 0)
+    stop_trials = _subset(stacked, stacked['signal'] == 1)
+    theta = initial_theta(stacked, n)
+    theta += rng.normal(0, .01, theta.shape)
+    B = np.linalg.lstsq(X, theta, rcond=None)[0]
+    tau2 = np.full(4, .1)
+    go_loglik = participant_loglik(theta, go_trials, n, trial_length)
+    stop_loglik = participant_loglik(theta, stop_trials, n, trial_length)
+    blocks = ((0, 1), (2, 3))
+    # starting step sizes reflect the very different posterior scales of the
+    # means (ms precision) and of the log sds
+    step = np.tile([.005, .06, .01, .15], (n, 1))
+    accepted = np.zeros((n, 2))
+    XtX = X.T.dot(X)
+
+    keep = (n_iter-n_burn)//thin
+    theta_draws = np.empty((keep, n, 4))
+    B_draws = np.empty((keep, k, 4))
+    tau_draws = np.empty((keep, 4))
+    kept = 0
+    for it in range(n_iter):
+        # 1. individual parameters: a Metropolis step for every participant at once,
+        # first for the go then for the stop parameters
+        mean = X.dot(B)
+        for b, cols in enumerate(blocks):
+            cols = list(cols)
+            proposal = theta.copy()
+            proposal[:, cols] += step[:, cols]*rng.standard_normal((n, 2))
+            prop_stop = participant_loglik(proposal, stop_trials, n, trial_length)
+            if b == 0:
+                prop_go = participant_loglik(proposal, go_trials, n, trial_length)
+            else:
+                prop_go = go_loglik
+            log_ratio = (prop_go+prop_stop-go_loglik-stop_loglik
+                -0.5*(((proposal[:, cols]-mean[:, cols])**2-(theta[:, cols]-mean[:, cols])**2)/tau2[cols]).sum(axis=1))
+            accept = np.log(rng.random(n)) < log_ratio
+            theta[accept] = proposal[accept]
+            go_loglik = np.where(accept, prop_go, go_loglik)
+            stop_loglik = np.where(accept, prop_stop, stop_loglik)
+            accepted[:, b] += accept
+        if it < n_burn and (it+1) % 50 == 0:
+            # adapt the step sizes of each participant towards ~30% acceptance
+            rate = accepted/50
+            step *= np.exp(rate-.3).repeat(2, axis=1)
+            accepted[:] = 0
+        # 2. population means: conjugate normal regression for each parameter
+        for j in range(4):
+            precision = XtX/tau2[j]+np.eye(k)/prior['B_sd']**2
+            cov = np.linalg.inv(precision)
+            B[:, j] = rng.multivariate_normal(cov.dot(X.T.dot(theta[:, j]))/tau2[j], cov)
+        # 3. population variances: inverse gamma
+        resid = theta-X.dot(B)
+        shape = prior['tau_a']+n/2
+        scale = prior['tau_b']+0.5*(resid**2).sum(axis=0)
+        tau2 = scale/rng.gamma(shape, 1., 4)
+        if it >= n_burn and (it-n_burn) % thin == 0 and kept < keep:
+            theta_draws[kept] = theta
+            B_draws[kept] = B
+            tau_draws[kept] = tau2
+            kept += 1
+    return theta_draws[:kept], B_draws[:kept], tau_draws[:kept]
+
+
+def rhat(draws):
+    """Gelman-Rubin potential scale reduction for (chains, draws, ...) samples"""
+    n_chains, n = draws.shape[0], draws.shape[1]
+    if n_chains < 2 or n < 2:
+        return np.full(draws.shape[2:], np.nan)
+    chain_means = draws.mean(axis=1)
+    W = draws.var(axis=1, ddof=1).mean(axis=0)
+    B = n*chain_means.var(axis=0, ddof=1)
+    var = (n-1)/n*W+B/n
+    return np.sqrt(var/np.where(W > 0, W, np.nan))
+
+
+def fit_hierarchical(sessions, design=None, categorical=(), continuous=(), n_chains=4, n_iter=2000,
+        n_burn=1000, thin=1, seed=None, n_jobs=None, trial_length=1., trial_types=osari_data.TEST_TRIAL_TYPES,
+        prior=None):
+    """Fit the hierarchical race model to the sessions returned by osari_data.load_sessions
+
+    Sessions of the same participant are pooled. "design" maps participant ID to a dict
+    of covariates; "categorical" and "continuous" name the covariates to use. Chains are
+    run in "n_jobs" processes (default: one per chain, up to the number of CPUs).
+
+    Returns a dict with
+        'participants': participant IDs (row order of the individual estimates)
+        'design_columns': names of the design matrix columns
+        'population': {param: {'mean': (n columns,), 'sd': (n columns,)}}
+        'tau': {param: posterior mean of the population sd}
+        'individual': {param: {'mean': (n participants,), 'sd': (n participants,)}}
+        'rhat': {'population': (n columns, 4), 'individual': (n participants, 4)}
+    SSRT and the go mean are in seconds; the sd parameters are returned on the log scale.
+    """
+    stacked = osari_data.stack_trials(sessions, trial_types)
+    participants = stacked['participants']
+    if not participants:
+        raise ValueError('No trials to fit')
+    X, names = design_matrix(participants, design, categorical, continuous, sessions)
+    prior = dict({'B_sd': 10., 'tau_a': 2., 'tau_b': .01}, **(prior or {}))
+    stacked = dict((key, value) for key, value in stacked.items() if key != 'participants')
+
+    seeds = np.random.SeedSequence(seed).spawn(n_chains)
+    jobs = [(stacked, X, n_iter, n_burn, thin, s, trial_length, prior) for s in seeds]
+    if n_jobs is None:
+        n_jobs = min(n_chains, multiprocessing.cpu_count())
+    if n_jobs > 1:
+        pool = multiprocessing.Pool(n_jobs)
+        try:
+            results = pool.map(_chain, jobs)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_chain(job) for job in jobs]
+
+    theta = np.stack([r[0] for r in results])
+    B = np.stack([r[1] for r in results])
+    tau2 = np.stack([r[2] for r in results])
+    flat_theta = theta.reshape((-1,)+theta.shape[2:])
+    flat_B = B.reshape((-1,)+B.shape[2:])
+    flat_tau = np.sqrt(tau2.reshape(-1, 4))
+    return {'participants': participants,
+            'design_columns': names,
+            'population': dict((p, {'mean': flat_B[:, :, j].mean(axis=0), 'sd': flat_B[:, :, j].std(axis=0)})
+                for j, p in enumerate(PARAMS)),
+            'tau': dict((p, flat_tau[:, j].mean()) for j, p in enumerate(PARAMS)),
+            'individual': dict((p, {'mean': flat_theta[:, :, j].mean(axis=0), 'sd': flat_theta[:, :, j].std(axis=0)})
+                for j, p in enumerate(PARAMS)),
+            'rhat': {'population': rhat(B), 'individual': rhat(theta)}}
+
+
+if __name__ == '__main__':
+    import sys
+    data_dir = sys.argv[1] if len(sys.argv) > 1 else 'data'
+    fit = fit_hierarchical(osari_data.load_sessions(data_dir), seed=1)
+    print('participant\tSSRT (s)\tsd')
+    for i, pid in enumerate(fit['participants']):
+        print('%s\t%.3f\t%.3f' % (pid, fit['individual']['ssrt']['mean'][i], fit['individual']['ssrt']['sd'][i]))
+    print('group SSRT: %.3f (sd %.3f)' % (fit['population']['ssrt']['mean'][0], fit['population']['ssrt']['sd'][0]))
@@ -0,0 +1,218 @@
+"""
+OSARI inhibition functions
+
+Fits the probability of lifting on a stop trial as a function of the SSD the task
+presented, P(lift | SSD), for every session at once.
+
+The stop trials of each session are binned by their SSD (the staircase only visits
+multiples of the step size, so the presented values are used directly) and two
+inhibition functions are fitted with batched iteratively reweighted least squares
+(IRLS) - every iteration updates all sessions with a handful of NumPy operations:
+
+    logistic: P(lift | SSD) = 1/(1+exp(-(a + b*SSD)))
+    Weibull:  P(lift | SSD) = 1-exp(-(SSD/alpha)**beta)
+              (a complementary log-log model on log(SSD): a = -beta*log(alpha), b = beta)
+
+For each session and model the following are reported:
+
+    slope      b (logistic, per second) or beta (Weibull, unitless)
+    midpoint   the SSD (in seconds) at which P(lift) = 0.5
+    slope_mid  dP/dSSD at the midpoint (per second) - comparable across the two models
+    deviance   residual deviance, with the number of SSD bins for its degrees of freedom
+    pseudo_r2  McFadden's pseudo R squared against an intercept only model
+    plausible  False if the fit makes no sense as an inhibition function: a slope of 0 or
+               below (lifts get rarer as the SSD grows) or a midpoint outside the SSDs
+               the session presented
+    converged  False if IRLS did not converge, the fit was undefined (fewer than two
+               SSD values), the data are perfectly separated or the fit is not
+               plausible - only use the fits that converged (e.g. for SSRT estimates)
+
+Usage:
+    index = osari_data.session_index('data')
+    fits = fit_sessions(osari_data.load_sessions('data', index))
+    rows = join_index(index, fits)   # one row per session and model
+
+or from the command line (writes a csv):
+
+    python osari_inhibition.py data inhibition_functions.csv
+"""
+from __future__ import absolute_import, division
+import csv
+import numpy as np
+
+import osari_data
+
+MODELS = ('logistic', 'weibull')
+
+
+def bin_stop_trials(sessions, trial_types=osari_data.TEST_TRIAL_TYPES, decimals=3):
+    """Count stop trials and lifts per presented SSD for every session
+
+    Returns padded (n sessions, max n SSD values) arrays 'ssd', 'n' (number of stop
+    trials) and 'k' (number of lifts); unused bins have n = 0.
+    """
+    binned = []
+    for session in sessions:
+        trials = session['trials']
+        stop = trials[(trials['signal'] == 1) & ~np.isnan(trials['ssd'])]
+        if trial_types is not None:
+            stop = stop[np.isin(stop['trialType'], trial_types)]
+        ssd, inverse = np.unique(np.round(stop['ssd'], decimals), return_inverse=True)
+        n = np.bincount(inverse, minlength=len(ssd))
+        k = np.bincount(inverse, weights=stop['response'], minlength=len(ssd))
+        binned.append((ssd, n, k))
+    width = max([len(b[0]) for b in binned] + [1])
+    out = {'ssd': np.ones((len(binned), width)),
+           'n': np.zeros((len(binned), width)),
+           'k': np.zeros((len(binned), width))}
+    for i, (ssd, n, k) in enumerate(binned):
+        out['ssd'][i, :len(ssd)] = ssd
+        out['n'][i, :len(ssd)] = n
+        out['k'][i, :len(ssd)] = k
+    return out
+
+
+def _link(model, eta):
+    """Mean and its derivative with respect to the linear predictor"""
+    if model == 'logistic':
+        mu = 1/(1+np.exp(-eta))
+        return mu, mu*(1-mu)
+    e = np.exp(eta)
+    mu = -np.expm1(-e)
+    return mu, e*np.exp(-e)
+
+
+def _wls(x, z, w):
+    """Weighted least squares of z on (1, x) for every row at once"""
+    s0, s1, s2 = w.sum(axis=1), (w*x).sum(axis=1), (w*x*x).sum(axis=1)
+    t0, t1 = (w*z).sum(axis=1), (w*x*z).sum(axis=1)
+    det = s0*s2-s1*s1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (s2*t0-s1*t1)/det, (s0*t1-s1*t0)/det
+
+
+def _loglik(k, n, mu):
+    mu = np.clip(mu, 1e-12, 1-1e-12)
+    return (k*np.log(mu)+(n-k)*np.log(1-mu)).sum(axis=1)
+
+
+def fit_binned(binned, model='logistic', max_iter=50, tol=1e-8):
+    """Batched IRLS fit of one inhibition function to binned stop trials
+
+    Returns a dict of arrays (one entry per session).
+    """
+    n, k = binned['n'], binned['k']
+    used = n > 0
+    x = binned['ssd'] if model == 'logistic' else np.log(binned['ssd'])
+    x = np.where(used, x, 0.)
+    y = np.where(used, k/np.maximum(n, 1), 0.)
+
+    # start from a least squares fit to the empirical (adjusted) transform of P(lift)
+    y_adj = (k+.5)/(n+1)
+    z = np.log(y_adj/(1-y_adj)) if model == 'logistic' else np.log(-np.log1p(-y_adj))
+    a, b = _wls(x, z, np.where(used, n, 0.))
+    fittable = (used.sum(axis=1) >= 2) & np.isfinite(a) & np.isfinite(b)
+    a, b = np.where(fittable, a, 0.), np.where(fittable, b, 0.)
+
+    converged = np.zeros(len(n), dtype=bool)
+    n_iter = np.zeros(len(n), dtype=int)
+    for it in range(max_iter):
+        active = fittable & ~converged
+        if not active.any():
+            break
+        eta = np.clip(a[:, None]+b[:, None]*x, -30, 30)
+        mu, dmu = _link(model, eta)
+        dmu = np.maximum(dmu, 1e-12)
+        w = np.where(used, n*dmu**2/np.maximum(mu*(1-mu), 1e-12), 0.)
+        z = eta+(y-mu)/dmu
+        a_new, b_new = _wls(x, z, w)
+        ok = np.isfinite(a_new) & np.isfinite(b_new)
+        change = np.abs(a_new-a)+np.abs(b_new-b)
+        a = np.where(active & ok, a_new, a)
+        b = np.where(active & ok, b_new, b)
+        n_iter += active
+        converged |= active & ok & (change < tol*(1+np.abs(a)+np.abs(b)))
+        fittable &= ok
+
+    eta = np.clip(a[:, None]+b[:, None]*x, -30, 30)
+    mu, _ = _link(model, eta)
+    loglik = _loglik(k, n, np.where(used, mu, .5))
+    saturated = _loglik(k, n, np.where(used, y, .5))
+    p0 = k.sum(axis=1)/np.maximum(n.sum(axis=1), 1)
+    null = _loglik(k, n, np.where(used, p0[:, None], .5))
+    # perfect separation shows up as an exploding slope
+    separated = np.abs(b) > (1e3 if model == 'logistic' else 1e2)
+    converged &= fittable & ~separated
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if model == 'logistic':
+            midpoint = -a/b
+            slope_mid = b/4
+        else:
+            alpha = np.exp(-a/b)
+            midpoint = alpha*np.log(2)**(1/b)
+            # dP/dSSD = (beta/SSD)*(SSD/alpha)**beta*exp(-(SSD/alpha)**beta), at P = .5
+            slope_mid = b/midpoint*np.log(2)*.5
+        pseudo_r2 = np.where(null < 0, 1-loglik/null, np.nan)
+    lowest = np.where(used, binned['ssd'], np.inf).min(axis=1)
+    highest = np.where(used, binned['ssd'], -np.inf).max(axis=1)
+    with np.errstate(invalid='ignore'):
+        plausible = fittable & (b > 0) & (midpoint >= lowest) & (midpoint <= highest)
+    converged &= plausible
+    nan = ~fittable
+    return {'model': np.full(len(n), model),
+            'n_stop': n.sum(axis=1).astype(int),
+            'n_ssd': used.sum(axis=1),
+            'intercept': np.where(nan, np.nan, a),
+            'slope': np.where(nan, np.nan, b),
+            'midpoint': np.where(nan, np.nan, midpoint),
+            'slope_mid': np.where(nan, np.nan, slope_mid),
+            'deviance': np.where(nan, np.nan, 2*(saturated-loglik)),
+            'pseudo_r2': np.where(nan, np.nan, pseudo_r2),
+            'plausible': plausible,
+            'converged': converged,
+            'n_iter': n_iter}
+
+
+def fit_sessions(sessions, models=MODELS, trial_types=osari_data.TEST_TRIAL_TYPES):
+    """Fit the inhibition functions of every session
+
+    Returns {model: dict of arrays} with a 'session' array holding the session key
+    of each row.
+    """
+    binned = bin_stop_trials(sessions, trial_types)
+    fits = {}
+    for model in models:
+        fits[model] = fit_binned(binned, model)
+        fits[model]['session'] = np.array([s['session'] for s in sessions])
+    return fits
+
+
+def join_index(index, fits):
+    """One row (dict) per session and model, with the session index columns first
+
+    Sessions without a fit (e.g. no .txt file) are left out.
+    """
+    by_session = dict((entry['session'], entry) for entry in index)
+    rows = []
+    for model, fit in fits.items():
+        for i, session in enumerate(fit['session']):
+            row = dict(by_session.get(session, {'session': session}))
+            for key, values in fit.items():
+                if key != 'session':
+                    row[key] = values[i].item() if hasattr(values[i], 'item') else values[i]
+            rows.append(row)
+    return rows
+
+
+if __name__ == '__main__':
+    import sys
+    data_dir = sys.argv[1] if len(sys.argv) > 1 else 'data'
+    out = sys.argv[2] if len(sys.argv) > 2 else 'inhibition_functions.csv'
+    index = osari_data.session_index(data_dir)
+    rows = join_index(index, fit_sessions(osari_data.load_sessions(data_dir, index)))
+    with open(out, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()) if rows else ['session'])
+        writer.writeheader()
+        writer.writerows(rows)
+    print('Wrote %s inhibition function fits to %s' % (len(rows), out))
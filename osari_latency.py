@@ -0,0 +1,95 @@
+"""
+OSARI input latency
+
+The keyboard backend time stamps a lift when it happens (key.tDown+key.duration, the
+rt column), but the bar rise loop only sees it on its next call to kb.getKeys(), at
+lift_time on the trial clock, and the bar stops on screen at the flip after that.
+The feedback ("... ms from the target") and the height the bar stops at come from
+lift_time, so everything between the lift and its detection biases them. For every
+trial with a lift the task records:
+
+    detect_ms       lift to detection by the loop (lift_time - rt)
+    flip_ms         lift to the flip that showed the bar stopped
+    overshoot_cm    how far the bar rose past its height at the lift
+
+    latency = trial_latency(release, lift_time, flip_time, height, this_stoptime,
+                            trial_length, bar_height)
+    write_report(Output_ExpH+'.latency', records.trials(), frame_dur)
+
+The report lists the trials whose detection latency is longer than one frame; with
+the loop polling once per frame anything longer comes from the keyboard or its
+driver. The latency columns are in the .osari file too, so sessions run on
+different keyboards or computers can be compared:
+
+    python osari_latency.py data/*.osari
+"""
+from __future__ import absolute_import, division
+import numpy as np
+
+import osari_trial
+
+FIELDS = ('detect_ms', 'flip_ms', 'overshoot_cm')
+
+
+def trial_latency(release, lift_time, flip_time, shown_height, this_stoptime, trial_length, total_height):
+    """The latency of a lift (see the module docstring); release, lift_time and flip_time
+    are on the trial clock, shown_height is the height (cm) of the bar on screen after
+    the lift was seen"""
+    return {'detect_ms': (lift_time-release)*1000,
+            'flip_ms': (flip_time-release)*1000,
+            'overshoot_cm': shown_height-osari_trial.bar_height(release, this_stoptime, trial_length, total_height)}
+
+
+def summary(trials, frame_ms):
+    """Latency statistics of the trials with a lift and the trials whose detection took
+    longer than one frame (frame_ms); trials has the FIELDS, 'block' and 'trial'"""
+    detect = np.asarray(trials['detect_ms'], dtype=float)
+    lifted = np.flatnonzero(~np.isnan(detect))
+    result = {'n': len(lifted), 'frame_ms': frame_ms, 'late': []}
+    if not len(lifted):
+        return result
+    for name in FIELDS:
+        values = np.asarray(trials[name], dtype=float)[lifted]
+        result[name] = {'mean': values.mean(), 'median': np.median(values),
+                        'p95': np.percentile(values, 95), 'max': values.max()}
+    for i in lifted[detect[lifted] > frame_ms]:
+        result['late'].append((int(trials['block'][i]), int(trials['trial'][i]),
+                               float(detect[i]), float(trials['overshoot_cm'][i])))
+    return result
+
+
+def report(trials, frame_ms, title='Input latency'):
+    """The latency report as text"""
+    s = summary(trials, frame_ms)
+    lines = ['%s of %s trials with a lift (one frame = %.2f ms)' % (title, s['n'], frame_ms)]
+    if not s['n']:
+        return lines[0]+'\n'
+    lines += ['', '%-14s %10s %10s %10s %10s' % ('', 'mean', 'median', 'p95', 'max')]
+    for name in FIELDS:
+        lines.append('%-14s %10.2f %10.2f %10.2f %10.2f' % (
+            name, s[name]['mean'], s[name]['median'], s[name]['p95'], s[name]['max']))
+    lines += ['', 'The feedback is late by %.2f ms on average.' % s['detect_ms']['mean'],
+              '%s trials (%.1f%%) were detected more than one frame after the lift%s' % (
+                  len(s['late']), 100*len(s['late'])/s['n'], ':' if s['late'] else '.')]
+    for block, trial, detect_ms, overshoot_cm in s['late']:
+        lines.append('  block %3d trial %3d  %8.2f ms  %6.3f cm' % (block, trial, detect_ms, overshoot_cm))
+    return '\n'.join(lines)+'\n'
+
+
+def write_report(path, trials, frame_ms):
+    with open(path, 'w') as f:
+        f.write(report(trials, frame_ms))
+
+
+if __name__ == '__main__':
+    import os
+    import sys
+    import osari_binary
+    for path in sys.argv[1:]:
+        f = osari_binary.SessionFile(path)
+        if 'detect_ms' not in f.columns:
+            print('%s: no latency columns (recorded by an older version of the task)\n' % path)
+            continue
+        columns = dict((name, f.column(name)) for name in FIELDS+('block', 'trial'))
+        frame_rate = f.meta['expInfo'].get('frameRate') or 1/osari_trial.FRAME
+        print(report(columns, 1000/frame_rate, os.path.basename(path)))
@@ -0,0 +1,268 @@
+"""
+OSARI log file parser and timing audit
+
+The task writes a DEBUG level PsychoPy log (.log) for every session. This module
+turns those free text files into typed event tables and checks them for timing
+problems:
+
+    iter_events(path)      -> generator of (t, level, kind, source, attribute, value)
+    read_log(path)         -> the events of a whole file as a dict of NumPy arrays
+    log_parts(path)        -> the files of a rotated log, oldest first (see osari_ringlog.py)
+    align_trials(events)   -> which trial (row of the .txt file) each event belongs to
+    audit_session(entry)   -> summary and flags for one entry of osari_data.session_index
+    audit_archive(data_dir)-> audit_session for every session with a log, in parallel
+
+Event kinds:
+
+    'attribute'     autoLog attribute changes, e.g. "unnamed ShapeStim: vertices = [...]"
+                    (source = object name, attribute = attribute name, value = new value)
+    'created'       "Created unnamed TextStim = TextStim(...)" (attribute = class name)
+    'keypress'      "Keypress: space" (value = key)
+    'trial'         "New trial (rep=0, index=0): OrderedDict(...)" from the trial loops
+                    (value = the conditions of the trial, 'None' for the block loop)
+    'frame_drop'    "t of last frame was 34.73ms (=1/28)" (value = interval in ms)
+    'fullscreen'    the "User requested fullscreen with size [800 600], but screen is
+                    actually [1920, 1080]" warning (value = requested, attribute = actual)
+    'message'       anything else
+
+Flags raised by the audit:
+
+    fullscreen_mismatch   the window size asked for did not match the screen
+    dropped_frames        frame drop warnings, or intervals between the per-frame bar
+                          (vertices) updates during the bar rise longer than 1.5x the
+                          median interval
+    long_gaps             no events for more than "gap" seconds within a trial
+    multiple_runs         more than one run of the task was logged to the same file
+
+    python osari_logs.py data log_audit.csv
+"""
+from __future__ import absolute_import, division
+import csv
+import gzip
+import os
+import re
+import numpy as np
+
+import osari_data
+
+LEVELS = ('CRITICAL', 'ERROR', 'WARNING', 'DATA', 'EXP', 'INFO', 'DEBUG')
+KINDS = ('attribute', 'created', 'keypress', 'trial', 'frame_drop', 'fullscreen', 'message')
+
+_line = re.compile(r'^(\d+\.\d+)\s*\t(\w+)\s*\t(.*)$')
+_attribute = re.compile(r'^(.+?): (\w+) = (.*)$')
+_created = re.compile(r'^Created (.+?) = (\w+)\(')
+_keypress = re.compile(r'^Keypress: (.*)$')
+_trial = re.compile(r'^New trial \(rep=\d+, index=\d+\): (.*)$')
+_frame = re.compile(r'^t of last frame was ([\d.]+)ms')
+_fullscreen = re.compile(r'^User requested fullscreen with size \[([\d\s]+)\], but screen is actually \[([\d,\s]+)\]')
+
+
+def parse_message(message):
+    """Split a log message into (kind, source, attribute, value)"""
+    match = _attribute.match(message)
+    if match and not message.startswith('Created '):
+        return 'attribute', match.group(1), match.group(2), match.group(3)
+    match = _created.match(message)
+    if match:
+        return 'created', match.group(1), match.group(2), ''
+    match = _keypress.match(message)
+    if match:
+        return 'keypress', 'keyboard', 'key', match.group(1)
+    match = _trial.match(message)
+    if match:
+        return 'trial', 'TrialHandler', 'conditions', match.group(1)
+    match = _frame.match(message)
+    if match:
+        return 'frame_drop', 'window', 'frame interval (ms)', match.group(1)
+    match = _fullscreen.match(message)
+    if match:
+        requested = 'x'.join(match.group(1).split())
+        actual = 'x'.join(v.strip() for v in match.group(2).split(','))
+        return 'fullscreen', 'window', actual, requested
+    return 'message', '', '', message
+
+
+def log_parts(path):
+    """The files of a log, oldest first: the parts a rotating log was moved to
+    (path.N ... path.1, see osari_ringlog.py) and then path itself"""
+    n = 0
+    while os.path.exists('%s.%s' % (path, n+1)):
+        n += 1
+    return ['%s.%s' % (path, i) for i in range(n, 0, -1)]+[path]
+
+
+def iter_events(path):
+    """Stream the events of a log file one at a time
+
+    Lines that do not start with a timestamp are continuations of the previous
+    message. Gzipped logs (.log.gz, see osari_ringlog.py) are read as well, and a
+    rotated log is read from its oldest part on (log_parts).
+    """
+    pending = None
+    opener = gzip.open if path.endswith('.gz') else open
+    for part in log_parts(path):
+        with opener(part, 'rt', errors='replace') as f:
+            for line in f:
+                match = _line.match(line.rstrip('\n'))
+                if match is None:
+                    if pending is not None:
+                        pending[2] += '\n'+line.rstrip('\n')
+                    continue
+                if pending is not None:
+                    yield (pending[0], pending[1])+parse_message(pending[2])
+                pending = [float(match.group(1)), match.group(2), match.group(3)]
+    if pending is not None:
+        yield (pending[0], pending[1])+parse_message(pending[2])
+
+
+def read_log(path, keep_values=True):
+    """Read a whole log file into a dict of arrays
+
+    't' (float seconds), 'level' and 'kind' (small integer codes into LEVELS and
+    KINDS), 'run' (counts up each time the clock restarts, i.e. a new run of the task
+    appended to the same file), 'source', 'attribute' and 'value' (text). With
+    keep_values=False the values of 'created' events (long object reprs) are dropped.
+    """
+    t, level, kind, source, attribute, value = [], [], [], [], [], []
+    for event in iter_events(path):
+        t.append(event[0])
+        level.append(LEVELS.index(event[1]) if event[1] in LEVELS else -1)
+        kind.append(KINDS.index(event[2]))
+        source.append(event[3])
+        attribute.append(event[4])
+        value.append(event[5] if keep_values or event[2] != 'created' else '')
+    t = np.array(t, dtype=np.float64)
+    return {'t': t,
+            'level': np.array(level, dtype=np.int8),
+            'kind': np.array(kind, dtype=np.int8),
+            'run': np.concatenate([[0], np.cumsum(np.diff(t) < 0)]).astype(np.int16) if len(t) else np.zeros(0, np.int16),
+            'source': np.array(source, dtype=str),
+            'attribute': np.array(attribute, dtype=str),
+            'value': np.array(value, dtype=str)}
+
+
+def align_trials(events, run=None):
+    """Assign every event to a trial
+
+    Trials start at the 'New trial' events of the trial loops (not the block loop)
+    and are numbered in order, so trial i lines up with row i of the session's .txt
+    file. Events before the first trial get -1. Only events of "run" (default: the
+    last run in the file) are aligned, the rest get -1 too.
+    """
+    if run is None:
+        run = events['run'].max() if len(events['run']) else 0
+    in_run = events['run'] == run
+    starts = np.flatnonzero(in_run & (events['kind'] == KINDS.index('trial')) & (events['value'] != 'None'))
+    trial = np.full(len(events['t']), -1, dtype=np.int32)
+    if len(starts):
+        index = np.searchsorted(starts, np.arange(len(trial)), side='right')-1
+        trial = np.where(in_run, index, -1).astype(np.int32)
+    return trial
+
+
+def rising(events):
+    """True for events logged while the bar was rising
+
+    The task records frame intervals only during the bar rise, so the window's
+    "recordFrameIntervals = True/False" changes bracket it.
+    """
+    marks = np.flatnonzero((events['kind'] == KINDS.index('attribute')) &
+        (events['attribute'] == 'recordFrameIntervals'))
+    on = events['value'][marks] == 'True'
+    # forward fill the last recordFrameIntervals value
+    state = np.full(len(events['t']), -1, dtype=np.int64)
+    state[marks] = np.arange(len(marks))
+    state = np.maximum.accumulate(state)
+    return np.where(state >= 0, on[np.maximum(state, 0)] if len(marks) else False, False)
+
+
+def frame_intervals(events, trial):
+    """Intervals (s) between consecutive per-frame bar updates during each trial's bar rise"""
+    is_vert = (events['kind'] == KINDS.index('attribute')) & (events['attribute'] == 'vertices') & \
+        (trial >= 0) & rising(events)
+    t = events['t'][is_vert]
+    tr = trial[is_vert]
+    same = tr[1:] == tr[:-1]
+    return np.diff(t)[same], tr[1:][same]
+
+
+def audit_session(entry, gap=10., drop_factor=1.5):
+    """Audit the log of one session (an entry of osari_data.session_index)"""
+    events = read_log(entry['log'], keep_values=False)
+    trial = align_trials(events)
+    n_trials = trial.max()+1 if len(trial) else 0
+    n_txt = len(osari_data.read_txt(entry['txt'])) if entry.get('txt') else None
+
+    fullscreen = events['kind'] == KINDS.index('fullscreen')
+    last_run = events['run'] == (events['run'].max() if len(events['run']) else 0)
+    mismatch = fullscreen & last_run
+    warned_drops = (events['kind'] == KINDS.index('frame_drop')) & last_run
+
+    intervals, interval_trial = frame_intervals(events, trial)
+    if len(intervals):
+        frame = np.median(intervals)
+        long_frames = intervals > drop_factor*frame
+        drops_per_trial = np.bincount(interval_trial[long_frames], minlength=n_trials)
+    else:
+        frame = np.nan
+        drops_per_trial = np.zeros(n_trials, dtype=int)
+
+    in_trial = trial >= 0
+    gaps = np.diff(events['t'])
+    within = in_trial[1:] & (trial[1:] == trial[:-1])
+    long_gaps = np.flatnonzero(within & (gaps > gap))
+
+    return {'session': entry['session'],
+            'log': entry['log'],
+            'n_events': len(events['t']),
+            'n_runs': int(events['run'].max()+1) if len(events['run']) else 0,
+            'n_trials_log': int(n_trials),
+            'n_trials_txt': n_txt,
+            'requested_size': events['value'][mismatch][-1] if mismatch.any() else '',
+            'actual_size': events['attribute'][mismatch][-1] if mismatch.any() else '',
+            'frame_interval_ms': frame*1000,
+            'n_frame_drop_warnings': int(warned_drops.sum()),
+            'n_long_frames': int(drops_per_trial.sum()),
+            'trials_with_long_frames': int((drops_per_trial > 0).sum()),
+            'n_long_gaps': len(long_gaps),
+            'longest_gap_s': float(gaps[within].max()) if within.any() else 0.,
+            'fullscreen_mismatch': bool(mismatch.any()),
+            'dropped_frames': bool(warned_drops.any() or drops_per_trial.any()),
+            'long_gaps': len(long_gaps) > 0,
+            'multiple_runs': bool(len(events['run']) and events['run'].max() > 0)}
+
+
+def _audit(args):
+    entry, gap = args
+    try:
+        return audit_session(entry, gap)
+    except Exception as err:
+        return {'session': entry['session'], 'log': entry['log'], 'error': '%s: %s' % (type(err).__name__, err)}
+
+
+def audit_archive(data_dir='data', gap=10., n_jobs=None):
+    """audit_session for every session in "data_dir" that has a log file, in parallel"""
+    from concurrent.futures import ProcessPoolExecutor
+    jobs = [(entry, gap) for entry in osari_data.session_index(data_dir) if entry['log']]
+    with ProcessPoolExecutor(n_jobs) as pool:
+        return list(pool.map(_audit, jobs, chunksize=8))
+
+
+if __name__ == '__main__':
+    import sys
+    data_dir = sys.argv[1] if len(sys.argv) > 1 else 'data'
+    out = sys.argv[2] if len(sys.argv) > 2 else 'log_audit.csv'
+    rows = audit_archive(data_dir)
+    names = []
+    for row in rows:
+        names += [n for n in row if n not in names]
+    with open(out, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=names)
+        writer.writeheader()
+        writer.writerows(rows)
+    flags = ('fullscreen_mismatch', 'dropped_frames', 'long_gaps', 'multiple_runs', 'error')
+    print('Audited %s sessions, written to %s' % (len(rows), out))
+    for flag in flags:
+        flagged = [r['session'] for r in rows if r.get(flag)]
+        if flagged:
+            print('  %s: %s' % (flag, ', '.join(flagged)))
@@ -0,0 +1,137 @@
+"""
+OSARI media preloading
+
+The video at the end of the session is checked and read in a background thread while
+the last block runs, so that a missing or broken file can't stop the task after the
+last trial and the window doesn't stall while the file is opened:
+
+    reward_video = osari_media.Preloader('Stimuli/Astronaught_floss_test.mp4')
+    reward_video.start()            # at the start of the last block
+    ...                             # the data files are saved before any media is used
+    mov = reward_video.movie(win, size=(320, 240), loop=False)
+    if mov is None:
+        print(reward_video.error)   # not found, not a video, could not be decoded ...
+
+The thread checks that the file is there and starts like a video of its type, reads
+it once (so it is in the operating system's file cache when MovieStim3 opens it) and
+decodes its first frame with moviepy, the decoder MovieStim3 uses. The MovieStim3 is
+then made in the main thread, which owns the window's OpenGL context, and only from a
+file that passed. movie() returns None rather than raising if anything failed. The
+file reads are in 1 MB chunks, which release the GIL, so the trials of the last block
+keep their timing; the whole check normally takes a small part of a block.
+
+To check a file on a testing computer:
+
+    python osari_media.py Stimuli/Astronaught_floss_test.mp4
+"""
+from __future__ import absolute_import, division
+import os
+import threading
+import time
+
+WAITING = 'waiting'
+LOADING = 'loading'
+READY = 'ready'
+FAILED = 'failed'
+
+CHUNK = 1 << 20
+# extension -> (offset, bytes) the file starts with
+SIGNATURES = {
+    '.mp4': (4, b'ftyp'), '.m4v': (4, b'ftyp'), '.mov': (4, b'ftyp'),
+    '.avi': (8, b'AVI '),
+    '.mkv': (0, b'\x1a\x45\xdf\xa3'), '.webm': (0, b'\x1a\x45\xdf\xa3'),
+}
+
+
+class MediaError(Exception):
+    pass
+
+
+def check(path):
+    """Check a media file, read it once and decode its first frame; returns the duration
+    (s) and size (pixels) of the video. Raises MediaError for a file that can't be used."""
+    if not os.path.isfile(path):
+        raise MediaError('%s not found' % path)
+    signature = SIGNATURES.get(os.path.splitext(path)[1].lower())
+    with open(path, 'rb') as f:
+        head = f.read(16)
+        if signature is not None and head[signature[0]:signature[0]+len(signature[1])] != signature[1]:
+            raise MediaError('%s is not a %s file' % (path, os.path.splitext(path)[1]))
+        while f.read(CHUNK):
+            pass
+    try:
+        from moviepy.video.io.VideoFileClip import VideoFileClip
+    except ImportError:
+        raise MediaError('playing %s needs moviepy (used by MovieStim3)' % path)
+    try:
+        clip = VideoFileClip(path, audio=False)
+        try:
+            clip.get_frame(0)
+            return clip.duration, tuple(clip.size)
+        finally:
+            clip.close()
+    except Exception as e:
+        raise MediaError('%s could not be decoded: %s' % (path, e))
+
+
+class Preloader(object):
+    """Checks a media file in a background thread (see the module docstring)"""
+
+    def __init__(self, path):
+        self.path = path
+        self.status = WAITING
+        self.error = None
+        self.duration = None
+        self.size = None
+        self.seconds = None
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self.status = LOADING
+        self._thread = threading.Thread(target=self._run, name='osari-media')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        start = time.perf_counter()
+        try:
+            self.duration, self.size = check(self.path)
+            self.status = READY
+        except Exception as e:
+            self.error = '%s' % e
+            self.status = FAILED
+        self.seconds = time.perf_counter()-start
+
+    def ready(self, timeout=10.):
+        """True if the file passed; waits up to "timeout" seconds for the check to finish
+        (and starts it if it was not started)"""
+        self.start()
+        self._thread.join(timeout)
+        if self.status == LOADING:
+            self.error = '%s was still loading after %s s' % (self.path, timeout)
+            return False
+        return self.status == READY
+
+    def movie(self, win, timeout=10., **kwargs):
+        """A MovieStim3 of the file, or None (with the reason in self.error)"""
+        if not self.ready(timeout):
+            return None
+        try:
+            from psychopy import visual
+            return visual.MovieStim3(win, self.path, **kwargs)
+        except Exception as e:
+            self.error = '%s could not be opened: %s' % (self.path, e)
+            return None
+
+
+if __name__ == '__main__':
+    import sys
+    for path in sys.argv[1:]:
+        preloader = Preloader(path)
+        if preloader.ready():
+            print('%s: %.1f s, %s x %s pixels (checked in %.2f s)' % (
+                path, preloader.duration, preloader.size[0], preloader.size[1], preloader.seconds))
+        else:
+            print(preloader.error)
@@ -0,0 +1,215 @@
+"""
+OSARI live experimenter monitor
+
+A small web server on a background thread that shows how the session is going
+(trial results, the current SSD, stop success rate, go accuracy, dropped frames
+and block progress) in a browser, e.g. on a second screen or another computer.
+
+    monitor = osari_monitor.Monitor(port=8765)
+    ...
+    monitor.post(block=1, trialType='testBlocks', trial=3, signal=1, response=0,
+                 ssd=0.525, rt=float('nan'), frame_drops=0, n_trials=64, n_blocks=5)
+    ...
+    monitor.close()
+
+post() only appends the trial to a collections.deque (an atomic operation, no lock
+is taken), so the trial loop never waits for the server. The server folds the
+posted trials into its summary when a page asks for it.
+
+Pages:
+
+    /           live view (updates itself through /events)
+    /state      the summary as JSON
+    /trials     every trial posted so far as JSON
+    /events     the summary as a stream of server-sent events
+
+The server listens on 127.0.0.1 unless another host is given (host='' for every
+network interface). To try it without running the task, a saved session can be
+replayed into it:
+
+    python osari_monitor.py data/OSARI_123_OSARI_2020_Jul_19_1307.txt 8765
+"""
+from __future__ import absolute_import, division
+import collections
+import json
+import math
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:  # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+PAGE = '''<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>OSARI monitor</title>
+<style>
+body {font-family: sans-serif; background: #111; color: #eee; margin: 2em}
+td, th {padding: 2px 10px; text-align: right}
+#summary td {font-size: 1.6em}
+.stop {color: #f66} .go {color: #6cf}
+</style></head>
+<body>
+<h2>OSARI <span id="status">waiting for the first trial</span></h2>
+<table id="summary"></table>
+<h3>Last trials</h3>
+<table><thead><tr><th>block</th><th>type</th><th>trial</th><th>signal</th><th>response</th>
+<th>ssd</th><th>rt</th><th>frame drops</th></tr></thead><tbody id="trials"></tbody></table>
+<script>
+var names = [["block", "Block"], ["trial", "Trial"], ["ssd", "Current SSD (s)"],
+    ["stop_success", "Stop success"], ["go_accuracy", "Go accuracy"],
+    ["mean_go_rt", "Mean go RT (s)"], ["frame_drops", "Dropped frames"]];
+function fmt(v) {return v === null ? "-" : (typeof v === "number" ? +v.toFixed(3) : v);}
+new EventSource("events").onmessage = function (e) {
+    var s = JSON.parse(e.data);
+    if (!s.n) return;
+    document.getElementById("status").textContent = s.n + " trials, " + s.age + " s since the last";
+    s.block = s.block + " of " + fmt(s.n_blocks);
+    s.trial = s.trial + " of " + fmt(s.n_trials);
+    document.getElementById("summary").innerHTML = names.map(function (n) {
+        return "<tr><th>" + n[1] + "</th><td>" + fmt(s[n[0]]) + "</td></tr>";}).join("");
+    document.getElementById("trials").innerHTML = s.last.map(function (t) {
+        return "<tr class='" + (t.signal ? "stop" : "go") + "'>" + ["block", "trialType", "trial",
+            "signal", "response", "ssd", "rt", "frame_drops"].map(function (k) {
+            return "<td>" + fmt(t[k]) + "</td>";}).join("") + "</tr>";}).join("");
+};
+</script></body></html>
+'''
+
+
+def _clean(value):
+    """JSON has no NaN: None instead"""
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass  # no console output from the server
+
+    def _send(self, body, content_type):
+        body = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        monitor = self.server.monitor
+        path = self.path.split('?')[0]
+        if path == '/':
+            self._send(PAGE, 'text/html; charset=utf-8')
+        elif path == '/state':
+            self._send(json.dumps(monitor.state()), 'application/json')
+        elif path == '/trials':
+            self._send(json.dumps(monitor.trials()), 'application/json')
+        elif path == '/events':
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Cache-Control', 'no-cache')
+            self.end_headers()
+            try:
+                while not monitor.closed:
+                    self.wfile.write(('data: %s\n\n' % json.dumps(monitor.state())).encode('utf-8'))
+                    self.wfile.flush()
+                    time.sleep(monitor.interval)
+            except (IOError, OSError):
+                pass  # the browser went away
+        else:
+            self.send_error(404)
+
+
+class Monitor(object):
+    """Serves the monitor pages from a background thread (see the module docstring)"""
+
+    def __init__(self, port=8765, host='127.0.0.1', interval=.25, n_last=20):
+        self.interval = interval
+        self.n_last = n_last
+        self.closed = False
+        self._posted = collections.deque()
+        self._trials = []
+        self._lock = threading.Lock()  # only taken by the server threads
+        self._server = _Server((host, port), _Handler)
+        self._server.monitor = self
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name='OSARI monitor')
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def url(self):
+        host = self._server.server_address[0]
+        return 'http://%s:%s/' % ('127.0.0.1' if host in ('', '0.0.0.0') else host, self.port)
+
+    def post(self, **trial):
+        """Hand a finished trial to the monitor (called from the trial loop)"""
+        trial['time'] = time.time()
+        self._posted.append(trial)
+
+    def _collect(self):
+        with self._lock:
+            while self._posted:
+                trial = self._posted.popleft()
+                self._trials.append(dict((k, _clean(v)) for k, v in trial.items()))
+            return self._trials
+
+    def trials(self):
+        return list(self._collect())
+
+    def state(self):
+        """Summary of the trials so far (test trials only for the rates, if there are any)"""
+        trials = self._collect()
+        state = {'n': len(trials), 'age': None, 'block': None, 'n_blocks': None, 'trial': None,
+                 'n_trials': None, 'trialType': None, 'ssd': None, 'stop_success': None, 'go_accuracy': None,
+                 'mean_go_rt': None, 'frame_drops': 0, 'last': trials[-self.n_last:][::-1]}
+        if not trials:
+            return state
+        last = trials[-1]
+        state['age'] = round(time.time()-last['time'], 1)
+        for key in ('block', 'n_blocks', 'trial', 'n_trials', 'trialType'):
+            state[key] = last.get(key)
+        test = [t for t in trials if t.get('trialType') in ('testBlocks', 'main')] or trials
+        stops = [t for t in test if t.get('signal') == 1]
+        gos = [t for t in test if t.get('signal') == 0]
+        ssds = [t.get('ssd') for t in stops if t.get('ssd') is not None]
+        state['ssd'] = ssds[-1] if ssds else None
+        if stops:
+            state['stop_success'] = sum(t.get('response') == 0 for t in stops)/len(stops)
+        if gos:
+            state['go_accuracy'] = sum(t.get('response') == 1 for t in gos)/len(gos)
+            rts = [t['rt'] for t in gos if t.get('rt') is not None]
+            state['mean_go_rt'] = sum(rts)/len(rts) if rts else None
+        state['frame_drops'] = sum(t.get('frame_drops') or 0 for t in trials)
+        return state
+
+    def close(self):
+        self.closed = True
+        self._server.shutdown()
+        self._server.server_close()
+
+
+if __name__ == '__main__':
+    import sys
+    import osari_data
+    trials = osari_data.read_txt(sys.argv[1])
+    monitor = Monitor(int(sys.argv[2]) if len(sys.argv) > 2 else 8765)
+    print('Replaying %s trials, open %s' % (len(trials), monitor.url))
+    n_blocks = trials['block'].max() if len(trials) else 0
+    for row in trials:
+        monitor.post(block=int(row['block']), trialType=str(row['trialType']), trial=int(row['trial']),
+            signal=int(row['signal']), response=int(row['response']), ssd=float(row['ssd']),
+            rt=float(row['rt']), frame_drops=0, n_blocks=int(n_blocks),
+            n_trials=int((trials['block'] == row['block']).sum()))
+        time.sleep(1)
+    monitor.close()
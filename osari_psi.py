@@ -0,0 +1,145 @@
+"""
+OSARI Bayesian adaptive SSD ('psi' method)
+
+Instead of stepping the SSD up or down by a fixed step, the 'psi' method keeps a
+posterior over the parameters of the inhibition function and puts each stop
+trial at the SSD that is expected to tell us the most about them (psi method,
+Kontsevich & Tyler 1999):
+
+    P(lift | SSD) = guess + (1-guess-lapse) / (1+exp(-(SSD-threshold)/slope))
+
+threshold is the SSD at which half of the stop trials fail (the point the
+staircase oscillates around) and slope its spread (s). The posterior is kept on a
+grid of THRESHOLDS x SLOPES. The probability of a lift for every candidate SSD
+(the SSDs the staircase could visit: lowest to highest SSD in steps of the step
+size) and every grid point is computed once, when the method is set up, so that
+after a stop trial the update is one multiplication of the posterior, and the
+next SSD - the candidate with the highest expected information gain (mutual
+information of the outcome and the parameters) - takes two matrix-vector products.
+
+    psi = Psi(lower=.05, upper=.775, step=.025, start=.5)
+    ssd = psi.ssd                   # the SSD of the next stop trial
+    psi.update(ssd, lifted)         # after the stop trial: posterior and next SSD
+    psi.summary()                   # posterior mean and sd of threshold and slope ...
+    psi.save(path)                  # the summary after every update (tab separated)
+
+Every update is timed; psi.worst is the longest so far (s). To check that the
+update fits in the ISI on a testing computer:
+
+    python osari_psi.py 1000        # simulated stop trials, prints the update times
+"""
+from __future__ import absolute_import, division
+import time
+import numpy as np
+
+THRESHOLDS = 73       # grid points between the lowest and highest SSD
+SLOPES = np.geomspace(.005, .2, 24)
+GUESS = .02           # lifts on stop trials that happen whatever the SSD
+LAPSE = .02           # stops whatever the SSD
+
+
+def _logsumexp(values):
+    top = values.max()
+    return top+np.log(np.exp(values-top).sum())
+
+
+class Psi(object):
+    """Posterior over the inhibition function on a precomputed grid (see the module docstring)"""
+
+    def __init__(self, lower, upper, step, start=None, thresholds=THRESHOLDS, slopes=SLOPES,
+                 guess=GUESS, lapse=LAPSE):
+        self.ssds = np.round(np.arange(lower, upper+step/2, step), 6)
+        self.thresholds = np.linspace(lower, upper, thresholds)
+        self.slopes = np.asarray(slopes, dtype=float)
+        threshold, slope = [grid.ravel() for grid in np.meshgrid(self.thresholds, self.slopes, indexing='ij')]
+        self.threshold, self.slope = threshold, slope
+        # (candidate SSD, grid point): P(lift), and the log likelihoods of both outcomes
+        p = guess+(1-guess-lapse)/(1+np.exp(-(self.ssds[:, None]-threshold[None, :])/slope[None, :]))
+        self.p_lift = p
+        self.log_lift = np.log(p)
+        self.log_stop = np.log1p(-p)
+        # minus the entropy of the outcome at each grid point, for the expected information gain
+        self.neg_entropy = p*self.log_lift+(1-p)*self.log_stop
+        # flat prior over the threshold and over the log of the slope (the grid is log spaced)
+        self.log_prior = np.full(len(threshold), -np.log(len(threshold)))
+        self.start = start
+        self.worst = 0.
+        self.reset()  # sets self.history, the summary after every update
+
+    def reset(self, start=None):
+        """Back to the prior, with an empty history (e.g. after the practice, so that the
+        .psi file only has the test trials); the first SSD is the candidate nearest
+        "start" (or the most informative one)"""
+        self.log_posterior = self.log_prior.copy()
+        self.history = []
+        start = self.start if start is None else start
+        self.ssd = self.select() if start is None else self.ssds[self.nearest(start)]
+
+    def nearest(self, ssd):
+        return int(np.abs(self.ssds-ssd).argmin())
+
+    def posterior(self):
+        return np.exp(self.log_posterior)
+
+    def information_gain(self):
+        """Expected information gain (nats) of a stop trial at each candidate SSD"""
+        posterior = self.posterior()
+        p = self.p_lift.dot(posterior)
+        p = np.clip(p, 1e-12, 1-1e-12)
+        outcome_entropy = -(p*np.log(p)+(1-p)*np.log1p(-p))
+        return outcome_entropy+self.neg_entropy.dot(posterior)
+
+    def select(self):
+        return self.ssds[int(self.information_gain().argmax())]
+
+    def update(self, ssd, lifted):
+        """Add the outcome of a stop trial at "ssd" and choose the next SSD; returns the summary"""
+        started = time.perf_counter()
+        i = self.nearest(ssd)
+        self.log_posterior = self.log_posterior+(self.log_lift[i] if lifted else self.log_stop[i])
+        self.log_posterior -= _logsumexp(self.log_posterior)
+        self.ssd = self.select()
+        elapsed = time.perf_counter()-started
+        self.worst = max(self.worst, elapsed)
+        summary = self.summary()
+        summary.update(ssd=float(ssd), lifted=int(lifted), ms=elapsed*1000)
+        self.history.append(summary)
+        return summary
+
+    def summary(self):
+        """Posterior mean and sd of the threshold and slope, its entropy and the next SSD"""
+        posterior = self.posterior()
+        threshold = posterior.dot(self.threshold)
+        log_slope = posterior.dot(np.log(self.slope))
+        return {'threshold': float(threshold),
+                'threshold_sd': float(np.sqrt(max(posterior.dot(self.threshold**2)-threshold**2, 0.))),
+                'slope': float(np.exp(log_slope)),
+                'entropy': float(-posterior.dot(self.log_posterior)),
+                'next_ssd': float(self.ssd)}
+
+    def save(self, path):
+        """Write the summary after every update as a tab separated text file"""
+        names = ('ssd', 'lifted', 'threshold', 'threshold_sd', 'slope', 'entropy', 'next_ssd', 'ms')
+        with open(path, 'w') as f:
+            f.write('\t'.join(names)+'\n')
+            for summary in self.history:
+                f.write('\t'.join('%s' % summary[n] for n in names)+'\n')
+
+
+if __name__ == '__main__':
+    import sys
+    n_trials = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    rng = np.random.RandomState(1)
+    psi = Psi(.05, .775, .025, start=.5)
+    true_threshold, true_slope = .6, .03
+    for trial in range(n_trials):
+        p = GUESS+(1-GUESS-LAPSE)/(1+np.exp(-(psi.ssd-true_threshold)/true_slope))
+        psi.update(psi.ssd, rng.uniform() < p)
+        if trial in (9, 24, 49, 99):
+            s = psi.summary()
+            print('after %3d stop trials: threshold %.3f (sd %.3f), slope %.3f' % (
+                trial+1, s['threshold'], s['threshold_sd'], s['slope']))
+    ms = np.array([s['ms'] for s in psi.history])
+    print('grid %s x %s, %s candidate SSDs' % (len(psi.thresholds), len(psi.slopes), len(psi.ssds)))
+    print('update time: median %.3f ms, 99th percentile %.3f ms, worst %.3f ms' % (
+        np.median(ms), np.percentile(ms, 99), psi.worst*1000))
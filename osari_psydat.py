@@ -0,0 +1,277 @@
+"""
+OSARI .psydat extraction
+
+Every session saves a pickle (.psydat) of the whole ExperimentHandler. Loading one
+normally needs the PsychoPy version that wrote it. This module reads them without
+importing PsychoPy: PsychoPy classes in the pickle are replaced by plain stand-in
+classes that only keep the saved attributes, and nothing else may be loaded from the
+pickle but the classes and functions listed in _allowed_globals (numpy arrays, masked
+arrays and scalars, OrderedDict, datetime ... and a few builtins).
+
+From each file the trial entries, the loop structure (name, method, nReps, sequence
+of trial indices ...) and the extraInfo (participant and task info) are extracted and
+written to a .osari file (see osari_binary.py) in the output folder:
+
+    extract(path)                           -> dict with 'entries', 'loops', 'extraInfo' ...
+    convert_archive(data_dir, out_dir)      -> converts every .psydat file in a process pool
+
+Conversion is incremental: a manifest (psydat_manifest.json in the output folder)
+stores the SHA-1 of every converted file, so unchanged files are skipped on the next
+run. Each file has a time limit, and files that fail or time out are listed in
+psydat_errors.txt instead of stopping the conversion.
+
+    python osari_psydat.py data data_store
+"""
+from __future__ import absolute_import, division
+import hashlib
+import json
+import multiprocessing
+import os
+import pickle
+import signal
+import time
+import numpy as np
+
+import osari_binary
+
+# the only (module, name) globals that may be loaded while unpickling (psychopy classes are stubbed)
+_allowed_builtins = ('set', 'frozenset', 'list', 'dict', 'tuple', 'object', 'complex', 'slice', 'range', 'bytearray')
+_allowed_globals = frozenset(
+    [(module, name) for module in ('numpy.core.multiarray', 'numpy._core.multiarray')
+     for name in ('_reconstruct', 'scalar')] +
+    [(module, '_frombuffer') for module in ('numpy.core.numeric', 'numpy._core.numeric')] +
+    [('numpy', 'ndarray'), ('numpy', 'dtype'),
+     ('numpy.ma.core', 'MaskedArray'), ('numpy.ma.core', '_mareconstruct'),
+     ('numpy.ma', 'MaskedArray'), ('numpy.ma', '_mareconstruct'),
+     ('collections', 'OrderedDict'),
+     ('copyreg', '_reconstructor'), ('copy_reg', '_reconstructor'),
+     ('_codecs', 'encode')] +  # bytes in protocol 2 pickles written by Python 3
+    [('datetime', name) for name in ('datetime', 'date', 'time', 'timedelta', 'timezone')] +
+    [(module, name) for module in ('__builtin__', 'builtins') for name in _allowed_builtins])
+
+MANIFEST = 'psydat_manifest.json'
+ERRORS = 'psydat_errors.txt'
+
+
+class PsychopyStub(dict):
+    """Stand-in for any PsychoPy class found in a pickle
+
+    It derives from dict because some PsychoPy data classes (e.g. DataHandler) do,
+    and keeps whatever state was pickled as attributes.
+    """
+    _module = None
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __setstate__(self, state):
+        if isinstance(state, tuple) and len(state) == 2:
+            # (dict state, slots state)
+            state = dict(state[0] or {}, **(state[1] or {}))
+        self.__dict__.update(state or {})
+
+    def __repr__(self):
+        return '<%s.%s>' % (self._module, type(self).__name__)
+
+
+class _Unpickler(pickle.Unpickler):
+    _stubs = {}
+
+    def find_class(self, module, name):
+        if module.split('.')[0] == 'psychopy':
+            key = (module, name)
+            if key not in self._stubs:
+                self._stubs[key] = type(str(name), (PsychopyStub,), {'_module': module})
+            return self._stubs[key]
+        if (module, name) not in _allowed_globals:
+            raise pickle.UnpicklingError('%s.%s is not allowed in a .psydat file' % (module, name))
+        return pickle.Unpickler.find_class(self, module, name)
+
+
+def load(path):
+    """Unpickle a .psydat file without PsychoPy (PsychoPy objects become PsychopyStubs)"""
+    with open(path, 'rb') as f:
+        return _Unpickler(f, encoding='latin1').load()
+
+
+def _plain(value):
+    """numpy scalars to Python values, 'NaN' strings to NaN floats"""
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, str) and value == 'NaN':
+        return float('nan')
+    return value
+
+
+def extract(path):
+    """Pull the trial entries, loop structure and extraInfo out of a .psydat file"""
+    exp = load(path)
+    state = exp.__dict__
+    loops = []
+    for loop in state.get('loops', []):
+        info = loop.__dict__
+        loops.append({'name': info.get('name'),
+                      'type': type(loop).__name__,
+                      'method': info.get('method'),
+                      'nReps': info.get('nReps'),
+                      'nTotal': info.get('nTotal'),
+                      'finished': info.get('finished'),
+                      'seed': info.get('seed'),
+                      'trialList': [dict((k, _plain(v)) for k, v in row.items()) for row in info.get('trialList') or []
+                          if hasattr(row, 'items')],
+                      'sequenceIndices': np.asarray(info.get('sequenceIndices', [])).tolist()})
+    entries = [dict((k, _plain(v)) for k, v in entry.items()) for entry in state.get('entries', [])]
+    return {'name': state.get('name'),
+            'version': state.get('version'),
+            'extraInfo': dict((k, _plain(v)) for k, v in (state.get('extraInfo') or {}).items()),
+            'dataNames': list(state.get('dataNames', [])),
+            'dataFileName': state.get('dataFileName'),
+            'loops': loops,
+            'entries': entries}
+
+
+def entry_columns(entries, exclude=()):
+    """Turn the list of trial entries into typed columns (in order of first appearance)
+
+    Only entries with trial data are kept and the names in "exclude" (e.g. the
+    extraInfo, which the ExperimentHandler repeats in every entry) are left out.
+    Columns of numbers (with 'NaN' for missing) become float or int arrays, anything
+    else text.
+    """
+    entries = [e for e in entries if 'trialType' in e]
+    names = []
+    for entry in entries:
+        for name in entry:
+            if name not in names and name not in exclude:
+                names.append(name)
+    columns = {}
+    for name in names:
+        values = [entry.get(name) for entry in entries]
+        if all(isinstance(v, (bool, int)) for v in values):
+            columns[name] = np.array(values, dtype=np.int64)
+        elif all(v is None or isinstance(v, (bool, int, float)) for v in values):
+            columns[name] = np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+        else:
+            columns[name] = np.array(['' if v is None else str(v) for v in values])
+    return columns
+
+
+def convert(path, out_path):
+    """Extract one .psydat file and write it as a .osari file"""
+    info = extract(path)
+    extra = info['extraInfo']
+    expInfo = dict((k, v) for k, v in extra.items() if k in osari_binary.EXPINFO_KEYS)
+    taskInfo_brief = dict((k, v) for k, v in extra.items() if k not in osari_binary.EXPINFO_KEYS)
+    osari_binary.write(out_path, entry_columns(info['entries'], extra), expInfo, taskInfo_brief,
+        extra={'source': os.path.basename(path), 'name': info['name'], 'version': info['version'],
+               'dataNames': info['dataNames'], 'loops': info['loops']})
+    return out_path
+
+
+def file_hash(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class _Timeout(Exception):
+    pass
+
+
+def _on_alarm(signum, frame):
+    raise _Timeout()
+
+
+def _convert_job(args):
+    path, out_path, timeout = args
+    start = time.time()
+    use_alarm = timeout and hasattr(signal, 'SIGALRM')
+    if use_alarm:
+        signal.signal(signal.SIGALRM, _on_alarm)
+        signal.alarm(int(np.ceil(timeout)))
+    try:
+        convert(path, out_path)
+        return path, 'converted', '', time.time()-start
+    except _Timeout:
+        return path, 'timeout', 'took longer than %ss' % timeout, time.time()-start
+    except Exception as err:
+        return path, 'error', '%s: %s' % (type(err).__name__, err), time.time()-start
+    finally:
+        if use_alarm:
+            signal.alarm(0)
+
+
+def convert_archive(data_dir='data', out_dir='data_store', n_jobs=None, timeout=60, force=False):
+    """Convert every .psydat file in "data_dir" to .osari files in "out_dir"
+
+    Files whose SHA-1 matches the manifest (and whose output exists) are skipped.
+    Returns a list of (path, status, message, seconds) with status one of
+    'converted', 'skipped', 'error' or 'timeout'; failures are also written to
+    psydat_errors.txt in "out_dir".
+    """
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    manifest_path = os.path.join(out_dir, MANIFEST)
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+    results = []
+    jobs = []
+    hashes = {}
+    for fname in sorted(os.listdir(data_dir)):
+        if not fname.endswith('.psydat'):
+            continue
+        path = os.path.join(data_dir, fname)
+        out_path = os.path.join(out_dir, fname[:-len('.psydat')]+osari_binary.EXTENSION)
+        hashes[path] = file_hash(path)
+        known = manifest.get(fname)
+        if not force and known and known['sha1'] == hashes[path] and os.path.exists(out_path):
+            results.append((path, 'skipped', '', 0.))
+        else:
+            jobs.append((path, out_path, timeout))
+
+    if jobs:
+        pool = multiprocessing.Pool(n_jobs)
+        try:
+            pending = [(job, pool.apply_async(_convert_job, (job,))) for job in jobs]
+            # the alarm in the workers handles slow files; this is the backstop for a
+            # worker that is stuck outside Python code
+            deadline = time.time()+timeout*(len(jobs)//(n_jobs or multiprocessing.cpu_count())+2)
+            for job, result in pending:
+                try:
+                    results.append(result.get(max(deadline-time.time(), 0.)))
+                except multiprocessing.TimeoutError:
+                    results.append((job[0], 'timeout', 'worker did not return', timeout))
+        finally:
+            pool.terminate()
+            pool.join()
+
+    for path, status, _, _ in results:
+        if status == 'converted':
+            manifest[os.path.basename(path)] = {'sha1': hashes[path],
+                'output': os.path.basename(path)[:-len('.psydat')]+osari_binary.EXTENSION}
+    tmp = manifest_path+'.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp, manifest_path)
+    failed = [r for r in results if r[1] in ('error', 'timeout')]
+    with open(os.path.join(out_dir, ERRORS), 'w') as f:
+        for path, status, message, _ in failed:
+            f.write('%s\t%s\t%s\n' % (path, status, message))
+    return results
+
+
+if __name__ == '__main__':
+    import sys
+    results = convert_archive(*sys.argv[1:3])
+    counts = {}
+    for r in results:
+        counts[r[1]] = counts.get(r[1], 0)+1
+    print(', '.join('%s %s' % (n, status) for status, n in sorted(counts.items())))
+    for path, status, message, _ in results:
+        if status in ('error', 'timeout'):
+            print('  %s: %s %s' % (path, status, message))
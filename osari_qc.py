@@ -0,0 +1,362 @@
+"""
+OSARI quality control report
+
+A static HTML site with one page per session and an overview of all of them:
+
+    qc/index.html                   one row per session: trials, stop success, go lift
+                                    error, last SSD, frame drops, countdown restarts, flags
+    qc/sessions/<session>.html      the SSD of every stop trial, the go lift times around
+                                    the target (0.8 of the trial length), and stop success,
+                                    frame drops and countdown restarts by block
+
+Plots are inline SVG, so the pages need nothing but a browser. Frame drops (frame
+intervals during the bar rise longer than DROP_FACTOR x the median, see
+osari_logs.py) and countdown restarts (the key was lifted during the countdown,
+which starts it again) come from the session's log; for sessions without one
+they are left blank.
+
+Flags in the overview (test trials only):
+
+    stop_success    stop success outside STOP_SUCCESS (the staircase should hold it near 50%)
+    go_omissions    more than MAX_GO_OMISSIONS of the go trials without a lift
+    frame_drops     any frame drops during the bar rise
+    restarts        more countdown restarts than MAX_RESTARTS of the trials
+
+    build_report(data_dir, out_dir)
+
+The report is incremental: qc_manifest.json in the output folder keeps the size and
+modification time of each session's files and the summary row of its page. Only
+pages whose files changed are made again (in a process pool); the overview is
+rewritten from the manifest every time. Pages are written to a temporary file and
+renamed, so a page is never seen half written.
+
+    python osari_qc.py data qc
+"""
+from __future__ import absolute_import, division
+import json
+import os
+import time
+import numpy as np
+
+try:
+    from html import escape
+except ImportError:
+    from cgi import escape
+
+import osari_config
+import osari_data
+import osari_logs
+import osari_trial
+
+MANIFEST = 'qc_manifest.json'
+DROP_FACTOR = 1.5
+STOP_SUCCESS = (.25, .75)
+MAX_GO_OMISSIONS = .1
+MAX_RESTARTS = .1
+# SVG plot size (px)
+WIDTH, HEIGHT = 480, 220
+
+_STYLE = '''<style>
+body {font-family: sans-serif; margin: 2em; color: #222}
+table {border-collapse: collapse} td, th {padding: 2px 10px; text-align: right; border-bottom: 1px solid #ddd}
+th {background: #f4f4f4} .flag {color: #c00; font-weight: bold} svg {margin: 1em 2em 1em 0}
+</style>'''
+
+
+def log_counts(path, n_trials):
+    """(frame drops, countdown restarts) of every trial from a session's log"""
+    events = osari_logs.read_log(path, keep_values=False)
+    trial = osari_logs.align_trials(events)
+    trial = np.where(trial < n_trials, trial, -1)
+    intervals, interval_trial = osari_logs.frame_intervals(events, trial)
+    drops = np.zeros(n_trials, dtype=np.int64)
+    if len(intervals):
+        drops = np.bincount(interval_trial[intervals > DROP_FACTOR*np.median(intervals)], minlength=n_trials)
+
+    # restarts: key presses after the first countdown digit of a trial and before its bar rise
+    in_trial = trial >= 0
+    t, kind, tr = events['t'][in_trial], events['kind'][in_trial], trial[in_trial]
+    attribute = kind == osari_logs.KINDS.index('attribute')
+    digit = attribute & (events['attribute'][in_trial] == 'text') & \
+        np.isin(events['value'][in_trial], ["'0'", "'1'", "'2'", "'3'"])
+    rise = attribute & (events['attribute'][in_trial] == 'recordFrameIntervals') & (events['value'][in_trial] == 'True')
+    countdown_start, rise_start = np.full(n_trials, np.inf), np.full(n_trials, np.inf)
+    np.minimum.at(countdown_start, tr[digit], t[digit])
+    np.minimum.at(rise_start, tr[rise], t[rise])
+    pressed = (kind == osari_logs.KINDS.index('keypress')) & (t > countdown_start[tr]) & (t < rise_start[tr])
+    return drops, np.bincount(tr[pressed], minlength=n_trials)
+
+
+def session_qc(entry):
+    """The numbers on the page of one session (an entry of osari_data.session_index)"""
+    trials = osari_data.read_txt(entry['txt'])
+    info = osari_data.read_csv_info(entry['csv']) if entry.get('csv') else {}
+    taskInfo_brief, taskInfo = osari_trial.session_parameters(info)
+    target = osari_config.derived(taskInfo_brief, taskInfo)['Target_time']
+    drops = restarts = None
+    if entry.get('log'):
+        drops, restarts = log_counts(entry['log'], len(trials))
+
+    stop, go = trials['signal'] == 1, trials['signal'] == 0
+    test = np.isin(trials['trialType'], osari_data.TEST_TRIAL_TYPES)
+    lift_error = (trials['rt']-target)*1000
+    blocks = []
+    for block in np.unique(trials['block']):
+        here = trials['block'] == block
+        errors = lift_error[here & go & (trials['response'] == 1)]
+        blocks.append({'block': int(block), 'type': str(trials['trialType'][here][0]),
+                       'stop_trials': int((here & stop).sum()),
+                       'stop_success': _rate(trials['response'][here & stop] == 0),
+                       'go_trials': int((here & go).sum()),
+                       'go_omissions': int((here & go & (trials['response'] == 0)).sum()),
+                       'median_lift_error_ms': float(np.median(errors)) if len(errors) else np.nan,
+                       'frame_drops': None if drops is None else int(drops[here].sum()),
+                       'restarts': None if restarts is None else int(restarts[here].sum())})
+
+    test_go = test & go
+    errors = lift_error[test_go & (trials['response'] == 1)]
+    ssds = trials['ssd'][stop & ~np.isnan(trials['ssd'])]
+    row = {'session': entry['session'], 'participant': entry['participant'], 'date': entry.get('date') or '',
+           'method': taskInfo_brief['Method'], 'trials': len(trials),
+           'stop_success': _rate(trials['response'][test & stop] == 0),
+           'go_omissions': _rate(trials['response'][test_go] == 0),
+           'median_lift_error_ms': float(np.median(errors)) if len(errors) else np.nan,
+           'last_ssd': float(ssds[-1]) if len(ssds) else np.nan,
+           'frame_drops': None if drops is None else int(drops.sum()),
+           'restarts': None if restarts is None else int(restarts.sum())}
+    row['flags'] = flags(row)
+    return {'row': row, 'blocks': blocks, 'target': target,
+            'ssd': ssds, 'ssd_block': trials['block'][stop & ~np.isnan(trials['ssd'])],
+            'lift_error': lift_error[go & (trials['response'] == 1)]}
+
+
+def _rate(hits):
+    return float(np.mean(hits)) if len(hits) else np.nan
+
+
+def flags(row):
+    found = []
+    if not np.isnan(row['stop_success']) and not STOP_SUCCESS[0] <= row['stop_success'] <= STOP_SUCCESS[1]:
+        found.append('stop_success')
+    if row['go_omissions'] > MAX_GO_OMISSIONS:
+        found.append('go_omissions')
+    if row['frame_drops']:
+        found.append('frame_drops')
+    if row['restarts'] and row['restarts'] > MAX_RESTARTS*row['trials']:
+        found.append('restarts')
+    return found
+
+
+def _axes(xlim, ylim, xlabel, ylabel):
+    """(svg frame and labels, function mapping data x, y to pixels)"""
+    left, right, top, bottom = 50, 10, 10, 35
+    xspan = (xlim[1]-xlim[0]) or 1.
+    yspan = (ylim[1]-ylim[0]) or 1.
+
+    def to_px(x, y):
+        return (left+(x-xlim[0])/xspan*(WIDTH-left-right),
+                HEIGHT-bottom-(y-ylim[0])/yspan*(HEIGHT-top-bottom))
+    parts = ['<rect x="%d" y="%d" width="%d" height="%d" fill="none" stroke="#999"/>' % (
+        left, top, WIDTH-left-right, HEIGHT-top-bottom)]
+    for value, anchor in ((xlim[0], 'start'), (xlim[1], 'end')):
+        x, _ = to_px(value, ylim[0])
+        parts.append('<text x="%.1f" y="%d" font-size="11" text-anchor="%s">%s</text>' % (
+            x, HEIGHT-bottom+13, anchor, _number(value)))
+    for value in ylim:
+        _, y = to_px(xlim[0], value)
+        parts.append('<text x="%d" y="%.1f" font-size="11" text-anchor="end">%s</text>' % (
+            left-4, y+4, _number(value)))
+    parts.append('<text x="%d" y="%d" font-size="12" text-anchor="middle">%s</text>' % (
+        (WIDTH+left)//2, HEIGHT-4, escape(xlabel)))
+    parts.append('<text x="12" y="%d" font-size="12" text-anchor="middle" transform="rotate(-90 12 %d)">%s</text>' % (
+        HEIGHT//2, HEIGHT//2, escape(ylabel)))
+    return parts, to_px
+
+
+def _svg(parts):
+    return '<svg width="%d" height="%d" xmlns="http://www.w3.org/2000/svg">%s</svg>' % (WIDTH, HEIGHT, ''.join(parts))
+
+
+def _number(value):
+    return '%g' % round(value, 3)
+
+
+def svg_ssd(ssd, block):
+    """The SSD of every stop trial, a dot per trial coloured by block"""
+    if not len(ssd):
+        return '<p>No stop trials.</p>'
+    parts, to_px = _axes((1, max(len(ssd), 2)), (0, max(1., ssd.max())), 'stop trial', 'SSD (s)')
+    points = [to_px(i+1, value) for i, value in enumerate(ssd)]
+    parts.append('<polyline fill="none" stroke="#bbb" points="%s"/>' % ' '.join('%.1f,%.1f' % p for p in points))
+    colours = ('#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd', '#8c564b')
+    for (x, y), b in zip(points, block):
+        parts.append('<circle cx="%.1f" cy="%.1f" r="2.5" fill="%s"/>' % (x, y, colours[b % len(colours)]))
+    return _svg(parts)
+
+
+def svg_histogram(values, xlabel, width=25.):
+    """Histogram of "values" in bins of "width", with a line at 0"""
+    if not len(values):
+        return '<p>No go trials with a lift.</p>'
+    lo = min(np.floor(values.min()/width)*width, -width)
+    hi = max(np.ceil(values.max()/width)*width, width)
+    counts, edges = np.histogram(values, bins=np.arange(lo, hi+width/2, width))
+    parts, to_px = _axes((lo, hi), (0, counts.max()), xlabel, 'trials')
+    for count, a, b in zip(counts, edges[:-1], edges[1:]):
+        (x0, y0), (x1, y1) = to_px(a, count), to_px(b, 0)
+        parts.append('<rect x="%.1f" y="%.1f" width="%.1f" height="%.1f" fill="#6a9fd4"/>' % (x0, y0, x1-x0, y1-y0))
+    (x, top), (_, bottom) = to_px(0, counts.max()), to_px(0, 0)
+    parts.append('<line x1="%.1f" y1="%.1f" x2="%.1f" y2="%.1f" stroke="#c00"/>' % (x, top, x, bottom))
+    return _svg(parts)
+
+
+def svg_bars(labels, values, ylabel):
+    """One bar per label (values may be NaN)"""
+    parts, to_px = _axes((0, len(labels)), (0, 1), 'block', ylabel)
+    for i, (name, value) in enumerate(zip(labels, values)):
+        if not np.isnan(value):
+            (x0, y0), (x1, y1) = to_px(i+.15, value), to_px(i+.85, 0)
+            parts.append('<rect x="%.1f" y="%.1f" width="%.1f" height="%.1f" fill="#6a9fd4"/>' % (
+                x0, y0, x1-x0, y1-y0))
+        x, y = to_px(i+.5, 0)
+        parts.append('<text x="%.1f" y="%.1f" font-size="11" text-anchor="middle">%s</text>' % (x, y-3, name))
+    return _svg(parts)
+
+
+def _cell(value, digits=3):
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return '-'
+    if isinstance(value, float):
+        return '%.*f' % (digits, value)
+    return escape('%s' % value)
+
+
+def session_page(qc):
+    row = qc['row']
+    names = ('block', 'type', 'stop_trials', 'stop_success', 'go_trials', 'go_omissions',
+             'median_lift_error_ms', 'frame_drops', 'restarts')
+    table = '<table><tr>%s</tr>%s</table>' % (''.join('<th>%s</th>' % n for n in names), ''.join(
+        '<tr>%s</tr>' % ''.join('<td>%s</td>' % _cell(block[n]) for n in names) for block in qc['blocks']))
+    stop_success = [block['stop_success'] for block in qc['blocks']]
+    return '\n'.join([
+        '<!DOCTYPE html>', '<html><head><meta charset="utf-8"><title>%s</title>%s</head><body>' % (
+            escape(row['session']), _STYLE),
+        '<p><a href="../index.html">all sessions</a></p>',
+        '<h2>%s</h2>' % escape(row['session']),
+        '<p>%s trials, method %s. Flags: %s</p>' % (row['trials'], escape(row['method']),
+            '<span class="flag">%s</span>' % ', '.join(row['flags']) if row['flags'] else 'none'),
+        '<h3>Blocks</h3>', table,
+        '<h3>SSD of every stop trial</h3>', svg_ssd(qc['ssd'], qc['ssd_block']),
+        '<h3>Go lift time relative to the target (%.2f s)</h3>' % qc['target'],
+        svg_histogram(qc['lift_error'], 'lift time - target (ms)'),
+        '<h3>Stop success by block</h3>',
+        svg_bars([block['block'] for block in qc['blocks']], stop_success, 'stop success'),
+        '</body></html>'])
+
+
+def index_page(rows):
+    names = ('session', 'participant', 'date', 'method', 'trials', 'stop_success', 'go_omissions',
+             'median_lift_error_ms', 'last_ssd', 'frame_drops', 'restarts', 'flags')
+    body = []
+    for row in rows:
+        cells = []
+        for name in names:
+            if name == 'session':
+                cells.append('<td style="text-align:left"><a href="%s">%s</a></td>' % (
+                    escape(page_name(row['session'])), escape(row['session'])))
+            elif name == 'flags':
+                cells.append('<td class="flag">%s</td>' % ', '.join(row['flags']))
+            else:
+                cells.append('<td>%s</td>' % _cell(row[name]))
+        body.append('<tr>%s</tr>' % ''.join(cells))
+    flagged = sum(1 for row in rows if row['flags'])
+    return '\n'.join([
+        '<!DOCTYPE html>', '<html><head><meta charset="utf-8"><title>OSARI QC</title>%s</head><body>' % _STYLE,
+        '<h2>OSARI quality control</h2>',
+        '<p>%s sessions, %s flagged. Made %s.</p>' % (len(rows), flagged, time.strftime('%Y-%m-%d %H:%M')),
+        '<table><tr>%s</tr>%s</table>' % (''.join('<th>%s</th>' % n for n in names), ''.join(body)),
+        '</body></html>'])
+
+
+def page_name(session):
+    return 'sessions/%s.html' % session
+
+
+def _write(path, text):
+    tmp = path+'.tmp'
+    with open(tmp, 'w') as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def _json_row(row):
+    """The summary row with NaN as None, for the manifest"""
+    return dict((name, None if isinstance(value, float) and np.isnan(value) else value)
+                for name, value in row.items())
+
+
+def _page_job(args):
+    entry, out_dir = args
+    try:
+        qc = session_qc(entry)
+        _write(os.path.join(out_dir, page_name(entry['session'])), session_page(qc))
+        return entry['session'], 'made', _json_row(qc['row'])
+    except Exception as err:
+        return entry['session'], 'error', '%s: %s' % (type(err).__name__, err)
+
+
+def build_report(data_dir='data', out_dir='qc', n_jobs=None, force=False):
+    """Make the pages of new or changed sessions and the overview
+
+    Returns a list of (session, status, summary row or error message) with status
+    one of 'made', 'unchanged' or 'error'.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    if not os.path.exists(os.path.join(out_dir, 'sessions')):
+        os.makedirs(os.path.join(out_dir, 'sessions'))
+    manifest_path = os.path.join(out_dir, MANIFEST)
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+    results = []
+    jobs = []
+    signatures = {}
+    for entry in osari_data.session_index(data_dir):
+        if not entry['txt']:
+            continue
+        signatures[entry['session']] = osari_data.file_signature([entry['txt'], entry['csv'], entry['log']])
+        known = manifest.get(entry['session'])
+        if not force and known and known['sources'] == signatures[entry['session']] and \
+                os.path.exists(os.path.join(out_dir, page_name(entry['session']))):
+            results.append((entry['session'], 'unchanged', known['row']))
+        else:
+            jobs.append((entry, out_dir))
+    if jobs:
+        with ProcessPoolExecutor(n_jobs) as pool:
+            results += list(pool.map(_page_job, jobs, chunksize=4))
+
+    manifest = dict((session, manifest[session]) for session in signatures if session in manifest)
+    for session, status, row in results:
+        if status == 'made':
+            manifest[session] = {'sources': signatures[session], 'row': row}
+        elif status == 'error':
+            manifest.pop(session, None)
+    _write(manifest_path, json.dumps(manifest, indent=1, sort_keys=True))
+    _write(os.path.join(out_dir, 'index.html'), index_page([manifest[session]['row'] for session in sorted(manifest)]))
+    return results
+
+
+if __name__ == '__main__':
+    import sys
+    started = time.time()
+    results = build_report(*sys.argv[1:3])
+    counts = {}
+    for r in results:
+        counts[r[1]] = counts.get(r[1], 0)+1
+    print('%s in %.1f s' % (', '.join('%s %s' % (n, status) for status, n in sorted(counts.items())),
+                            time.time()-started))
+    for session, status, message in results:
+        if status == 'error':
+            print('  %s: %s' % (session, message))
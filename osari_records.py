@@ -0,0 +1,131 @@
+"""
+OSARI session records
+
+The results of every trial of a session are kept in one NumPy structured array,
+allocated at the start for the number of trials in the schedule, with a fixed type
+per column and real NaNs for missing values (the SSD of a go trial, the rt of a
+trial without a lift):
+
+    records = SessionRecords(len(schedule))
+    i = records.new()                       # the record of the next trial
+    records.fill(i, block, trial_label, trial, signal, stoptime, outcome, latency)
+    records[i]['log_dropped'] = 3           # fields can be set directly too
+    records.txt_row(i)                      # the row of the .txt file
+    records.values(i, names)                # Python values (monitor, sink)
+    columns = csv_columns(staircases)       # 'staircase' only with interleaved staircases
+    records.add_data(i, trials, columns)    # the columns of the ExperimentHandler csv
+    records.trials()                        # the trials so far, a view of the array
+
+The trial loop writes each trial into its record, and every output (.txt, the csv
+and .psydat through the ExperimentHandler, .osari, the monitor and the sink) reads
+it from there; analysis code can use records.trials() at the end of the session.
+The text outputs still write 'NaN' for missing values, as before.
+
+The first columns are those of osari_data.TRIAL_DTYPE, so records.trials() can be
+passed wherever the trials of a session are expected (e.g. osari_binary.write_trials
+or osari_staircase.update_state).
+"""
+from __future__ import absolute_import, division
+import numpy as np
+
+import osari_data
+import osari_latency
+import osari_trial
+
+RECORD_DTYPE = np.dtype(osari_data.TRIAL_DTYPE.descr+[
+    ('correct', 'i1'),        # outcome of the trial: -2, -1, 1 or 2 (see osari_trial.py)
+    ('feedback_ms', 'f8'),    # go trials with a lift: distance from the target (ms)
+    ('staircase', 'i2'),      # stop trials with interleaved staircases: the staircase (-1 none)
+    ('log_dropped', 'i4'),    # log records lost because the ring buffer was full
+    ('log_late', 'i4'),       # log records written to disk late (see osari_ringlog.py)
+    ('detect_ms', 'f8'),      # trials with a lift: lift to its detection by the bar rise loop (ms)
+    ('flip_ms', 'f8'),        # lift to the flip that showed the bar stopped (ms)
+    ('overshoot_cm', 'f8'),   # rise of the bar after the lift (cm), see osari_latency.py
+])
+
+
+def csv_columns(staircases=False):
+    """The columns of every trial in the csv (and .psydat); 'staircase' only with interleaved staircases"""
+    return osari_trial.CSV_COLUMNS+(('staircase',) if staircases else ())+('log_dropped', 'log_late')+osari_latency.FIELDS
+
+
+CSV_COLUMNS = csv_columns()
+
+_empty = np.zeros(1, dtype=RECORD_DTYPE)
+for _name in RECORD_DTYPE.names:
+    if RECORD_DTYPE[_name].kind == 'f':
+        _empty[_name] = np.nan
+_empty['staircase'] = -1
+
+
+def _value(record, name):
+    """A field as a Python value (NaN stays NaN, no staircase is None)"""
+    value = record[name].item()
+    if name == 'staircase' and value < 0:
+        return None
+    return value
+
+
+def _text(value):
+    """'NaN' for NaN, as in the text outputs of the task"""
+    return 'NaN' if isinstance(value, float) and np.isnan(value) else value
+
+
+class SessionRecords(object):
+    """Preallocated typed records of the trials of a session (see the module docstring)"""
+
+    def __init__(self, n_trials):
+        self.data = np.repeat(_empty, max(n_trials, 1))
+        self.n = 0
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, i):
+        # a record of a structured array is a view: setting its fields writes into self.data
+        return self.data[i]
+
+    def new(self):
+        """The index of the record of the next trial"""
+        if self.n == len(self.data):
+            # more trials than the schedule said (e.g. a repeated block): grow
+            self.data = np.concatenate([self.data, np.repeat(_empty, len(self.data))])
+        self.n += 1
+        return self.n-1
+
+    def fill(self, i, block, trial_label, trial, signal, stoptime, outcome, latency=None):
+        """Record a trial from its outcome (osari_trial.TrialEngine.finish) and, for a
+        lift, its latency (osari_latency.trial_latency)"""
+        record = self.data[i]
+        record['block'] = block
+        record['trialType'] = trial_label
+        record['trial'] = trial
+        record['signal'] = signal
+        record['response'] = outcome['lifted']
+        record['ssd'] = stoptime if signal == 1 else np.nan
+        record['rt'] = np.nan if outcome['rt'] == 'NaN' else outcome['rt']
+        record['correct'] = outcome['correct']
+        record['feedback_ms'] = np.nan if outcome['feedback_ms'] is None else outcome['feedback_ms']
+        record['staircase'] = -1 if outcome.get('staircase') is None else outcome['staircase']
+        if latency is not None:
+            for name, value in latency.items():
+                record[name] = value
+        return record
+
+    def trials(self):
+        return self.data[:self.n]
+
+    def values(self, i, names=osari_trial.CSV_COLUMNS):
+        record = self.data[i]
+        return dict((name, _value(record, name)) for name in names)
+
+    def txt_row(self, i):
+        """The row of the .txt file, in the format written by the task ('NaN' for missing values)"""
+        record = self.data[i]
+        return tuple(_text(_value(record, name)) for name in osari_trial.CSV_COLUMNS)
+
+    def add_data(self, i, handler, names=CSV_COLUMNS):
+        """Add the fields of a trial to a PsychoPy TrialHandler (for the csv and .psydat)"""
+        record = self.data[i]
+        for name in names:
+            handler.addData(name, _text(_value(record, name)))
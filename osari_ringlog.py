@@ -0,0 +1,203 @@
+"""
+OSARI ring buffered log
+
+With a DEBUG level LogFile every autoDraw toggle, fillBar.vertices change and
+frame event is formatted and written to disk by the flush that PsychoPy runs on
+every win.flip(). RingLog takes the place of the LogFile: logging a record only
+stores its time, level and message in the next slot of a preallocated ring buffer
+(nothing is formatted on the frame loop), and the records are formatted and
+written out by a background thread and/or by calling drain() when nothing timing
+critical is happening (the ISI).
+
+    logFile = osari_ringlog.RingLog(Output_ExpH+'.log', level=logging.DEBUG)
+    logFile.install(logging)            # psychopy.logging
+    ...
+    logFile.set_trial(n)                # records logged from now on belong to trial n
+    logFile.drain()                     # e.g. during the ISI
+    logFile.trial_counts(n)             # (records, dropped, late) of trial n
+
+The file has the same format as a PsychoPy LogFile, so osari_logs.py reads it.
+
+Options:
+
+    capacity    number of slots; when the disk falls so far behind that the ring is
+                full, new records are dropped (and counted) instead of waiting
+    interval    seconds between drains by the background thread (None: no thread,
+                only explicit drain() calls)
+    late        records written to disk more than this many seconds after they were
+                logged are counted as late
+    compress    write a gzip file (path+'.gz')
+    max_bytes   rotate the file once this many (uncompressed) bytes have been written
+                to it: path -> path.1 -> path.2
+                ... keeping "backups" old files
+"""
+from __future__ import absolute_import, division
+import atexit
+import gzip
+import os
+import threading
+import time
+import numpy as np
+
+# PsychoPy's logging levels
+LEVEL_NAMES = {50: 'CRITICAL', 40: 'ERROR', 30: 'WARNING', 25: 'DATA', 22: 'EXP', 20: 'INFO', 10: 'DEBUG'}
+
+
+class RingLog(object):
+
+    def __init__(self, path, level=10, capacity=1 << 16, interval=.25, late=1., compress=False,
+                 max_bytes=None, backups=5, clock=None):
+        self.path = path+'.gz' if compress else path
+        self.level = level
+        self.capacity = capacity
+        self.interval = interval
+        self.late = late
+        self.compress = compress
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.clock = clock or time.time
+
+        # the ring: slot i holds record number i (mod capacity)
+        self._t = np.zeros(capacity, dtype=np.float64)
+        self._level = np.zeros(capacity, dtype=np.int16)
+        self._trial = np.zeros(capacity, dtype=np.int32)
+        self._logged = np.zeros(capacity, dtype=np.float64)
+        self._message = [None]*capacity
+        self._head = 0  # records logged (only changed by the logging thread)
+        self._tail = 0  # records written (only changed by the draining thread)
+
+        self.trial = -1
+        self._counts = {}  # trial -> [records, dropped, late]
+        self.n_dropped = 0
+        self.n_late = 0
+
+        self._lock = threading.Lock()  # one drain at a time
+        self._stop = threading.Event()
+        self._thread = None
+        self._file = None
+        self._bytes = 0
+        self._original_log = None
+        self._forward_level = None
+        self._open()
+        if interval:
+            self._thread = threading.Thread(target=self._run, name='RingLog')
+            self._thread.daemon = True
+            self._thread.start()
+
+    # ---------------------------------------------------------------- logging
+
+    def log(self, message, level, t=None, obj=None, levelname=None):
+        """Store a record (same arguments as psychopy.logging.root.log)"""
+        if self._forward_level is not None and level >= self._forward_level:
+            # the console (or any other target) still gets what it asked for
+            self._original_log(message, level, t, obj, levelname)
+        if level < self.level:
+            return
+        counts = self._counts.get(self.trial)
+        if counts is None:
+            counts = self._counts[self.trial] = [0, 0, 0]
+        counts[0] += 1
+        head = self._head
+        if head-self._tail >= self.capacity:
+            counts[1] += 1
+            self.n_dropped += 1
+            return
+        slot = head % self.capacity
+        now = self.clock()
+        self._t[slot] = now if t is None else t
+        self._logged[slot] = now
+        self._level[slot] = level
+        self._trial[slot] = self.trial
+        self._message[slot] = message
+        self._head = head+1
+
+    def set_trial(self, trial):
+        self.trial = trial
+
+    def trial_counts(self, trial=None):
+        """(records, dropped, late) of a trial (default: the current one)
+
+        Late counts are only complete once the trial's records have been drained.
+        """
+        return tuple(self._counts.get(self.trial if trial is None else trial, (0, 0, 0)))
+
+    # ---------------------------------------------------------------- psychopy
+
+    def install(self, logging):
+        """Route psychopy.logging into this ring instead of a LogFile
+
+        Records at or above the level of the existing targets (e.g. WARNING for
+        logging.console) are still passed on to them. The log is closed at exit.
+        """
+        root = logging.root
+        self._original_log = root.log
+        levels = [target.level for target in getattr(root, 'targets', [])]
+        self._forward_level = min(levels) if levels else None
+        if getattr(logging, 'defaultClock', None) is not None:
+            self.clock = logging.defaultClock.getTime
+        root.log = self.log
+        atexit.register(self.close)
+
+    # ---------------------------------------------------------------- writing
+
+    def _open(self):
+        if self.compress:
+            self._file = gzip.open(self.path, 'at', encoding='utf-8')
+        else:
+            self._file = open(self.path, 'a', encoding='utf-8')
+        self._bytes = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+
+    def _rotate(self):
+        self._file.close()
+        for i in range(self.backups-1, 0, -1):
+            if os.path.exists('%s.%s' % (self.path, i)):
+                os.replace('%s.%s' % (self.path, i), '%s.%s' % (self.path, i+1))
+        if self.backups:
+            os.replace(self.path, self.path+'.1')
+        else:
+            os.remove(self.path)
+        self._open()
+
+    def drain(self):
+        """Format and write every record logged so far; returns the number written"""
+        with self._lock:
+            head, tail = self._head, self._tail
+            if head == tail or self._file is None:
+                return 0
+            now = self.clock()
+            lines = []
+            for i in range(tail, head):
+                slot = i % self.capacity
+                level = int(self._level[slot])
+                lines.append('%.4f \t%s \t%s\n' % (self._t[slot], LEVEL_NAMES.get(level, level), self._message[slot]))
+                self._message[slot] = None
+                if now-self._logged[slot] > self.late:
+                    counts = self._counts.get(int(self._trial[slot]))
+                    if counts is not None:
+                        counts[2] += 1
+                    self.n_late += 1
+            text = ''.join(lines)
+            self._file.write(text)
+            self._file.flush()
+            self._bytes += len(text)
+            self._tail = head
+            if self.max_bytes and self._bytes > self.max_bytes:
+                self._rotate()
+            return head-tail
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.drain()
+
+    def close(self):
+        """Stop the thread, write what is left and a summary line, and close the file"""
+        if self._file is None:
+            return
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self.drain()
+        self._file.write('%.4f \tINFO \tRingLog: %s records, %s dropped, %s late\n' % (
+            self.clock(), sum(c[0] for c in self._counts.values()), self.n_dropped, self.n_late))
+        self._file.close()
+        self._file = None
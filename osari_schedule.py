@@ -0,0 +1,259 @@
+"""
+OSARI trial schedules
+
+Builds the trial order of a whole session at startup, instead of letting every
+block's TrialHandler shuffle its conditions when the block starts. A schedule is
+two small integer arrays, the block and the conditions row of every trial, made
+from the conditions files, a seed and (optionally) constraints on how the stop
+trials may be ordered within a block:
+
+    schedule = osari_schedule.make_schedule(
+        [('practiceGoTrials', practiceGoConditions, 1),
+         ('practiceMixedTrials', practiceMixedConditions, 1),
+         ('testBlocks', conditions, 1), ('testBlocks', conditions, 1), ...],
+        seed=1234, method='random',
+        constraints={'column': 'Signal', 'value': 1, 'max_run': 3, 'not_first': True})
+    schedule.trial_list(2)          # the conditions of block 2, in the order to run them
+    schedule.save(Output_ExpH+'.schedule')
+
+Constraints (for method='random'; 'sequential' blocks keep the file order):
+
+    column, value   which trials are constrained (default Signal == 1, the stop trials)
+    max_run         no more than this many of them in a row
+    not_first       never the first trial of a block
+
+The constrained shuffle is a few NumPy operations per block, so even a schedule
+of 100k trials takes milliseconds. With not_first alone every valid order is
+equally likely. With max_run, the trials that are not constrained are shuffled
+and the constrained ones are dealt into the gaps between them: each gap has
+max_run seats and the seats are drawn at random. Every valid order can come out,
+but the draw is not exactly uniform over them.
+
+The saved schedule is an OSARI binary file (see osari_binary.py) with the block,
+block name, trial and conditions row of every trial plus the conditions columns.
+The seed, constraints and conditions of every block are kept in its header.
+Print a saved schedule with
+
+    python osari_schedule.py data/s_123_OSARI_2020_Jul_19_1307.schedule
+"""
+from __future__ import absolute_import, division
+import os
+import numpy as np
+
+import osari_binary
+import osari_conditions
+
+try:
+    from collections.abc import Sequence
+except ImportError:  # Python 2
+    from collections import Sequence
+
+EXTENSION = '.schedule'
+
+
+def new_seed():
+    return int.from_bytes(os.urandom(4), 'little')
+
+
+def _first_not(rng, order, target):
+    """Move a random non target trial to the front of a shuffled block"""
+    others = np.flatnonzero(~target[order])
+    if not len(others):
+        raise ValueError('Cannot schedule a block without a first trial that is not constrained')
+    pick = others[rng.integers(len(others))]
+    order[[0, pick]] = order[[pick, 0]]
+    return order
+
+
+def _shuffle_block(rng, rows, target, max_run=None, not_first=False):
+    """Shuffle the conditions rows of one block under the constraints
+
+    "rows" holds the conditions row of every trial of the block, "target" says for
+    each conditions row whether it is constrained.
+    """
+    if not max_run:
+        order = rows[rng.permutation(len(rows))]
+        if not_first and len(order) and target[order[0]]:
+            # swapping the first trial with a random non target one keeps the draw
+            # uniform over the orders that satisfy the constraint
+            order = _first_not(rng, order, target)
+        return order
+    is_target = target[rows]
+    stops, others = rows[is_target], rows[~is_target]
+    stops, others = stops[rng.permutation(len(stops))], others[rng.permutation(len(others))]
+    # gap i comes after non target trial i-1 (gap 0 is the start of the block)
+    n_gaps = len(others)+1
+    skip = 1 if not_first else 0
+    n_seats = (n_gaps-skip)*max_run
+    if len(stops) > n_seats:
+        raise ValueError('%s constrained trials do not fit between %s others with at most %s in a row%s' % (
+            len(stops), len(others), max_run, ' and none first' if not_first else ''))
+    seats = rng.choice(n_seats, len(stops), replace=False)
+    per_gap = np.bincount(seats//max_run+skip, minlength=n_gaps)
+    order = np.empty(len(rows), dtype=rows.dtype)
+    at_other = np.cumsum(per_gap)[:-1]+np.arange(len(others))
+    placed = np.zeros(len(rows), dtype=bool)
+    placed[at_other] = True
+    order[placed] = others
+    order[~placed] = stops
+    return order
+
+
+def _target(conditions, column, value):
+    """Which conditions rows are constrained"""
+    if hasattr(conditions, 'column'):
+        return conditions.column(column) == value
+    return np.array([row.get(column) == value for row in conditions], dtype=bool)
+
+
+def _keys(conditions):
+    if isinstance(conditions, osari_conditions.Conditions):
+        return conditions.keys
+    keys = []
+    for row in conditions:
+        keys += [k for k in row if k not in keys]
+    return keys
+
+
+class BlockTrials(Sequence):
+    """The conditions of one block in scheduled order, made one row at a time"""
+
+    def __init__(self, conditions, rows):
+        self.conditions = conditions
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.conditions[r] for r in self.rows[i]]
+        return self.conditions[self.rows[i]]
+
+
+def _runs(flags):
+    """Length of the longest run of True"""
+    if not flags.any():
+        return 0
+    edges = np.diff(np.concatenate([[0], flags.astype(np.int8), [0]]))
+    return int((np.flatnonzero(edges == -1)-np.flatnonzero(edges == 1)).max())
+
+
+class Schedule(object):
+    """The trial order of a session
+
+    "names" and "conditions" hold the name and the conditions list of every block;
+    "block" and "condition" the block and the conditions row of every trial, in
+    the order they will be run; "starts" where each block starts.
+    """
+
+    def __init__(self, names, conditions, block, condition, seed=None, constraints=None):
+        self.names = list(names)
+        self.conditions = list(conditions)
+        self.block = np.asarray(block, dtype=np.int16)
+        self.condition = np.asarray(condition, dtype=np.int32)
+        self.starts = np.searchsorted(self.block, np.arange(len(self.names)+1))
+        self.seed = seed
+        self.constraints = constraints or {}
+
+    def __len__(self):
+        return len(self.condition)
+
+    def rows(self, block):
+        """The conditions rows of one block, in order"""
+        return self.condition[self.starts[block]:self.starts[block+1]]
+
+    def trial_list(self, block):
+        """The conditions (dicts) of one block in the order to run them
+
+        The rows are only made when they are used. A TrialHandler (method='sequential')
+        should be given list(trial_list(block)): it makes every row anyway, and the
+        ExperimentHandler pickles its trialList into the .psydat, which osari_psydat.py
+        can only read back as plain lists and dicts.
+        """
+        return BlockTrials(self.conditions[block], self.rows(block))
+
+    def check(self):
+        """Longest run of constrained trials and number of blocks starting with one"""
+        column, value = self.constraints.get('column', 'Signal'), self.constraints.get('value', 1)
+        longest, first = 0, 0
+        for b, conditions in enumerate(self.conditions):
+            flags = _target(conditions, column, value)[self.rows(b)] if len(conditions) else np.zeros(0, dtype=bool)
+            longest = max(longest, _runs(flags))
+            first += bool(len(flags) and flags[0])
+        return longest, first
+
+    def columns(self):
+        """The schedule as columns: block, name, trial, condition and the conditions columns"""
+        trial = np.arange(len(self))-self.starts[self.block]+1
+        columns = {'block': self.block, 'name': np.array(self.names)[self.block] if len(self) else np.zeros(0, str),
+                   'trial': trial, 'condition': self.condition}
+        keys = []
+        for conditions in self.conditions:
+            keys += [k for k in _keys(conditions) if k not in keys and k not in columns]
+        for key in keys:
+            values = []
+            for b, conditions in enumerate(self.conditions):
+                rows = self.rows(b)
+                if isinstance(conditions, osari_conditions.Conditions) and key in conditions.keys:
+                    values += conditions.column(key, rows).tolist()
+                else:
+                    values += [conditions[r].get(key) for r in rows]
+            if all(isinstance(v, (int, float)) or v is None for v in values):
+                columns[key] = np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+            else:
+                columns[key] = np.array(['' if v is None else str(v) for v in values])
+        return columns
+
+    def save(self, path):
+        osari_binary.write(path, self.columns(),
+            extra={'seed': self.seed, 'constraints': self.constraints, 'names': self.names,
+                   'conditions': [{'spec': c.spec} if isinstance(c, osari_conditions.Conditions) else list(c)
+                                  for c in self.conditions]})
+
+
+def make_schedule(blocks, seed=None, method='random', constraints=None):
+    """Build the schedule of a session
+
+    "blocks" is a list of (name, conditions, nReps), conditions being the list of
+    dicts returned by data.importConditions or an osari_conditions.Conditions.
+    A seed is drawn (and kept in the schedule) if none is given.
+    """
+    seed = new_seed() if seed is None else seed
+    constraints = dict(constraints or {})
+    rng = np.random.default_rng(seed)
+    column, value = constraints.get('column', 'Signal'), constraints.get('value', 1)
+    block, condition = [], []
+    targets = {}  # the same conditions list is usually used for many blocks
+    for b, (name, conditions, n_reps) in enumerate(blocks):
+        rows = np.tile(np.arange(len(conditions), dtype=np.int32), n_reps)
+        if method == 'random':
+            if id(conditions) not in targets:
+                targets[id(conditions)] = _target(conditions, column, value)
+            target = targets[id(conditions)]
+            rows = _shuffle_block(rng, rows, target, constraints.get('max_run'), constraints.get('not_first', False))
+        block.append(np.full(len(rows), b, dtype=np.int16))
+        condition.append(rows)
+    return Schedule([b[0] for b in blocks], [b[1] for b in blocks],
+        np.concatenate(block) if block else [], np.concatenate(condition) if condition else [],
+        seed, dict(constraints, method=method))
+
+
+def load(path):
+    """Read a schedule saved with Schedule.save"""
+    f = osari_binary.SessionFile(path, mmap=False)
+    extra = f.meta['extra']
+    conditions = [osari_conditions.Conditions(**c['spec']) if isinstance(c, dict) else c for c in extra['conditions']]
+    return Schedule(extra['names'], conditions, np.array(f.column('block')),
+        np.array(f.column('condition')), extra['seed'], extra['constraints'])
+
+
+if __name__ == '__main__':
+    import sys
+    schedule = load(sys.argv[1])
+    longest, first = schedule.check()
+    print('%s trials in %s blocks, seed %s, constraints %s' % (
+        len(schedule), len(schedule.names), schedule.seed, schedule.constraints))
+    print('longest run of constrained trials: %s, blocks starting with one: %s' % (longest, first))
+    for b, name in enumerate(schedule.names):
+        print('%s %s: %s' % (b, name, ' '.join(str(r) for r in schedule.rows(b))))
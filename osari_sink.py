@@ -0,0 +1,257 @@
+"""
+OSARI result sink
+
+Streams the session information and every finished trial over a TCP socket to a
+collector (see osari_collector.py), so the results of all testing computers end up
+in one place. The data folder is still written as usual; the sink is an extra copy.
+
+    sink = osari_sink.Sink('192.168.0.10:8766', session='s_123_OSARI_2020_Jul_19_1307',
+                           spool_dir='data/spool')
+    sink.post_session({'expInfo': expInfo, 'taskInfo_brief': taskInfo_brief})
+    sink.post_trial({'block': 1, 'trialType': 'testBlocks', 'trial': 1, ...})
+    ...
+    sink.close()        # (also called at exit)
+
+post_session() and post_trial() only append to a collections.deque and never wait.
+A background thread sends the records in batches of newline delimited JSON
+messages. Each message is {"session", "seq", "kind", "records"}, and the
+collector answers "ok <seq>" for every message it has stored.
+
+When the collector cannot be reached, or does not answer, each batch is written
+to the spool folder (one file per batch, fsynced before it is renamed into
+place). The thread then retries with a growing delay (up to max_delay seconds)
+and sends the spooled batches, oldest first, once the collector is back. Spooled
+batches left over from earlier sessions are sent too. The collector ignores
+batches it already has, so a batch that is sent twice is only stored once.
+
+A batch the collector answers with "error <message>" (e.g. records it can't
+store) would be rejected again however often it was sent, so it is not retried:
+it is kept in the spool folder as a .rejected file (sink.rejected has the
+collector's messages) and the batches after it go on being sent.
+
+Backpressure: when more than max_queue records are waiting, the thread stops
+trying the network for the current backlog and writes it straight to the spool,
+and post_trial() returns False, so that memory stays bounded while the trial
+loop carries on.
+"""
+from __future__ import absolute_import, division
+import atexit
+import collections
+import json
+import math
+import os
+import socket
+import threading
+import time
+
+SPOOL_EXTENSION = '.batch'
+REJECTED_EXTENSION = '.rejected'
+
+# what became of a batch sent to the collector
+SENT = 'sent'
+REJECTED = 'rejected'
+UNREACHABLE = 'unreachable'
+
+
+def _clean(value):
+    """NaN (and 'NaN' strings, as in the .txt file) to None, numpy scalars to Python values"""
+    if hasattr(value, 'item') and not hasattr(value, '__len__'):
+        value = value.item()
+    if value == 'NaN' or (isinstance(value, float) and math.isnan(value)):
+        return None
+    return value
+
+
+def _json_default(value):
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    return str(value)
+
+
+def parse_address(address):
+    """'host:port' (or a (host, port) tuple) to a (host, port) tuple"""
+    if isinstance(address, (tuple, list)):
+        return address[0], int(address[1])
+    host, _, port = address.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+class Sink(object):
+
+    def __init__(self, address, session, spool_dir='spool', batch_size=32, interval=1., timeout=2.,
+                 max_queue=5000, max_delay=30.):
+        self.address = parse_address(address)
+        self.session = session
+        self.spool_dir = spool_dir
+        self.batch_size = batch_size
+        self.interval = interval
+        self.timeout = timeout
+        self.max_queue = max_queue
+        self.max_delay = max_delay
+        if not os.path.exists(spool_dir):
+            os.makedirs(spool_dir)
+
+        self._queue = collections.deque()
+        self._started = time.time()
+        self._seq = 0
+        self._lock = threading.Lock()  # one flush at a time (the thread, or close())
+        self._socket = None
+        self._reader = None
+        self._delay = 0.
+        self._next_try = 0.
+        self._error = None
+        self.n_sent = 0
+        self.n_spooled = 0
+        self.rejected = []  # (file in the spool folder, the collector's message)
+        self.connected = False
+
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='OSARI sink')
+        self._thread.daemon = True
+        self._thread.start()
+        atexit.register(self.close)
+
+    # ------------------------------------------------------------- trial loop
+
+    def post_session(self, info):
+        """Queue the session information (any JSON serialisable dict)"""
+        self._queue.append(('session', info))
+        self._wake.set()
+        return len(self._queue) <= self.max_queue
+
+    def post_trial(self, record):
+        """Queue a finished trial; returns False while the sink is behind"""
+        self._queue.append(('trial', dict((k, _clean(v)) for k, v in record.items())))
+        if len(self._queue) >= self.batch_size:
+            self._wake.set()
+        return len(self._queue) <= self.max_queue
+
+    # ------------------------------------------------------------- sending
+
+    def _connect(self):
+        if self._socket is None:
+            self._socket = socket.create_connection(self.address, timeout=self.timeout)
+            self._reader = self._socket.makefile('rb')
+            self.connected = True
+
+    def _disconnect(self):
+        for closable in (self._reader, self._socket):
+            try:
+                if closable is not None:
+                    closable.close()
+            except (IOError, OSError):
+                pass
+        self._socket = self._reader = None
+        self.connected = False
+
+    def _send(self, message):
+        """Send one batch and wait for the collector's answer; returns SENT, REJECTED (the
+        collector answered with an error, the message is in self._error) or UNREACHABLE
+        (no connection or no answer: try again later)"""
+        if time.time() < self._next_try:
+            return UNREACHABLE
+        try:
+            self._connect()
+            self._socket.sendall(message)
+            reply = self._reader.readline().decode('utf-8')
+            words = reply.split()
+            if words[:1] == ['error']:
+                self._error = reply.strip()[len('error'):].strip()
+                self._delay = 0.
+                return REJECTED
+            if words[:1] != ['ok'] or words[1:2] != [str(json.loads(message)['seq'])]:
+                raise IOError('unexpected reply from the collector: %s' % words)
+        except (IOError, OSError, ValueError):
+            self._disconnect()
+            self._delay = min(max(self._delay*2, self.interval), self.max_delay)
+            self._next_try = time.time()+self._delay
+            return UNREACHABLE
+        self._delay = 0.
+        self.n_sent += 1
+        return SENT
+
+    def _message(self, kind, records):
+        self._seq += 1
+        message = {'session': self.session, 'seq': '%d.%06d' % (self._started*1000, self._seq),
+                   'kind': kind, 'records': records}
+        return (json.dumps(message, default=_json_default)+'\n').encode('utf-8')
+
+    def _spool(self, message, extension=SPOOL_EXTENSION):
+        name = '%s_%s%s' % (self.session, json.loads(message)['seq'], extension)
+        path = os.path.join(self.spool_dir, name)
+        with open(path+'.tmp', 'wb') as f:
+            f.write(message)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path+'.tmp', path)
+        if extension == SPOOL_EXTENSION:
+            self.n_spooled += 1
+        return path
+
+    def _reject(self, path):
+        """Keep a rejected batch aside (a .rejected file), so it is not sent again"""
+        self.rejected.append((os.path.basename(path), self._error))
+
+    def _spooled(self):
+        names = [n for n in os.listdir(self.spool_dir) if n.endswith(SPOOL_EXTENSION)]
+        return sorted(names, key=lambda n: (os.path.getmtime(os.path.join(self.spool_dir, n)), n))
+
+    def _send_spooled(self):
+        """Send spooled batches, oldest first; True once the spool is empty"""
+        for name in self._spooled():
+            path = os.path.join(self.spool_dir, name)
+            with open(path, 'rb') as f:
+                message = f.read()
+            result = self._send(message)
+            if result == UNREACHABLE:
+                return False
+            if result == REJECTED:
+                rejected = path[:-len(SPOOL_EXTENSION)]+REJECTED_EXTENSION
+                os.replace(path, rejected)
+                self._reject(rejected)
+            else:
+                os.remove(path)
+        return True
+
+    def _batches(self):
+        """Take everything queued, as (kind, records) batches in order"""
+        batches = []
+        while self._queue:
+            kind, record = self._queue.popleft()
+            if batches and batches[-1][0] == kind and len(batches[-1][1]) < self.batch_size:
+                batches[-1][1].append(record)
+            else:
+                batches.append((kind, [record]))
+        return batches
+
+    def _flush(self):
+        with self._lock:
+            # batches may only go out once everything spooled before them has
+            behind = len(self._queue) > self.max_queue
+            sending = not behind and self._send_spooled()
+            for kind, records in self._batches():
+                message = self._message(kind, records)
+                result = self._send(message) if sending else UNREACHABLE
+                if result == REJECTED:
+                    self._reject(self._spool(message, REJECTED_EXTENSION))
+                elif result == UNREACHABLE:
+                    sending = False
+                    self._spool(message)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self._flush()
+
+    def close(self, timeout=5.):
+        """Send what is left (or spool it if the collector does not answer in time)"""
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(timeout)
+        self._next_try = 0.
+        self._flush()
+        self._disconnect()
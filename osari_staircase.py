@@ -0,0 +1,264 @@
+"""
+OSARI staircase helpers
+
+Interleaved staircases:
+
+With 'Staircases' in taskInfo, e.g.
+
+    [{'start': .3}, {'start': .7}, {'start': .5, 'up': 2}]
+
+the stop trials are shared out between that many independent staircases instead
+of running one. Each has its own start SSD ('start'), step size ('step') and rule:
+the SSD goes up a step after 'up' successful stops in a row and down a step after
+'down' failed stops in a row (1 and 1 by default, the task's single staircase).
+The staircase of a stop trial is the 'Staircase' column of the conditions (e.g.
+"columns": {"Staircase": [0, 1, 2]} in a conditions spec, see osari_conditions.py),
+so it follows the (shuffled) trial schedule; stop trials without one go to the
+staircases in turn. The column is checked against the number of staircases when
+the schedule is made, before the first trial:
+
+    check_schedule(schedule, len(specs))    # ValueError for e.g. 3 or -1 with 3 staircases
+
+    staircases = Staircases(specs, lower=.05, upper=.775, step=.025, start=.5)
+    ssd = staircases.ssd[k]
+    staircases.update(k, stopped)       # after a stop trial of staircase k
+    staircases.summary()                # SSD, trials, reversals, converged SSD of each
+    staircases.save(path)
+
+The state of all staircases is kept in a few NumPy arrays (one entry per
+staircase, plus the SSDs of the last N_REVERSALS reversals of each in a ring),
+so choosing and updating a staircase costs the same however many there are.
+
+Warm start:
+
+Every session starts the staircase at 'StopS start pos. (seconds)'. With 'Warm
+start SSD' in taskInfo, a participant who has been tested before starts where the
+staircase of their last session converged instead:
+
+    ssd, source = warm_start('data', participant, default=.5, lower=.05, upper=.775)
+    ...
+    update_state('data', participant, session, trials)     # at the end of the session
+
+The converged SSD of a session is the mean SSD of the last N_REVERSALS reversals
+of the staircase over its test stop trials (a reversal is the stop trial where the
+SSD turned round). A session with fewer than MIN_REVERSALS reversals has not
+converged and is not used, nor is a session with interleaved staircases. The SSD
+is rounded to the ms and kept within the lowest and highest SSD of the session to
+come.
+
+Each participant's sessions are kept in data/participants/<Participant ID>.json, so
+the warm start reads one small file. If a participant has no such file yet (e.g.
+they were tested before the warm start existed) it is built from their sessions
+in the data folder (see osari_data.session_index) and saved.
+"""
+from __future__ import absolute_import, division
+import json
+import os
+import re
+import time
+import numpy as np
+
+import osari_data
+
+STATE_DIR = 'participants'
+N_REVERSALS = 6
+MIN_REVERSALS = 4
+
+
+def reversals(ssds):
+    """Indices of the reversals (where the direction of the SSD changes) in a sequence of SSDs"""
+    step = np.sign(np.diff(np.asarray(ssds, dtype=float)))
+    moves = np.flatnonzero(step)
+    return moves[1:][step[moves[1:]] != step[moves[:-1]]]
+
+
+def _as_trials(trials):
+    """A TRIAL_DTYPE array from an array or a list of 7-tuples in .txt column order"""
+    if isinstance(trials, np.ndarray):
+        return trials
+    return np.array([tuple(row) for row in trials], dtype=osari_data.TRIAL_DTYPE)
+
+
+def converged_ssd(trials, n_reversals=N_REVERSALS, min_reversals=MIN_REVERSALS,
+                  trial_types=osari_data.TEST_TRIAL_TYPES):
+    """(mean SSD of the last n_reversals reversals, number of reversals) of the test stop
+    trials of a session; the SSD is None if there are fewer than min_reversals reversals"""
+    trials = _as_trials(trials)
+    stop = trials[(trials['signal'] == 1) & ~np.isnan(trials['ssd']) & np.isin(trials['trialType'], trial_types)]
+    turns = reversals(stop['ssd'])
+    if len(turns) < min_reversals:
+        return None, len(turns)
+    return float(np.mean(stop['ssd'][turns[-n_reversals:]])), len(turns)
+
+
+class Staircases(object):
+    """Interleaved up/down staircases (see the module docstring)"""
+
+    def __init__(self, specs, lower, upper, step, start):
+        self.specs = [dict(spec) for spec in specs]
+        self.lower = lower
+        self.upper = upper
+        self.start = np.array([spec.get('start', start) for spec in specs], dtype=np.float64)
+        self.step = np.array([spec.get('step', step) for spec in specs], dtype=np.float64)
+        self.up = np.array([spec.get('up', 1) for spec in specs], dtype=np.int32)
+        self.down = np.array([spec.get('down', 1) for spec in specs], dtype=np.int32)
+        self.reset()
+
+    def __len__(self):
+        return len(self.start)
+
+    def reset(self):
+        """Every staircase back to its start"""
+        n = len(self)
+        self.ssd = self.start.copy()
+        self.run = np.zeros(n, dtype=np.int32)        # successful (+) or failed (-) stops in a row
+        self.direction = np.zeros(n, dtype=np.int8)   # last move: 1 up, -1 down
+        self.trials = np.zeros(n, dtype=np.int32)
+        self.reversals = np.zeros(n, dtype=np.int32)
+        self.last_reversals = np.full((n, N_REVERSALS), np.nan)
+
+    def update(self, k, stopped):
+        """Add a stop trial of staircase k (stopped: the key was held)"""
+        self.trials[k] += 1
+        move = 0
+        if stopped:
+            self.run[k] = max(self.run[k], 0)+1
+            if self.run[k] >= self.up[k]:
+                move = 1
+        else:
+            self.run[k] = min(self.run[k], 0)-1
+            if -self.run[k] >= self.down[k]:
+                move = -1
+        if not move:
+            return
+        self.run[k] = 0
+        if self.direction[k] and move != self.direction[k]:
+            self.last_reversals[k, self.reversals[k] % N_REVERSALS] = self.ssd[k]
+            self.reversals[k] += 1
+        self.direction[k] = move
+        self.ssd[k] = min(max(round(self.ssd[k]+move*self.step[k], 6), self.lower), self.upper)
+
+    def converged(self):
+        """Mean SSD of the last N_REVERSALS reversals of each staircase (NaN if it has fewer
+        than MIN_REVERSALS)"""
+        counted = np.where(np.isnan(self.last_reversals), 0., self.last_reversals).sum(1)
+        n = np.minimum(self.reversals, N_REVERSALS)
+        return np.where(self.reversals >= MIN_REVERSALS, counted/np.maximum(n, 1), np.nan)
+
+    def summary(self):
+        converged = self.converged()
+        return [{'staircase': k, 'start': self.start[k], 'step': self.step[k], 'up': self.up[k],
+                 'down': self.down[k], 'ssd': self.ssd[k], 'trials': self.trials[k],
+                 'reversals': self.reversals[k], 'converged_ssd': converged[k]} for k in range(len(self))]
+
+    def save(self, path):
+        """Write the summary of every staircase as a tab separated text file"""
+        names = ('staircase', 'start', 'step', 'up', 'down', 'ssd', 'trials', 'reversals', 'converged_ssd')
+        with open(path, 'w') as f:
+            f.write('\t'.join(names)+'\n')
+            for row in self.summary():
+                f.write('\t'.join('%s' % row[n] for n in names)+'\n')
+
+
+def check_schedule(schedule, n):
+    """Raise ValueError if the 'Staircase' column of a schedule (see osari_schedule.py)
+    has a value other than a staircase number, 0 to n-1, or an empty one"""
+    columns = schedule.columns()
+    if 'Staircase' not in columns:
+        return
+    bad = set()
+    for value in columns['Staircase']:
+        if value == '' or (isinstance(value, float) and np.isnan(value)):
+            continue
+        try:
+            k = float(value)
+        except ValueError:
+            k = None
+        if k is None or k != int(k) or not 0 <= k < n:
+            bad.add('%s' % value if k is None else '%g' % k)
+    if bad:
+        raise ValueError('the Staircase column of the conditions has %s; with %s staircases it can only '
+                         'be 0 to %s (or empty)' % (', '.join(sorted(bad)), n, n-1))
+
+
+def state_path(data_dir, participant):
+    name = re.sub(r'[^\w.-]', '_', str(participant))
+    return os.path.join(data_dir, STATE_DIR, name+'.json')
+
+
+def _session_entry(session, trials, method):
+    ssd, n = converged_ssd(trials)
+    stop = _as_trials(trials)['signal'] == 1
+    return {'session': session, 'method': method, 'converged_ssd': ssd, 'reversals': n,
+            'stop_trials': int(stop.sum()), 'updated': time.strftime('%Y-%m-%d %H:%M')}
+
+
+def _date_key(entry):
+    try:
+        return time.mktime(time.strptime(entry['date'], '%Y_%b_%d_%H%M'))
+    except (TypeError, ValueError):
+        return 0.
+
+
+def build_state(data_dir, participant):
+    """The state of a participant from their sessions in the data folder, oldest first"""
+    entries = [e for e in osari_data.session_index(data_dir)
+               if e['participant'] == str(participant) and e['txt']]
+    sessions = []
+    for entry in sorted(entries, key=_date_key):
+        info = osari_data.read_csv_info(entry['csv']) if entry['csv'] else {}
+        method = info.get('Method', 'staircase')
+        if method == 'staircase' and info.get('Staircases', '') not in ('', 'None'):
+            # interleaved staircases: the SSDs of the session are not one staircase
+            method = 'interleaved'
+        sessions.append(_session_entry(entry['session'], osari_data.read_txt(entry['txt']), method))
+    return {'participant': str(participant), 'sessions': sessions}
+
+
+def save_state(data_dir, state):
+    path = state_path(data_dir, state['participant'])
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path+'.tmp', 'w') as f:
+        json.dump(state, f, indent=1)
+    os.replace(path+'.tmp', path)
+
+
+def load_state(data_dir, participant):
+    """The participant's state file, built from the data folder (and saved) if there is none"""
+    path = state_path(data_dir, participant)
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    state = build_state(data_dir, participant)
+    save_state(data_dir, state)
+    return state
+
+
+def update_state(data_dir, participant, session, trials, method='staircase'):
+    """Add (or replace) a session in the participant's state file; returns its entry"""
+    state = load_state(data_dir, participant)
+    entry = _session_entry(session, trials, method)
+    state['sessions'] = [s for s in state['sessions'] if s['session'] != session]+[entry]
+    save_state(data_dir, state)
+    return entry
+
+
+def warm_start(data_dir, participant, default, lower, upper):
+    """(start SSD, where it came from) for a participant's next session"""
+    for entry in reversed(load_state(data_dir, participant)['sessions']):
+        if entry['method'] == 'staircase' and entry['converged_ssd'] is not None:
+            ssd = round(min(max(entry['converged_ssd'], lower), upper), 3)
+            return ssd, '%s (mean of the last %s of %s reversals)' % (
+                entry['session'], min(N_REVERSALS, entry['reversals']), entry['reversals'])
+    return default, 'default (no converged previous session)'
+
+
+if __name__ == '__main__':
+    import sys
+    data_dir = sys.argv[1] if len(sys.argv) > 1 else 'data'
+    for participant in sys.argv[2:] or sorted(set(e['participant'] for e in osari_data.session_index(data_dir))):
+        state = build_state(data_dir, participant)
+        for entry in state['sessions']:
+            print('%-12s %-40s %-10s %8s %4s reversals' % (participant, entry['session'], entry['method'],
+                '-' if entry['converged_ssd'] is None else '%.3f' % entry['converged_ssd'], entry['reversals']))
@@ -0,0 +1,270 @@
+"""
+OSARI online statistics
+
+Running statistics of a session, updated in constant time and memory per trial so
+that nothing is ever recomputed from the earlier trials:
+
+    stats = SessionStats(target_time=.8, alerts=taskInfo['Alerts'], method='staircase')
+    for alert in stats.update(records[i]):   # after every trial, any new alerts
+        logging.warning(alert)
+    stats.end_block()                        # end of a block, returns the block's alerts
+    stats.block_feedback()                   # text for the screen between blocks
+    stats.summary()                          # the session so far (test trials)
+
+Per block (all trials) and per session (test trials) a Tally keeps:
+
+    go lift error   mean and sd (Welford) of the lift time minus the target time (ms),
+                    the mean distance from the target and the 10/50/90% quantiles
+                    (P-square estimates, five markers per quantile)
+    stop success    proportion of stop trials without a lift
+    go omissions    proportion of go trials without a lift
+
+and the session keeps the mean SSD of the last SSD_WINDOW stop trials (a ring of SSDs
+with a running sum) and the number of reversals of each staircase.
+
+Alerts, each given once when it starts (a dict of thresholds in taskInfo['Alerts'];
+a name set to None is not checked):
+
+    'no response'       this many go trials in a row without a lift
+    'stuck staircase'   this many test stop trials in a row of a staircase at the same SSD
+                        (not checked with the 'fixed' method)
+    'stop success'      (low, high) - the stop success of a block outside this range
+    'go omissions'      the go omission rate of a block above this
+"""
+from __future__ import absolute_import, division
+import collections
+import math
+
+import osari_data
+
+QUANTILES = (.1, .5, .9)
+SSD_WINDOW = 10
+ALERTS = {'no response': 5,
+          'stuck staircase': 8,
+          'stop success': (.25, .75),
+          'go omissions': .1}
+
+
+class RunningMoments(object):
+    """Mean and variance by Welford's method"""
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.
+        self._m2 = 0.
+
+    def add(self, x):
+        self.n += 1
+        delta = x-self.mean
+        self.mean += delta/self.n
+        self._m2 += delta*(x-self.mean)
+
+    @property
+    def sd(self):
+        return math.sqrt(self._m2/(self.n-1)) if self.n > 1 else float('nan')
+
+
+class P2Quantile(object):
+    """Streaming estimate of the p quantile (the P-square algorithm of Jain and
+    Chlamtac, 1985): five markers whose heights are moved towards the quantile"""
+
+    def __init__(self, p):
+        self.p = p
+        self.n = 0
+        self.heights = []
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired = [1, 1+2*p, 1+4*p, 3+2*p, 5]
+        self.increments = [0, p/2, p, (1+p)/2, 1]
+
+    def add(self, x):
+        self.n += 1
+        q = self.heights
+        if self.n <= 5:
+            q.append(x)
+            q.sort()
+            return
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k+1]:
+                k += 1
+        n = self.positions
+        for i in range(k+1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+        for i in (1, 2, 3):
+            d = self.desired[i]-n[i]
+            if (d >= 1 and n[i+1]-n[i] > 1) or (d <= -1 and n[i-1]-n[i] < -1):
+                d = 1 if d > 0 else -1
+                # parabolic prediction, or linear if that would put the markers out of order
+                h = q[i]+d/(n[i+1]-n[i-1])*((n[i]-n[i-1]+d)*(q[i+1]-q[i])/(n[i+1]-n[i]) +
+                                             (n[i+1]-n[i]-d)*(q[i]-q[i-1])/(n[i]-n[i-1]))
+                if not q[i-1] < h < q[i+1]:
+                    h = q[i]+d*(q[i+d]-q[i])/(n[i+d]-n[i])
+                q[i] = h
+                n[i] += d
+
+    def value(self):
+        if not self.n:
+            return float('nan')
+        if self.n <= 5:
+            return self.heights[min(int(round(self.p*(self.n-1))), self.n-1)]
+        return self.heights[2]
+
+
+class Tally(object):
+    """Counts, lift error moments and quantiles of a set of trials"""
+
+    def __init__(self):
+        self.n_go = 0
+        self.n_go_lifted = 0
+        self.n_stop = 0
+        self.n_stop_success = 0
+        self.error = RunningMoments()
+        self.distance = 0.
+        self.quantiles = [P2Quantile(p) for p in QUANTILES]
+
+    def add(self, signal, lifted, error_ms):
+        if signal == 1:
+            self.n_stop += 1
+            self.n_stop_success += not lifted
+        else:
+            self.n_go += 1
+            if lifted:
+                self.n_go_lifted += 1
+            if not math.isnan(error_ms):
+                self.error.add(error_ms)
+                self.distance += abs(error_ms)
+                for q in self.quantiles:
+                    q.add(error_ms)
+
+    def summary(self):
+        nan = float('nan')
+        summary = {'go': self.n_go, 'stop': self.n_stop, 'correct go': self.n_go_lifted,
+                   'correct stop': self.n_stop_success,
+                   'stop success': self.n_stop_success/self.n_stop if self.n_stop else nan,
+                   'go omissions': 1-self.n_go_lifted/self.n_go if self.n_go else nan,
+                   'lift error mean': self.error.mean if self.error.n else nan,
+                   'lift error sd': self.error.sd,
+                   'distance from target': self.distance/self.error.n if self.error.n else nan}
+        for q in self.quantiles:
+            summary['lift error p%02d' % round(100*q.p)] = q.value()
+        return summary
+
+
+def _names(record):
+    """The field names of a record (a NumPy record or a dict)"""
+    names = getattr(getattr(record, 'dtype', None), 'names', None)
+    return names if names is not None else record
+
+
+class SessionStats(object):
+    """The running statistics and alerts of a session (see the module docstring)"""
+
+    def __init__(self, target_time, alerts=None, method='staircase', ssd_window=SSD_WINDOW,
+                 trial_types=osari_data.TEST_TRIAL_TYPES):
+        self.target_time = target_time
+        unknown = set(alerts or {})-set(ALERTS)
+        if unknown:
+            raise ValueError('unknown alerts %s (alerts: %s)' % (', '.join(sorted(unknown)), ', '.join(sorted(ALERTS))))
+        self.alerts = dict(ALERTS, **(alerts or {}))
+        if method == 'fixed':
+            # the SSDs come from the conditions file
+            self.alerts['stuck staircase'] = None
+        self.trial_types = trial_types
+        self.session = Tally()
+        self.block = Tally()
+        self.last_block = None
+        self.n_blocks = 0
+        self._ssds = collections.deque(maxlen=ssd_window)
+        self._ssd_sum = 0.
+        self.reversals = {}
+        self._staircases = {}   # staircase -> (last SSD, last direction, stop trials at that SSD)
+        self._no_response = 0
+
+    def update(self, record):
+        """Add a trial (a record of osari_records.SessionRecords, or anything with its
+        fields); returns the messages of the alerts it started"""
+        signal, lifted = int(record['signal']), int(record['response']) == 1
+        rt = float(record['rt'])
+        error_ms = (rt-self.target_time)*1000 if lifted and not math.isnan(rt) else float('nan')
+        self.block.add(signal, lifted, error_ms)
+        alerts = []
+        if signal == 0:
+            self._no_response = 0 if lifted else self._no_response+1
+            if self._no_response == self.alerts['no response']:
+                alerts.append('no lift on the last %s go trials - is the participant still responding?'
+                              % self._no_response)
+        if str(record['trialType']) not in self.trial_types:
+            return alerts
+        self.session.add(signal, lifted, error_ms)
+        ssd = float(record['ssd'])
+        if signal == 1 and not math.isnan(ssd):
+            if len(self._ssds) == self._ssds.maxlen:
+                self._ssd_sum -= self._ssds[0]
+            self._ssds.append(ssd)
+            self._ssd_sum += ssd
+            staircase = int(record['staircase']) if 'staircase' in _names(record) else -1
+            last, direction, same = self._staircases.get(staircase, (None, 0, 0))
+            if last is not None and round(ssd-last, 6) != 0:
+                turn = 1 if ssd > last else -1
+                if direction and turn != direction:
+                    self.reversals[staircase] = self.reversals.get(staircase, 0)+1
+                direction, same = turn, 1
+            else:
+                same += 1
+            self._staircases[staircase] = (ssd, direction, same)
+            if same == self.alerts['stuck staircase']:
+                alerts.append('the SSD%s has been %.3f s for %s stop trials in a row - is the staircase stuck?'
+                              % (' of staircase %s' % staircase if staircase >= 0 else '', ssd, same))
+        return alerts
+
+    def end_block(self):
+        """Keep the summary of the block that ended (for block_feedback) and start the next;
+        returns the alerts on the block"""
+        self.n_blocks += 1
+        self.last_block = self.block.summary()
+        self.block = Tally()
+        alerts = []
+        low_high = self.alerts['stop success']
+        success = self.last_block['stop success']
+        if low_high is not None and not math.isnan(success) and not low_high[0] <= success <= low_high[1]:
+            alerts.append('stop success %.0f%% in block %s (expected %.0f-%.0f%%)' % (
+                100*success, self.n_blocks, 100*low_high[0], 100*low_high[1]))
+        omissions = self.last_block['go omissions']
+        if self.alerts['go omissions'] is not None and not math.isnan(omissions) and \
+                omissions > self.alerts['go omissions']:
+            alerts.append('%.0f%% of the go trials of block %s without a lift' % (100*omissions, self.n_blocks))
+        return alerts
+
+    @property
+    def ssd_average(self):
+        return self._ssd_sum/len(self._ssds) if self._ssds else float('nan')
+
+    def summary(self):
+        """The session so far (test trials)"""
+        summary = self.session.summary()
+        summary.update({'ssd average': self.ssd_average, 'reversals': sum(self.reversals.values())})
+        return summary
+
+    def block_feedback(self):
+        """The participant's feedback on the last block, for the screen between blocks"""
+        return feedback_text(self.last_block) if self.last_block else ''
+
+
+def feedback_text(summary):
+    """Feedback for the participant from a Tally summary"""
+    lines = []
+    if summary['go']:
+        lines.append('You stopped the bar on %s of %s go trials' % (summary['correct go'], summary['go']))
+        if not math.isnan(summary['distance from target']):
+            lines.append('on average %.0f ms from the target' % summary['distance from target'])
+    if summary['stop']:
+        lines.append('You held the key on %s of %s stop trials' % (summary['correct stop'], summary['stop']))
+    return '\n'.join(lines)
@@ -0,0 +1,75 @@
+"""
+OSARI stimuli
+
+The stimuli drawn during a trial, made in one place so that the task and the
+render benchmark (osari_benchmark.py) draw exactly the same things:
+
+    stimuli = make_stimuli(win, taskInfo_brief, taskInfo)
+        'Bar'               the static (white) background bar
+        'fillBar'           the filling (blue) bar
+        'targetArrowRight'  the yellow target arrows either side of the bar
+        'targetArrowLeft'
+        'Spaceship'         the optional spaceship that rides on top of the fillBar
+        'number_text'       the countdown digit
+        'vert'              vertices of the fillBar at the start of a trial
+        'fullvert'          vertices of the static bar
+
+    feedback_text(win, text)   a feedback message to the left of the bar
+"""
+from __future__ import absolute_import, division
+import os
+import numpy as np
+
+# width of the target arrows (cm)
+TARGET_WIDTH = 0.5
+
+
+def bar_vertices(taskInfo):
+    """Vertices (cm) of the fillBar at the start of a trial and of the static bar"""
+    bar_width_vert1 = 0-(taskInfo['Bar width (cm)']/2)
+    bar_width_vert2 = (taskInfo['Bar width (cm)']/2)
+    base = 0-taskInfo['Bar base below fixation (cm)']
+    # "vert" = vertices (corners) of filling bar in x y coordinates ([0, 0] = centre)
+    vert = [(bar_width_vert1, base), (bar_width_vert1, base+.01),
+            (bar_width_vert2, base+.01), (bar_width_vert2, base)]
+    # "fullvert" = vertices of the static background bar
+    fullvert = [(bar_width_vert1, base),
+                (bar_width_vert1, taskInfo['Bar top above fixation (cm)']),
+                (bar_width_vert2, taskInfo['Bar top above fixation (cm)']),
+                (bar_width_vert2, base)]
+    return vert, fullvert
+
+
+def arrow_vertices(target_pos, target_width=TARGET_WIDTH):
+    """Vertices (cm) of the right and left target arrows"""
+    right = [(1.5, target_pos),
+             (1.5+target_width, target_pos+(target_width/np.sqrt(3))),
+             (1.5+target_width, target_pos-(target_width/np.sqrt(3)))]
+    left = [(-1.5-target_width, target_pos+(target_width/np.sqrt(3))),
+            (-1.5-target_width, target_pos-(target_width/np.sqrt(3))),
+            (-1.5, target_pos)]
+    return right, left
+
+
+def make_stimuli(win, taskInfo_brief, taskInfo, stimuli_dir='Stimuli'):
+    """The stimuli of the bar rise and the countdown (see the module docstring)"""
+    from psychopy import visual
+    target_pos = taskInfo['Target line above fixation (cm)']
+    vert, fullvert = bar_vertices(taskInfo)
+    right, left = arrow_vertices(target_pos)
+    return {'vert': vert,
+            'fullvert': fullvert,
+            'fillBar': visual.ShapeStim(win, fillColor='skyblue', lineWidth=0, opacity=1, units='cm', vertices=vert),
+            'Bar': visual.ShapeStim(win, vertices=fullvert, fillColor='white', lineWidth=0, opacity=1, units='cm'),
+            'targetArrowRight': visual.ShapeStim(win, vertices=right, fillColor='yellow', lineWidth=0, opacity=1, units='cm'),
+            'targetArrowLeft': visual.ShapeStim(win, vertices=left, fillColor='yellow', lineWidth=0, opacity=1, units='cm'),
+            # the line in the middle of the spaceship should eventually line up with the target line
+            'Spaceship': visual.ImageStim(win, image=os.path.join(stimuli_dir, 'SpaceShip_scaled.png'),
+                pos=(0, vert[2][1]), units='cm'),
+            'number_text': visual.TextStim(win, pos=[0, target_pos], height=1, color=[-1, -1, -1], text="1", units='cm')}
+
+
+def feedback_text(win, text):
+    """A feedback message, shown to the left of the bar"""
+    from psychopy import visual
+    return visual.TextStim(win, pos=[-8, 0], height=1, color=[1, 1, 1], text=text, units='cm')
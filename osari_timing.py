@@ -0,0 +1,193 @@
+"""
+OSARI timing helpers
+
+Idle waiting:
+
+event.waitKeys() and core.wait() spin on the CPU while a static screen is up
+(core.wait only for its last 0.2 s). Over a long session this keeps a core busy,
+the laptop heats up and throttles, and that shows up in the frame timing of the
+bar rise. The waits here sleep between checks for input instead:
+
+    wait_keys(keyList=None)     like event.waitKeys(), returns the list of keys
+    wait(secs)                  like core.wait(), but sleeps all the way
+    idle(secs)                  a short sleep between polls, e.g. in the countdown
+
+Key presses and lifts are time stamped by the keyboard backend when they happen,
+not when they are polled, so the sleeps don't change any recorded times.
+
+Phases:
+
+Phases records the wall clock and CPU time (of the whole process, so the log,
+monitor and sink threads are included) spent in each phase of every trial:
+
+    phases = osari_timing.Phases(profile=('bar rise',), profile_every=10)
+    phases.start('countdown')   # ends the previous phase
+    ...
+    phases.end_trial()          # {phase: (wall, cpu)} of the trial that just ended
+    phases.save(Output_ExpH+'.phases')
+    phases.write_report(Output_ExpH+'.timing')
+
+Timers use time.perf_counter. The durations of each phase are also counted in a
+histogram (log spaced bins from 0.1 ms to 100 s, ten per decade), which the report
+prints along with the percentiles of each phase. The phases named in "profile" are
+run under cProfile on every profile_every-th trial, and the report lists the
+functions that took the most time in them.
+
+With Phases(enabled=False) every method is a no-op (start() is a function that
+returns straight away), so the calls can stay in the trial loop.
+"""
+from __future__ import absolute_import, division
+import time
+import numpy as np
+
+# histogram bin edges (s): 0.1 ms to 100 s, 10 per decade
+BINS = 10**np.linspace(-4, 2, 61)
+
+# seconds between checks for input while waiting
+POLL = .005
+
+
+def idle(secs=POLL):
+    time.sleep(secs)
+
+
+def wait(secs):
+    """core.wait without the CPU hogging at the end"""
+    from psychopy import core
+    core.wait(secs, hogCPUperiod=0)
+
+
+def wait_keys(keyList=None, maxWait=None, poll=POLL):
+    """event.waitKeys (clearing earlier key presses first) that sleeps between checks
+
+    Returns the keys pressed, or None if maxWait seconds passed first.
+    """
+    from psychopy import event
+    event.clearEvents('keyboard')
+    start = time.time()
+    while maxWait is None or time.time()-start < maxWait:
+        keys = event.getKeys(keyList=keyList)
+        if keys:
+            return keys
+        time.sleep(poll)
+    return None
+
+
+def _nothing(*args, **kwargs):
+    return {}
+
+
+class Phases(object):
+    """Wall clock and CPU time of every phase of every trial"""
+
+    def __init__(self, enabled=True, profile=(), profile_every=10):
+        self.enabled = enabled
+        self.rows = []  # (trial, phase, wall, cpu)
+        self.trial = 0
+        self.histograms = {}  # phase -> counts per bin (wall clock time)
+        self.profile = tuple(profile)
+        self.profile_every = profile_every
+        self._profiler = None
+        self._profiling = False
+        self._phase = None
+        self._current = {}
+        if not enabled:
+            self.start = self.stop = self.end_trial = _nothing
+
+    def start(self, phase):
+        """End the current phase (if any) and start "phase" """
+        now, cpu = time.perf_counter(), time.process_time()
+        if self._profiling:
+            self._profiler.disable()
+            self._profiling = False
+        if self._phase is not None:
+            wall0, cpu0 = self._started
+            total = self._current.get(self._phase, (0., 0.))
+            self._current[self._phase] = (total[0]+now-wall0, total[1]+cpu-cpu0)
+        self._phase = phase
+        if phase in self.profile and self.trial % self.profile_every == 0:
+            if self._profiler is None:
+                import cProfile
+                self._profiler = cProfile.Profile()
+            self._profiling = True
+            self._profiler.enable()
+        self._started = (time.perf_counter(), time.process_time())
+
+    def stop(self):
+        self.start(None)
+
+    def end_trial(self):
+        """End the trial; returns {phase: (wall, cpu)} of the trial (seconds)"""
+        self.stop()
+        current = self._current
+        for phase, (wall, cpu) in current.items():
+            self.rows.append((self.trial, phase, wall, cpu))
+            if phase not in self.histograms:
+                self.histograms[phase] = np.zeros(len(BINS)+1, dtype=np.int64)
+            self.histograms[phase][np.searchsorted(BINS, wall)] += 1
+        self.trial += 1
+        self._current = {}
+        return current
+
+    def totals(self):
+        """{phase: (wall, cpu)} summed over the session"""
+        totals = {}
+        for _, phase, wall, cpu in self.rows:
+            total = totals.get(phase, (0., 0.))
+            totals[phase] = (total[0]+wall, total[1]+cpu)
+        return totals
+
+    def save(self, path):
+        """Write the phases of every trial as a tab separated text file"""
+        if not self.enabled:
+            return
+        with open(path, 'w') as f:
+            f.write('trial\tphase\twall\tcpu\n')
+            for row in self.rows:
+                f.write('%s\t%s\t%.6f\t%.6f\n' % row)
+
+    def summary(self):
+        """Per phase: n, total wall and cpu time, mean, median, 95th and 99th percentile
+        and maximum (wall clock, s)"""
+        summary = {}
+        for phase in sorted(set(row[1] for row in self.rows)):
+            wall = np.array([row[2] for row in self.rows if row[1] == phase])
+            cpu = np.array([row[3] for row in self.rows if row[1] == phase])
+            p50, p95, p99 = np.percentile(wall, [50, 95, 99])
+            summary[phase] = {'n': len(wall), 'wall': wall.sum(), 'cpu': cpu.sum(), 'mean': wall.mean(),
+                              'median': p50, 'p95': p95, 'p99': p99, 'max': wall.max()}
+        return summary
+
+    def report(self, n_functions=15):
+        """The timing report as text"""
+        lines = ['Timing of %s trials' % self.trial, '',
+                 '%-14s %6s %10s %10s %6s %10s %10s %10s %10s %10s' % (
+                     'phase', 'n', 'wall (s)', 'cpu (s)', 'cpu %', 'mean (ms)', 'median', 'p95', 'p99', 'max')]
+        summary = self.summary()
+        for phase, s in summary.items():
+            lines.append('%-14s %6d %10.2f %10.2f %6.0f %10.2f %10.2f %10.2f %10.2f %10.2f' % (
+                phase, s['n'], s['wall'], s['cpu'], 100*s['cpu']/max(s['wall'], 1e-9),
+                s['mean']*1000, s['median']*1000, s['p95']*1000, s['p99']*1000, s['max']*1000))
+        for phase in summary:
+            counts = self.histograms[phase]
+            used = np.flatnonzero(counts)
+            lines += ['', 'Histogram of %s (ms)' % phase]
+            for i in range(used.min(), used.max()+1):
+                low = BINS[i-1]*1000 if i > 0 else 0.
+                high = BINS[i]*1000 if i < len(BINS) else np.inf
+                lines.append('  %10.2f - %10.2f %6d %s' % (low, high, counts[i],
+                    '#'*int(np.ceil(50*counts[i]/counts.max()))))
+        if self._profiler is not None:
+            import io
+            import pstats
+            stream = io.StringIO()
+            pstats.Stats(self._profiler, stream=stream).sort_stats('cumulative').print_stats(n_functions)
+            lines += ['', 'Profile of %s (every %s trials)' % (', '.join(self.profile), self.profile_every),
+                      stream.getvalue()]
+        return '\n'.join(lines)+'\n'
+
+    def write_report(self, path):
+        if not self.enabled or not self.rows:
+            return
+        with open(path, 'w') as f:
+            f.write(self.report())
@@ -0,0 +1,394 @@
+"""
+OSARI trial logic
+
+The decisions made in every trial of OSARI_time_v1.8.py (the SSD staircase, the
+outcome and feedback of a trial and the row written to the output files), kept
+apart from the screen and the keyboard so that recorded sessions can be replayed
+through exactly the same code:
+
+    engine = TrialEngine(taskInfo_brief, taskInfo)
+    engine.restart()                            # first test trial: SSD back to its start
+    this_stoptime = engine.start(thisTrial)     # the staircase, psi or fixed SSD for this trial
+    ...                                         # bar rise: bar_height(), release_time()
+    result = engine.finish(Signal, lift_time, kd_start_synced, trial_label)
+    engine.update()                             # psi: posterior and next SSD (in the ISI)
+    row = txt_row(block_count, trial_label, trial_count, Signal, result['lifted'], this_stoptime, result['rt'])
+
+engine.finish() returns the outcome of the trial:
+
+    correct     2 = stopped on a stop trial, 1 = lifted on a go trial,
+                -1 = lifted on a stop trial, -2 = did not lift on a go trial
+    lifted      1 if the key was lifted before the bar filled, else 0
+    RT, rt      lift time (trial clock) and release time, 'NaN' if not lifted
+    feedback    'correctgo', 'incorrectstop', 'correctstop' or 'incorrectgo'
+    feedback_ms distance of the lift from the target (ms), correct go trials only
+    colour      colour of the target arrows
+    staircase   the staircase of a stop trial, with interleaved staircases
+
+Replay (golden outputs):
+
+replay() runs the trials of a recorded session through the engine. The input is
+the participant's release time on every trial (the rt column of the .txt file,
+held to the end where it is NaN) and a virtual clock moves the bar rise on one
+frame at a time, checking for the release on every frame as the task does. It
+returns what the task would write: the .txt rows, the columns of every trial in
+the ExperimentHandler csv (osari_records.csv_columns, added through
+SessionRecords.add_data as in the task, followed by the session's extraInfo) and
+the SSD (stoptime) before every trial. These are compared with golden copies
+stored from an earlier run:
+
+    python osari_trial.py data golden --record  # store the outputs as the golden files
+    python osari_trial.py data golden           # replay every session and diff
+
+Sessions are replayed in parallel. The exit status is 1 if the outputs of any
+session differ from its golden files (the differences are printed). Sessions
+without golden files are listed but not counted as a difference; --record adds
+them. The number of trials where the replay does not reproduce the recorded
+response or SSD is listed too (older versions of the task, or a change of logic).
+"""
+from __future__ import absolute_import, division
+import csv
+import difflib
+import io
+import os
+import numpy as np
+
+import osari_config
+import osari_data
+import osari_psi
+import osari_staircase
+
+FRAME = 1/60
+TXT_HEADER = 'block\ttrialType\ttrial\tsignal\tresponse\tssd\trt\n'
+TXT_FORMAT = '%s\t%s\t%s\t%s\t%s\t%s\t%s\n'
+CSV_COLUMNS = ('block', 'trialType', 'trial', 'signal', 'response', 'ssd', 'rt')
+OUTPUTS = ('.txt', '.csv', '.ssd')
+
+# the parameters of the task that the trial logic uses, with their default values
+DEFAULT_TASK_INFO_BRIEF = {'Practice trials': True,
+                           'Method': 'staircase',
+                           'Step size (s)': 0.025,
+                           'Lowest SSD (s)': 0.05,
+                           'Highest SSD (s)': 0.775,
+                           'Total bar height (in cm)': 15}
+DEFAULT_TASK_INFO = {'StopS start pos. (seconds)': .5,
+                     'trial length (max trial duration in seconds)': 1}
+
+
+def bar_height(time_elapsed, this_stoptime, trial_length, total_height):
+    """Height (cm) of the filling bar "time_elapsed" seconds into the bar rise"""
+    if time_elapsed < this_stoptime:
+        return (time_elapsed*total_height)/trial_length
+    return (this_stoptime*total_height)/trial_length
+
+
+def release_time(duration, tDown, reset_time):
+    """Time of a key release on the trial clock (reset when the bar starts rising)"""
+    return duration-np.abs(tDown-reset_time)
+
+
+def first_test_trial(name, block_count, practice_trials):
+    """True for the block that starts the test trials (asked whether the task is understood)"""
+    return name == 'testBlocks' and ((practice_trials and block_count == 3) or (not practice_trials and block_count == 1))
+
+
+def txt_row(block_count, trial_label, trial_count, signal, lifted, this_stoptime, rt):
+    """The row of the .txt file (the ssd of a go trial is 'NaN')"""
+    return (block_count, trial_label, trial_count, signal, lifted, 'NaN' if signal == 0 else this_stoptime, rt)
+
+
+class TrialEngine(object):
+    """The SSD (staircase, psi or fixed) and the outcome of each trial"""
+
+    def __init__(self, taskInfo_brief, taskInfo):
+        self.method = taskInfo_brief['Method']
+        self.stepsize = taskInfo_brief['Step size (s)']
+        self.lower_ssd = taskInfo_brief['Lowest SSD (s)']
+        self.upper_ssd = taskInfo_brief['Highest SSD (s)']
+        self.start_ssd = taskInfo['StopS start pos. (seconds)']
+        self.trial_length = taskInfo['trial length (max trial duration in seconds)']
+        self.stoptime = self.start_ssd
+        self.correct = []
+        # 'psi': Bayesian choice of the SSD (see osari_psi.py)
+        self.psi = None
+        self._pending = None
+        if self.method == 'psi':
+            self.psi = osari_psi.Psi(self.lower_ssd, self.upper_ssd, self.stepsize, start=self.start_ssd)
+        # interleaved staircases, one per stop trial chosen by the 'Staircase' column (see osari_staircase.py)
+        self.staircases = None
+        self.staircase = None
+        self._n_stop = 0
+        if self.method == 'staircase' and taskInfo.get('Staircases'):
+            self.staircases = osari_staircase.Staircases(taskInfo['Staircases'], self.lower_ssd, self.upper_ssd,
+                                                         self.stepsize, self.start_ssd)
+        self.correct_gos = 0
+        self.correct_StopSs = 0
+        self.feedback_list = []
+
+    def restart(self):
+        """SSD back to its starting value, so nothing carries over from the practice"""
+        self.stoptime = self.start_ssd
+        self.correct = []
+        self._n_stop = 0
+        if self.psi is not None:
+            self.psi.reset()
+            self._pending = None
+        if self.staircases is not None:
+            self.staircases.reset()
+
+    def start(self, thisTrial):
+        """Set the SSD from the outcome of the previous trial; returns the stop time of this
+        trial (the trial length on a go trial)"""
+        stoptime = self.stoptime
+        if self.method == 'psi':
+            self.update()
+            stoptime = float(self.psi.ssd)
+        elif self.staircases is not None:
+            if thisTrial['Signal'] == 1:
+                k = thisTrial.get('Staircase')
+                if k is None or k == '':
+                    k = self._n_stop % len(self.staircases)
+                self._n_stop += 1
+                self.staircase = int(k)
+                stoptime = float(self.staircases.ssd[self.staircase])
+        elif not self.method == 'fixed':
+            # never compare floats for equality, so round
+            if self.correct == -1 and round(stoptime, 3) > round(self.lower_ssd, 3):
+                stoptime = stoptime-self.stepsize
+            elif self.correct == -1 and round(stoptime, 3) == round(self.lower_ssd, 3):
+                stoptime = self.lower_ssd
+            elif self.correct == 2 and round(stoptime, 3) < round(self.upper_ssd, 3):
+                stoptime = stoptime+self.stepsize
+            elif self.correct == 2 and round(stoptime, 3) == round(self.upper_ssd, 3):
+                stoptime = self.upper_ssd
+        else:
+            stoptime = thisTrial['fixedStopTime']
+        self.stoptime = stoptime
+        self.correct = []
+        if thisTrial['Signal'] == 0:
+            return self.trial_length
+        return stoptime
+
+    def finish(self, signal, lift_time, rt, trial_label):
+        """The outcome of the trial (see the module docstring); lift_time is None if the
+        key was held until the bar filled"""
+        result = {'feedback_ms': None}
+        if lift_time is None:
+            result.update(lifted=0, RT='NaN', rt='NaN')
+            if signal == 0:
+                result.update(correct=-2, feedback='incorrectstop', colour='Red')
+            elif signal == 1:
+                result.update(correct=2, feedback='correctstop', colour='Green')
+                self.correct_StopSs += 1
+        else:
+            result.update(lifted=1, RT=lift_time, rt=rt)
+            if signal == 0:
+                # the target is at 80% of the trial length
+                feedback_ms = round(abs(((self.trial_length*osari_config.TARGET)-lift_time)*1000))
+                result.update(correct=1, feedback='correctgo', colour='Green', feedback_ms=feedback_ms)
+                self.feedback_list.append(feedback_ms)
+                if trial_label in osari_data.TEST_TRIAL_TYPES:
+                    self.correct_gos += 1
+            elif signal == 1:
+                result.update(correct=-1, feedback='incorrectgo', colour='Red')
+        self.correct = result['correct']
+        if self.psi is not None and signal == 1:
+            self._pending = (self.stoptime, result['lifted'])
+        if self.staircases is not None and signal == 1:
+            self.staircases.update(self.staircase, result['lifted'] == 0)
+            result['staircase'] = self.staircase
+        return result
+
+    def update(self):
+        """psi: add the last stop trial to the posterior and choose the next SSD. Returns the
+        posterior summary (see osari_psi.Psi.summary), or None if there was nothing to add.
+        Called in the ISI, and by start() if it has not been."""
+        if self._pending is None:
+            return None
+        ssd, lifted = self._pending
+        self._pending = None
+        return self.psi.update(ssd, lifted)
+
+
+# ------------------------------------------------------------- replay
+
+def bar_rise(release, trial_length, frame_dur=FRAME):
+    """Time on the trial clock at which the bar rise loop sees a release at "release"
+    (None: held), with a virtual clock that moves on one frame per loop"""
+    time_elapsed = 0
+    frame = 0
+    while time_elapsed < trial_length:
+        time_elapsed = frame*frame_dur
+        if release is not None and release <= time_elapsed:
+            return time_elapsed
+        frame += 1
+    return None
+
+
+def _parse(value):
+    if value in ('True', 'False'):
+        return value == 'True'
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return value
+
+
+def session_parameters(info):
+    """taskInfo_brief and taskInfo for the trial logic, from the session information
+    (e.g. osari_data.read_csv_info) with the task's defaults for anything missing"""
+    taskInfo_brief = dict(DEFAULT_TASK_INFO_BRIEF)
+    taskInfo = dict(DEFAULT_TASK_INFO)
+    for name in taskInfo_brief:
+        if name in info and info[name] != '':
+            taskInfo_brief[name] = _parse(info[name])
+    for name in taskInfo:
+        if name in info and info[name] != '':
+            taskInfo[name] = _parse(info[name])
+    return taskInfo_brief, taskInfo
+
+
+class _CsvRow(object):
+    """The data added to a trial of a TrialHandler (for SessionRecords.add_data)"""
+
+    def __init__(self):
+        self.data = {}
+
+    def addData(self, name, value):
+        self.data[name] = value
+
+
+def replay(trials, taskInfo_brief, taskInfo, frame_dur=FRAME):
+    """Run recorded trials (TRIAL_DTYPE) through the trial logic
+
+    Returns {'txt': rows of the .txt file, 'csv': the csv columns of every trial,
+    'csv_columns': their names, 'ssd': the stoptime before every trial}. The rows are
+    made from session records as in the task (see osari_records.py).
+    """
+    import osari_records
+    engine = TrialEngine(taskInfo_brief, taskInfo)
+    records = osari_records.SessionRecords(len(trials))
+    columns = osari_records.csv_columns(staircases=engine.staircases is not None)
+    rows, csv_rows, ssds = [], [], []
+    block_count = None
+    for trial in trials:
+        if trial['block'] != block_count:
+            block_count = int(trial['block'])
+            trial_count = 0
+        trial_count += 1
+        trial_label = str(trial['trialType'])
+        if trial_count == 1 and first_test_trial(trial_label, block_count, taskInfo_brief['Practice trials']):
+            engine.restart()
+        signal = int(trial['signal'])
+        # a fixed SSD is only known on stop trials; go trials leave it where it was
+        fixed = float(trial['ssd']) if signal == 1 else engine.stoptime
+        this_stoptime = engine.start({'Signal': signal, 'fixedStopTime': fixed})
+        ssds.append(engine.stoptime)
+        release = None if np.isnan(trial['rt']) else float(trial['rt'])
+        lift_time = bar_rise(release, engine.trial_length, frame_dur)
+        result = engine.finish(signal, lift_time, release, trial_label)
+        i = records.new()
+        records.fill(i, block_count, trial_label, trial_count, signal, this_stoptime, result)
+        rows.append(records.txt_row(i))
+        csv_row = _CsvRow()
+        records.add_data(i, csv_row, columns)
+        csv_rows.append(csv_row.data)
+    return {'txt': rows, 'csv': csv_rows, 'csv_columns': columns, 'ssd': ssds}
+
+
+def render(outputs, info=None):
+    """The output files of a replay as text: {'.txt': ..., '.csv': ..., '.ssd': ...};
+    the csv has the session information ("info", e.g. osari_data.read_csv_info) on
+    every row after the trial columns, as the extraInfo of the ExperimentHandler"""
+    txt = TXT_HEADER+''.join(TXT_FORMAT % row for row in outputs['txt'])
+    info = info or {}
+    extra = sorted(info)
+    stream = io.StringIO()
+    writer = csv.writer(stream, lineterminator='\n')
+    writer.writerow(list(outputs['csv_columns'])+extra)
+    for row in outputs['csv']:
+        writer.writerow([row[name] for name in outputs['csv_columns']]+[info[name] for name in extra])
+    ssd = ''.join('%r\n' % value for value in outputs['ssd'])
+    return {'.txt': txt, '.csv': stream.getvalue(), '.ssd': ssd}
+
+
+def unlike_recording(trials, outputs):
+    """Number of trials where the replay gives another response or SSD than was recorded"""
+    n = 0
+    for trial, row in zip(trials, outputs['txt']):
+        ssd = np.nan if row[5] == 'NaN' else float(row[5])
+        if row[4] != trial['response'] or not (ssd == trial['ssd'] or (np.isnan(ssd) and np.isnan(trial['ssd']))):
+            n += 1
+    return n
+
+
+def check_session(entry, golden_dir, record=False, frame_dur=FRAME):
+    """Replay one session (an osari_data.session_index entry) and compare it with, or
+    (record=True) store it as, its golden files"""
+    trials = osari_data.read_txt(entry['txt'])
+    info = osari_data.read_csv_info(entry['csv']) if entry['csv'] else {}
+    taskInfo_brief, taskInfo = session_parameters(info)
+    outputs = replay(trials, taskInfo_brief, taskInfo, frame_dur)
+    files = render(outputs, info)
+    result = {'session': entry['session'], 'trials': len(trials), 'unlike_recording': unlike_recording(trials, outputs),
+              'status': 'same', 'diff': ''}
+    for ext, text in files.items():
+        path = os.path.join(golden_dir, entry['session']+ext)
+        if record:
+            with open(path, 'w') as f:
+                f.write(text)
+            result['status'] = 'recorded'
+            continue
+        if not os.path.exists(path):
+            result['status'] = 'new'
+            continue
+        with open(path) as f:
+            golden = f.read()
+        if golden != text:
+            result['status'] = 'different'
+            result['diff'] += ''.join(difflib.unified_diff(golden.splitlines(True), text.splitlines(True),
+                                                           path, 'replay'))
+    return result
+
+
+def _check(args):
+    entry = args[0]
+    try:
+        return check_session(*args)
+    except Exception as err:
+        return {'session': entry['session'], 'trials': 0, 'unlike_recording': 0, 'status': 'error',
+                'diff': '%s: %s\n' % (type(err).__name__, err)}
+
+
+def check_archive(data_dir='data', golden_dir='golden', record=False, frame_dur=FRAME, n_jobs=None):
+    """check_session for every session in "data_dir" with a .txt file, in parallel"""
+    from concurrent.futures import ProcessPoolExecutor
+    if record and not os.path.exists(golden_dir):
+        os.makedirs(golden_dir)
+    jobs = [(entry, golden_dir, record, frame_dur) for entry in osari_data.session_index(data_dir) if entry['txt']]
+    with ProcessPoolExecutor(n_jobs) as pool:
+        return list(pool.map(_check, jobs, chunksize=8))
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+    args = [a for a in sys.argv[1:] if not a.startswith('--')]
+    data_dir = args[0] if args else 'data'
+    golden_dir = args[1] if len(args) > 1 else 'golden'
+    record = '--record' in sys.argv
+    started = time.time()
+    results = check_archive(data_dir, golden_dir, record)
+    for result in results:
+        if result['diff']:
+            print(result['diff'])
+    print('Replayed %s sessions (%s trials) in %.1f s' % (
+        len(results), sum(r['trials'] for r in results), time.time()-started))
+    for status in ('recorded', 'new', 'different', 'error'):
+        sessions = [r['session'] for r in results if r['status'] == status]
+        if sessions:
+            print('  %s: %s' % (status, ', '.join(sessions)))
+    unlike = ['%s (%s)' % (r['session'], r['unlike_recording']) for r in results if r['unlike_recording']]
+    if unlike:
+        print('  trials unlike the recording: %s' % ', '.join(unlike))
+    sys.exit(1 if any(r['status'] in ('different', 'error') for r in results) else 0)